@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批次報表：對很多個帳本資料夾各算一份報表（各類別支出統計、指定月份的預算使用情況、日期範圍內的收支合計），
+以多個行程平行處理，最後合併成一個 JSON 或 CSV 檔。
+
+每個帳本資料夾的後端會自動判斷（有 ledger.db 就是 SQLite，有 transactions_by_month/manifest.json
+就是依月份分檔，其餘讀 transactions.csv 與 budgets.csv），檔案路徑都由資料夾決定，不共用全域設定。
+
+用法範例：
+    python batch_report.py ledgers/alice ledgers/bob --start 2024-01-01 --end 2024-12-31 --output report.json
+    python batch_report.py --root ledgers --start 2024-01-01 --end 2024-12-31 --month 2024-12 --format csv --output report.csv
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import personal_accounting as pa
+
+CSV_FIELDS = ['directory', 'backend', 'status', 'error', 'month', 'total_income', 'total_expense', 'net_balance',
+              'transactions', 'total_expenses', 'top_category', 'over_budget', 'malformed_rows', 'seconds']
+
+
+def _report_one(task):
+    """
+    在工作行程裡處理一個帳本資料夾。task 為 (資料夾, 開始日期, 結束日期, 月份)。
+    stderr 上的警告（例如格式錯誤的紀錄）收進結果的 'warnings'，不會和其他行程的輸出混在一起。
+    """
+    directory, start_date_str, end_date_str, month_str = task
+    captured = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stderr(captured):
+        try:
+            success, data = pa.build_ledger_report(directory, start_date_str, end_date_str, month_str)
+        except Exception as e: # 一個帳本出錯不要拖垮整批
+            success, data = False, f"產生報表時發生未預期錯誤：{str(e)}"
+    result = {
+        'directory': os.path.abspath(directory),
+        'seconds': round(time.perf_counter() - started, 4),
+        'warnings': [line for line in captured.getvalue().splitlines() if line.strip()],
+    }
+    if success:
+        result['report'] = data
+    else:
+        result['error'] = data
+    return result
+
+
+def find_ledger_directories(root):
+    """root 底下（不含更深層）每個子資料夾當作一個帳本，依名稱排序。"""
+    with os.scandir(root) as entries:
+        return sorted(entry.path for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+
+
+def run_reports(directories, start_date_str, end_date_str, month_str, workers=None):
+    """
+    平行為每個帳本資料夾產生報表，依 directories 的順序返回 _report_one 的結果列表。
+    workers 為 1 時在目前的行程裡依序處理。
+    """
+    tasks = [(directory, start_date_str, end_date_str, month_str) for directory in directories]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks) or 1))
+    results = []
+    if workers == 1:
+        outputs = map(_report_one, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        # 帳本很多時一次交給每個行程好幾個，減少來回傳遞的次數
+        outputs = pool.map(_report_one, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    try:
+        for index, result in enumerate(outputs, 1):
+            status = '完成' if 'report' in result else f"失敗：{result['error']}"
+            print(f"[{index}/{len(tasks)}] {result['directory']} {status} ({result['seconds']:.2f}s)", file=sys.stderr)
+            results.append(result)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+
+def _csv_row(result):
+    row = {'directory': result['directory'], 'seconds': result['seconds']}
+    if 'error' in result:
+        row.update(status='error', error=result['error'])
+        return row
+    report = result['report']
+    totals = report['range_totals']
+    categories = report['category_summary']['category_summary']
+    row.update(
+        backend=report['backend'],
+        status='ok',
+        month=report['month'],
+        total_income=round(totals['total_income'], 2),
+        total_expense=round(totals['total_expense'], 2),
+        net_balance=round(totals['net_balance'], 2),
+        transactions=totals['count'],
+        total_expenses=round(report['category_summary']['total_expenses'], 2),
+        top_category=categories[0]['category'] if categories else '',
+        over_budget=';'.join(item['category'] for item in report['budget_usage'] if item['percentage_used'] > 100),
+        malformed_rows=report['malformed_rows'],
+    )
+    return row
+
+
+def write_output(results, meta, output_format, output_path=None):
+    """把所有帳本的結果合併寫到 output_path（未指定時印到標準輸出）。"""
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for result in results:
+            writer.writerow(_csv_row(result))
+        output = buffer.getvalue()
+    else:
+        output = json.dumps({'meta': meta, 'ledgers': results}, ensure_ascii=False, indent=2) + '\n'
+
+    if output_path:
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多個帳本的批次報表")
+    parser.add_argument('directories', nargs='*', help="帳本資料夾")
+    parser.add_argument('--root', help="把這個資料夾底下的每個子資料夾都當作一個帳本")
+    parser.add_argument('--start', required=True, help="收支合計的開始日期 (YYYY-MM-DD)")
+    parser.add_argument('--end', required=True, help="收支合計的結束日期 (YYYY-MM-DD)")
+    parser.add_argument('--month', help="預算使用情況的月份 (YYYY-MM，預設為當前月份)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="平行處理的行程數（預設為 CPU 核心數）")
+    parser.add_argument('--format', choices=['json', 'csv'], default='json', help="輸出格式")
+    parser.add_argument('--output', help="合併結果的存檔路徑（預設印到標準輸出）")
+    args = parser.parse_args(argv)
+
+    directories = list(args.directories)
+    if args.root:
+        directories.extend(find_ledger_directories(args.root))
+    if not directories:
+        parser.error("請指定帳本資料夾或 --root。")
+    # 月份在這裡決定好，避免跨過月底時各行程算到不同月份
+    month_str = args.month or datetime.now().strftime('%Y-%m')
+
+    started = time.perf_counter()
+    results = run_reports(directories, args.start, args.end, month_str, args.workers)
+    failed = sum(1 for result in results if 'error' in result)
+    meta = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'start_date': args.start,
+        'end_date': args.end,
+        'month': month_str,
+        'workers': args.workers,
+        'ledgers': len(results),
+        'failed': failed,
+        'seconds': round(time.perf_counter() - started, 4),
+    }
+    write_output(results, meta, args.format, args.output)
+
+    if failed:
+        print(f"有 {failed} 個帳本無法產生報表！", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+記帳本效能測試：產生大型的模擬帳本，量測 personal_accounting 各公開函式的
+執行時間、處理速度與記憶體用量，結果以 JSON 輸出，方便和之前的結果比較。
+
+用法範例：
+    python ledger_bench.py --sizes 10000,100000 --output bench.json
+    python ledger_bench.py --sizes 1000000 --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import personal_accounting as pa
+
+DEFAULT_SIZES = [10000, 100000]
+BENCH_START_DATE = datetime(2020, 1, 1)
+INCOME_CATEGORIES = ['薪水', '獎金', '利息', '二手拍賣']
+EXPENSE_CATEGORIES = ['吃飯', '車錢', '玩樂', '房租', '水電', '日用品', '醫療', '進修', '治裝', '旅遊']
+DESCRIPTIONS = ['早餐', '午餐', '晚餐', '捷運', 'Uber', '電影', '超市', '網購', '', '聚餐', '加油', '咖啡']
+MALFORMED_ROWS = [
+    ['2024-13-45', '100', '支出', '吃飯', '不存在的日期'],
+    ['2024/01/05', '100', '支出', '吃飯', '日期格式不對'],
+    ['2024-01-05', 'abc', '支出', '吃飯', '金額不是數字'],
+    ['2024-01-05', '', '支出', '吃飯', '沒有金額'],
+    ['2024-01-05'],
+]
+
+
+def build_categories(count):
+    """產生 count 個支出類別名稱；超過內建清單的部分以編號補上。"""
+    categories = list(EXPENSE_CATEGORIES[:count])
+    for i in range(len(categories), count):
+        categories.append(f"類別{i + 1:03d}")
+    return categories
+
+
+def generate_ledger(directory, rows, categories=10, malformed_ratio=0.0, days=5 * 365, seed=0):
+    """
+    在 directory 中產生 transactions.csv 與 budgets.csv。
+    交易日期從 BENCH_START_DATE 起依序遞增、分布在 days 天內，約一成為收入；
+    malformed_ratio 為格式錯誤紀錄的比例。返回 (交易紀錄檔路徑, 預算檔路徑)。
+    """
+    rng = random.Random(seed)
+    expense_categories = build_categories(categories)
+    transactions_path = os.path.join(directory, 'transactions.csv')
+    budgets_path = os.path.join(directory, 'budgets.csv')
+
+    with open(transactions_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'amount', 'type', 'category', 'description'])
+        date_strings = [(BENCH_START_DATE + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+        for i in range(rows):
+            if malformed_ratio and rng.random() < malformed_ratio:
+                writer.writerow(rng.choice(MALFORMED_ROWS))
+                continue
+            date_str = date_strings[i * days // rows]
+            if rng.random() < 0.1:
+                writer.writerow([date_str, round(rng.uniform(1000, 60000), 2), '收入', rng.choice(INCOME_CATEGORIES), ''])
+            else:
+                writer.writerow([date_str, round(rng.uniform(10, 3000), 2), '支出', rng.choice(expense_categories), rng.choice(DESCRIPTIONS)])
+
+    with open(budgets_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category', 'budget'])
+        for category in expense_categories:
+            writer.writerow([category, rng.choice([3000, 5000, 10000, 20000])])
+
+    return transactions_path, budgets_path
+
+
+def reset_caches():
+    """清掉帳本引擎、列號索引、日期解析與查詢結果的快取，以及月彙總檔，讓下一次呼叫從頭解析。"""
+    pa._LEDGERS.clear()
+    pa._ROW_READERS.clear()
+    pa.clear_query_cache()
+    pa._parse_date.cache_clear()
+    pa._parse_day.cache_clear()
+    rollups_path = pa._rollups_path(pa.TRANSACTIONS_FILE)
+    if os.path.exists(rollups_path):
+        os.remove(rollups_path)
+
+
+@contextlib.contextmanager
+def _quiet_stderr():
+    """格式錯誤的紀錄會在 stderr 印警告，量測時先關掉。"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        yield
+
+
+def _summarize(name, success, data):
+    if not success:
+        return {'error': data}
+    if name == 'fetch_transactions':
+        return {'transactions': len(data['transactions']), 'net_balance': round(data['net_balance'], 2)}
+    if name == 'get_category_expense_summary':
+        return {'categories': len(data['category_summary']), 'total_expenses': round(data['total_expenses'], 2)}
+    if name == 'get_budget_usage_details':
+        return {'budgets': len(data)}
+    return {'message': data}
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def bench_function(name, func, args, rows):
+    """量測一個查詢函式：冷啟動時間、快取後時間、冷啟動時的記憶體高峰。"""
+    reset_caches()
+    cold_seconds, (success, data) = _timed(func, *args)
+    warm_seconds, _ = _timed(func, *args)
+
+    reset_caches()
+    tracemalloc.start()
+    func(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'cold_seconds': round(cold_seconds, 6),
+        'warm_seconds': round(warm_seconds, 6),
+        'rows_per_second': round(rows / cold_seconds) if cold_seconds > 0 else None,
+        'peak_memory_bytes': peak_bytes,
+        'result': _summarize(name, success, data),
+    }
+
+
+def bench_add_transaction(count, seed=0, buffer_rows=1):
+    """連續新增 count 筆交易（寫入緩衝 buffer_rows 筆），量測每筆平均時間，包含最後寫出緩衝區。"""
+    rng = random.Random(seed)
+    if pa.STORAGE_BACKEND == 'csv':
+        pa.get_monthly_rollups() # 先讓月彙總檔就緒，量到的才是平常記帳時的成本
+    pa.set_write_buffering(max_rows=buffer_rows)
+    started = time.perf_counter()
+    failures = 0
+    for _ in range(count):
+        success, _ = pa.add_transaction_record('2030-01-15', round(rng.uniform(10, 3000), 2), '支出', '吃飯', '效能測試')
+        failures += not success
+    pa.flush_writes()
+    elapsed = time.perf_counter() - started
+    pa.set_write_buffering()
+    return {
+        'count': count,
+        'total_seconds': round(elapsed, 6),
+        'seconds_per_call': round(elapsed / count, 9) if count else None,
+        'calls_per_second': round(count / elapsed) if elapsed > 0 else None,
+        'failures': failures,
+    }
+
+
+def run_size(rows, args):
+    """在暫存目錄產生指定筆數的帳本並跑完所有量測。"""
+    with tempfile.TemporaryDirectory(prefix='ledger_bench_') as directory:
+        started = time.perf_counter()
+        transactions_path, budgets_path = generate_ledger(
+            directory, rows, args.categories, args.malformed_ratio, args.days, args.seed)
+        generate_seconds = time.perf_counter() - started
+
+        pa.TRANSACTIONS_FILE = transactions_path
+        pa.BUDGETS_FILE = budgets_path
+        pa.SQLITE_FILE = os.path.join(directory, 'ledger.db')
+        pa.STORAGE_BACKEND = 'csv'
+        pa.PARALLEL_SCAN_WORKERS = args.scan_workers
+        pa.PARALLEL_SCAN_MIN_BYTES = 0 # 量測時不論檔案大小都平行掃描
+        if args.backend == 'sqlite':
+            with _quiet_stderr():
+                success, message = pa.migrate_csv_to_sqlite()
+            if not success:
+                raise RuntimeError(message)
+            pa.STORAGE_BACKEND = 'sqlite'
+
+        last_day = BENCH_START_DATE + timedelta(days=args.days - 1)
+        month_start = (last_day - timedelta(days=29)).strftime('%Y-%m-%d')
+        year_start = (last_day - timedelta(days=364)).strftime('%Y-%m-%d')
+        last_day_str = last_day.strftime('%Y-%m-%d')
+        export_path = os.path.join(directory, 'export.csv')
+
+        cases = [
+            ('fetch_transactions', pa.fetch_transactions, (month_start, last_day_str)),
+            ('get_category_expense_summary', pa.get_category_expense_summary, ()),
+            ('get_budget_usage_details', pa.get_budget_usage_details, (last_day.strftime('%Y-%m'),)),
+            ('export_transactions_to_csv', pa.export_transactions_to_csv, (year_start, last_day_str, export_path)),
+        ]
+        benchmarks = {}
+        with _quiet_stderr():
+            for name, func, func_args in cases:
+                benchmarks[name] = bench_function(name, func, func_args, rows)
+            benchmarks['add_transaction_record'] = bench_add_transaction(args.add_count, args.seed, args.write_buffer_rows)
+
+        return {
+            'rows': rows,
+            'file_bytes': os.path.getsize(transactions_path),
+            'generate_seconds': round(generate_seconds, 3),
+            'benchmarks': benchmarks,
+        }
+
+
+def compare_results(current, baseline, threshold):
+    """
+    和之前的結果比較冷啟動時間，返回變慢超過 threshold（例如 0.2 表示 20%）的項目清單。
+    """
+    baseline_runs = {run['rows']: run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in current['runs']:
+        previous = baseline_runs.get(run['rows'])
+        if previous is None:
+            continue
+        for name, result in run['benchmarks'].items():
+            key = 'total_seconds' if name == 'add_transaction_record' else 'cold_seconds'
+            before = previous['benchmarks'].get(name, {}).get(key)
+            after = result.get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            print(f"{run['rows']:>10} 筆  {name:<30} {before:>10.4f}s -> {after:>10.4f}s ({change:+.1%})", file=sys.stderr)
+            if change > threshold:
+                regressions.append({'rows': run['rows'], 'benchmark': name, 'before': before, 'after': after, 'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="記帳本效能測試")
+    parser.add_argument('--sizes', default=','.join(str(n) for n in DEFAULT_SIZES),
+                        help="要測試的交易筆數，以逗號分隔（例如 10000,100000,1000000,10000000）")
+    parser.add_argument('--categories', type=int, default=10, help="支出類別數量")
+    parser.add_argument('--malformed-ratio', type=float, default=0.0, help="格式錯誤紀錄的比例，例如 0.01")
+    parser.add_argument('--days', type=int, default=5 * 365, help="交易日期分布的天數")
+    parser.add_argument('--add-count', type=int, default=1000, help="量測 add_transaction_record 時新增的筆數")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv', help="要測試的儲存後端")
+    parser.add_argument('--seed', type=int, default=0, help="亂數種子")
+    parser.add_argument('--write-buffer-rows', type=int, default=1, help="量測新增交易時的寫入緩衝筆數（1 表示每筆立刻寫入）")
+    parser.add_argument('--scan-workers', type=int, default=1, help="平行掃描的行程數（1 表示不用平行掃描）")
+    parser.add_argument('--output', help="結果 JSON 的存檔路徑（預設印到標準輸出）")
+    parser.add_argument('--baseline', help="之前的結果 JSON，會比較並列出變慢的項目")
+    parser.add_argument('--threshold', type=float, default=0.2, help="變慢多少比例以上視為退步（預設 0.2）")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'categories': args.categories,
+            'malformed_ratio': args.malformed_ratio,
+            'days': args.days,
+            'seed': args.seed,
+            'scan_workers': args.scan_workers,
+            'write_buffer_rows': args.write_buffer_rows,
+        },
+        'runs': [],
+    }
+    for rows in sizes:
+        print(f"測試 {rows} 筆交易...", file=sys.stderr)
+        results['runs'].append(run_size(rows, args))
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"有 {len(regressions)} 個項目變慢超過 {args.threshold:.0%}！", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
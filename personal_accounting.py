@@ -1,87 +1,3425 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import atexit
+from array import array
+import bisect
 import csv
+import hashlib
+import heapq
+import io
+import json
+import marshal
+import mmap
 import os
-from datetime import datetime
-from collections import defaultdict
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, wraps
+from itertools import accumulate, islice
 import sys
 
 # 常數設定
 TRANSACTIONS_FILE = 'transactions.csv'
 BUDGETS_FILE = 'budgets.csv'
+SQLITE_FILE = 'ledger.db'
+PARTITIONS_DIR = 'transactions_by_month' # 依月份分檔時，各月份檔與 manifest.json 放在這個資料夾
+STORAGE_BACKEND = os.environ.get('ACCOUNTING_BACKEND', 'csv') # 'csv'、'sqlite' 或 'partitioned'
+MALFORMED_SAMPLE_LIMIT = 20 # 格式錯誤的紀錄最多保留幾筆範例
+TRANSACTION_SORT_KEYS = ('date', 'amount', 'type', 'category', 'description') # 分頁查詢可用的排序欄位
+TREND_PERIODS = ('day', 'week', 'month', 'year') # 趨勢報表可用的時間單位
+# 分組統計可用的維度與統計量；keyword 是描述的第一個詞（以空白分隔），weekday 0 為星期一
+GROUP_DIMENSIONS = ('category', 'type', 'month', 'weekday', 'keyword')
+GROUP_MEASURES = ('sum', 'count', 'mean', 'min', 'max')
+# 平行掃描用幾個行程（1 表示不用）。只在帳本引擎還沒載入、檔案又夠大時才會用，適合跑一次就結束的批次報表
+PARALLEL_SCAN_WORKERS = int(os.environ.get('ACCOUNTING_SCAN_WORKERS', '1'))
+PARALLEL_SCAN_MIN_BYTES = 16 * 1024 * 1024
+ROW_INDEX_CHUNK_BYTES = 8 * 1024 * 1024 # 建列號索引時一次處理多少位元組
+ROW_READ_BATCH = 256 # 逐列讀取（例如由新到舊）時，一次對映檔案讀幾列
+# 新增交易的寫入緩衝（用 set_write_buffering() 調整）：累積幾筆、或第一筆等了幾秒才一起寫入，
+# 以及每次寫入後要不要 fsync。預設每筆立刻寫入。
+WRITE_BUFFER_ROWS = 1
+WRITE_BUFFER_SECONDS = 0.0
+WRITE_FSYNC = False
+BUDGET_LOG_SLACK = 64 # 預算檔裡被蓋掉的舊紀錄超過這麼多筆時就整理一次
+BUDGET_WARNING_PERCENT = 90 # 預算用到這個百分比就提醒（超過 100% 則是超支）
+TRANSACTION_FIELDS = ['date', 'amount', 'type', 'category', 'description', 'id']
+# 修改/刪除交易時不重寫交易紀錄檔，而是在旁邊的 <檔名>_amendments.csv 記一行，讀取時再套用；
+# 累積超過這麼多筆就在背景把修改併回交易紀錄檔
+AMENDMENT_FIELDS = ['op', 'id', 'date', 'amount', 'type', 'category', 'description']
+AMENDMENT_COMPACT_THRESHOLD = 500
+SNAPSHOT_FORMAT = 3 # 帳本快照檔的格式版本，格式改了就加一，舊快照會被當成無效
+# 查詢結果快取的大小上限（估計的位元組數），超過時從最久沒用到的結果開始丟；0 表示不快取
+QUERY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class LedgerError(Exception):
+    """資料檔案本身有問題（格式不符、缺少欄位等），訊息可以直接顯示給使用者。"""
+
+
+class OperationCancelled(BaseException):
+    """
+    操作被使用者取消。繼承 BaseException（和 KeyboardInterrupt 一樣），
+    才不會被各函式「返回 (False, 錯誤訊息)」的 except Exception 攔下來。
+    """
+
+
+# 效能統計：每個公開函式的呼叫次數、耗時，以及掃描/符合/略過的筆數與讀取的位元組數
+_STATS_LOCK = threading.Lock()
+_OPERATION_STATS = {}
+_COUNTER_NAMES = ('rows_scanned', 'rows_matched', 'rows_skipped', 'bytes_read')
+_current_call = threading.local()
+
+
+def _count(counter_name, amount=1):
+    """把計數加到目前這次呼叫的統計上；不在統計中的呼叫就忽略。"""
+    counters = getattr(_current_call, 'counters', None)
+    if counters is not None:
+        counters[counter_name] += amount
+
+
+def _instrumented(func):
+    """記錄函式的耗時與計數器；巢狀呼叫的計數也會算進外層。"""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        outer_counters = getattr(_current_call, 'counters', None)
+        counters = _current_call.counters = defaultdict(int)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_call.counters = outer_counters
+            if outer_counters is not None:
+                for counter_name, value in counters.items():
+                    outer_counters[counter_name] += value
+            failed = isinstance(result, tuple) and bool(result) and result[0] is False
+            _record_operation(name, elapsed, counters, failed)
+
+    return wrapper
+
+
+def run_cancellable(cancel_event, func, *args, **kwargs):
+    """
+    在目前的執行緒執行 func；執行期間只要 cancel_event（threading.Event）被設定，
+    後端的長迴圈就會在下一個檢查點丟出 OperationCancelled。給 GUI 的背景工作使用。
+    """
+    _current_call.cancel_event = cancel_event
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _current_call.cancel_event = None
+
+
+def _check_cancelled():
+    cancel_event = getattr(_current_call, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled("操作已取消。")
+
+
+def _record_operation(name, elapsed, counters, failed):
+    with _STATS_LOCK:
+        stats = _OPERATION_STATS.get(name)
+        if stats is None:
+            stats = _OPERATION_STATS[name] = dict(
+                {'calls': 0, 'failures': 0, 'total_seconds': 0.0, 'max_seconds': 0.0},
+                **{counter_name: 0 for counter_name in _COUNTER_NAMES}
+            )
+        stats['calls'] += 1
+        stats['failures'] += failed
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        for counter_name in _COUNTER_NAMES:
+            stats[counter_name] += counters.get(counter_name, 0)
+        stats['last'] = dict({'seconds': elapsed, 'failed': failed},
+                             **{counter_name: counters.get(counter_name, 0) for counter_name in _COUNTER_NAMES})
+
+
+@lru_cache(maxsize=65536)
+def _parse_date(date_str):
+    """解析 YYYY-MM-DD 日期字串；同一天的紀錄通常很多，所以快取解析結果。"""
+    return datetime.strptime(date_str, '%Y-%m-%d')
+
+
+@lru_cache(maxsize=65536)
+def _parse_day(date_str):
+    """解析日期字串成 date.toordinal() 的整數；同一天的紀錄共用同一個整數物件。"""
+    return _parse_date(date_str).toordinal()
+
+
+@lru_cache(maxsize=65536)
+def _day_date(day):
+    return datetime.fromordinal(day)
+
+
+@lru_cache(maxsize=65536)
+def _day_str(day):
+    return _day_date(day).strftime('%Y-%m-%d')
+
+
+@lru_cache(maxsize=4096)
+def _day_month(day):
+    day_date = _day_date(day)
+    return f"{day_date.year:04d}-{day_date.month:02d}"
+
+
+def _to_cents(amount):
+    """金額轉成整數的「分」；不是有限的數字時丟出 ValueError、TypeError 或 OverflowError。"""
+    return round(float(amount) * 100)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class TransactionRecord:
+    """
+    記憶體中的一筆交易：日期是 date.toordinal() 的整數、金額是整數的「分」，
+    類型、類別、描述都 intern 過，重複的字串只存一份；檔案裡其他欄位放在 extra（沒有時是 None）。
+    一百萬筆只佔每筆一個字串字典的幾分之一記憶體。
+
+    也能當唯讀字典用（row['type']、row.get('category')、dict(row)），
+    其中 'date' 是 YYYY-MM-DD 字串、'amount' 是 float，原本拿 row_dict 的程式照樣能用。
+    """
+
+    __slots__ = ('day', 'cents', 'type', 'category', 'description', 'id', 'extra')
+    FIELDS = ('date', 'amount', 'type', 'category', 'description', 'id')
+
+    def __init__(self, day, cents, trans_type, category, description, transaction_id, extra=None):
+        self.day = day
+        self.cents = cents
+        self.type = trans_type
+        self.category = category
+        self.description = description
+        self.id = transaction_id
+        self.extra = extra
+
+    @classmethod
+    def from_row(cls, row, day, cents, transaction_id, extra_fields=()):
+        """由 csv.DictReader 讀到的 row 建立（字串會 intern）；extra_fields 是要另外保留的非標準欄位。"""
+        extra = {field: row.get(field) for field in extra_fields} if extra_fields else None
+        return cls(day, cents, _intern(row.get('type')), _intern(row.get('category')), _intern(row.get('description')),
+                   transaction_id, extra)
+
+    @property
+    def amount(self):
+        return self.cents / 100
+
+    @property
+    def date(self):
+        return _day_date(self.day)
+
+    def keys(self):
+        return self.FIELDS + tuple(self.extra) if self.extra else self.FIELDS
+
+    def __getitem__(self, field):
+        if field == 'date':
+            return _day_str(self.day)
+        if field == 'amount':
+            return self.cents / 100
+        if field in ('type', 'category', 'description', 'id'):
+            return getattr(self, field)
+        if self.extra and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __contains__(self, field):
+        return field in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def to_dict(self):
+        """轉成一般的字典（給 GUI、匯出或要修改內容的呼叫端）。"""
+        row = {'date': _day_str(self.day), 'amount': self.cents / 100, 'type': self.type,
+               'category': self.category, 'description': self.description, 'id': self.id}
+        if self.extra:
+            row.update(self.extra)
+        return row
+
+    def __repr__(self):
+        return f"TransactionRecord({self.to_dict()!r})"
+
+
+# 全文搜尋的切詞：英數字連在一起的算一個詞，中日韓文字則另外取單字與相鄰兩字
+_SEARCH_RUN_RE = re.compile(r'[0-9a-z\u00c0-\u024f]+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+
+
+def _search_runs(text):
+    """把（已轉小寫的）文字切成 [(是否為中日韓文字, 連續片段), ...]。"""
+    return [(run[0] > '\u024f', run) for run in _SEARCH_RUN_RE.findall(text)]
+
+
+def _index_tokens(text):
+    tokens = set()
+    for is_cjk, run in _search_runs(text.lower()):
+        if is_cjk:
+            tokens.update(run)
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+class _PrefixSums:
+    """
+    依日期累加的前綴和：days 是有紀錄的日期（遞增），columns[k][i] 是 days[:i] 那幾天第 k 個值的累計。
+    任意日期範圍的合計就是兩次二分搜尋後相減，和範圍內有幾筆無關。值都是整數（金額用分），相減不會有浮點誤差。
+    只能在尾端（不早於最後一天）累加，其他變動要整份重建。
+    """
+
+    __slots__ = ('days', 'columns')
+
+    def __init__(self, width):
+        self.days = array('l') # date.toordinal()
+        self.columns = [array('q', [0]) for _ in range(width)]
+
+    def add(self, day, values):
+        if self.days and day == self.days[-1]:
+            for column, value in zip(self.columns, values):
+                column[-1] += value
+        else:
+            self.days.append(day)
+            for column, value in zip(self.columns, values):
+                column.append(column[-1] + value)
+
+    def between(self, start_day, end_day):
+        lo = bisect.bisect_left(self.days, start_day)
+        hi = bisect.bisect_right(self.days, end_day)
+        return [column[hi] - column[lo] for column in self.columns]
+
+
+class _LedgerColumns:
+    """
+    帳本的欄式檢視：依日期排序、不含已刪除的紀錄，每個欄位一個 array。
+    類別、類型、關鍵字存成代碼，values[維度][代碼] 是原本的字串；分組統計時整欄切片後一起走，
+    不必每筆都去翻 row 字典。
+    """
+
+    __slots__ = ('days', 'months', 'amounts', 'codes', 'values')
+
+    def __init__(self, records, positions):
+        self.days = array('l') # date.toordinal()
+        self.months = array('l') # 年 * 12 + 月 - 1
+        self.amounts = array('q') # 分
+        self.codes = {dimension: array('l') for dimension in ('category', 'type', 'keyword')}
+        code_maps = {dimension: {} for dimension in self.codes}
+        for i, position in enumerate(positions):
+            if not i & 0x3FFF:
+                _check_cancelled()
+            record = records[position]
+            if record is None:
+                continue
+            record_date = _day_date(record.day)
+            self.days.append(record.day)
+            self.months.append(record_date.year * 12 + record_date.month - 1)
+            self.amounts.append(record.cents)
+            description = (record.description or '').split(None, 1)
+            for dimension, value in (('category', record.category or "未分類"), ('type', record.type),
+                                     ('keyword', description[0] if description else '')):
+                code_map = code_maps[dimension]
+                code = code_map.get(value)
+                if code is None:
+                    code = code_map[value] = len(code_map)
+                self.codes[dimension].append(code)
+        self.values = {dimension: list(code_map) for dimension, code_map in code_maps.items()}
+
+    def group(self, dimensions, start_date=None, end_date=None, trans_type=None, extremes=False):
+        """依 dimensions 分組，返回 {維度值的 tuple: [總額, 筆數, 最小值, 最大值]}（金額都是分）；extremes 為 False 時不算最小、最大值。"""
+        lo = bisect.bisect_left(self.days, start_date.toordinal()) if start_date else 0
+        hi = bisect.bisect_right(self.days, end_date.toordinal()) if end_date else len(self.days)
+        key_columns = []
+        for dimension in dimensions:
+            if dimension == 'month':
+                key_columns.append(self.months[lo:hi])
+            elif dimension == 'weekday':
+                key_columns.append([(day - 1) % 7 for day in self.days[lo:hi]])
+            else:
+                key_columns.append(self.codes[dimension][lo:hi])
+        keys = zip(*key_columns) if key_columns else [()] * (hi - lo)
+        rows = zip(keys, self.amounts[lo:hi])
+        if trans_type is not None:
+            if trans_type not in self.values['type']:
+                return {}
+            type_code = self.values['type'].index(trans_type)
+            rows = (row for row, code in zip(rows, self.codes['type'][lo:hi]) if code == type_code)
+
+        stats = {}
+        for i, (key, amount) in enumerate(rows):
+            if not i & 0x3FFF:
+                _check_cancelled()
+            entry = stats.get(key)
+            if entry is None:
+                stats[key] = [amount, 1, amount, amount]
+            else:
+                entry[0] += amount
+                entry[1] += 1
+                if extremes:
+                    if amount < entry[2]:
+                        entry[2] = amount
+                    elif amount > entry[3]:
+                        entry[3] = amount
+        _count('rows_scanned', hi - lo)
+
+        decoders = []
+        for dimension in dimensions:
+            if dimension == 'month':
+                decoders.append(lambda code: f"{code // 12:04d}-{code % 12 + 1:02d}")
+            elif dimension == 'weekday':
+                decoders.append(None)
+            else:
+                decoders.append(self.values[dimension].__getitem__)
+        return {tuple(value if decode is None else decode(value) for decode, value in zip(decoders, key)): entry
+                for key, entry in stats.items()}
+
+
+class LedgerEngine:
+    """
+    帳本引擎：把交易紀錄檔解析一次後保存在記憶體中。
+    每次使用前會比對檔案大小與修改時間，檔案有變動才重新載入；
+    如果只是在檔尾新增資料，就只解析新增的那一段。
+    修改紀錄檔（_amendments.csv）裡的修改與刪除也在這裡套用，上層讀到的都是改過的結果。
+    每筆紀錄都有編號（record.id）：檔案有 id 欄位就用它，舊檔案沒有的話以「r+第幾筆」當編號。
+    紀錄以 TransactionRecord 保存，日期索引與每日合計也都用 date.toordinal() 的整數。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.fieldnames = None
+        self.records = [] # [TransactionRecord, ...]，只收錄日期與金額都有效的紀錄；被刪除或改到別天的是 None
+        self.tombstones = 0 # records 中 None 的數量
+        self._id_positions = {} # 交易編號 -> records 中的位置
+        self._row_count = 0 # 已讀過的資料列數（含格式錯誤的），舊檔案用來產生編號
+        self.amended_ids = set() # 被修改或刪除過的編號
+        self.amendment_count = 0
+        self._amend_offset = 0
+        self.malformed_count = 0
+        self.malformed_by_kind = defaultdict(int) # 'missing_field' / 'bad_date' / 'bad_amount' → 筆數
+        self.malformed_samples = [] # 最多 MALFORMED_SAMPLE_LIMIT 筆範例
+        self._date_keys = array('l') # 依日期排序的索引：日期（toordinal）與對應的 records 位置
+        self._date_positions = array('l')
+        self.monthly_rollups = {} # {'YYYY-MM': {(類別, 類型): [總額（分）, 筆數]}}
+        self.daily_totals = {} # {date.toordinal(): {(類別, 類型): [總額（分）, 筆數]}}，前綴和索引從這裡建
+        self._prefix = None # (整體的 _PrefixSums, {類別: 支出的 _PrefixSums})；None 表示下次查詢時重建
+        self._views = {} # 分頁查詢用的排序結果快取，檔案一變動就清掉
+        self._columns = None # 分組統計用的 _LedgerColumns，檔案一變動就清掉
+        self._search_index = None # 全文搜尋的倒排索引：詞 -> records 位置串列；第一次搜尋時才建立，之後隨新增的紀錄更新
+        self._search_words = [] # 索引裡出現過的英數字詞，找含有某段字的詞時逐一比對
+        self.signature = None # (檔案大小, 修改時間)
+        self._offset = None # 已解析到的位元組位置；None 表示下次必須整份重新載入
+        self._tail_marker = b''
+
+    def has_fields(self, required_fields):
+        return bool(self.fieldnames) and all(field in self.fieldnames for field in required_fields)
+
+    def iter_records_between(self, start_date, end_date):
+        """用二分搜尋找到日期範圍的起點後逐筆產生紀錄，依日期排序（同一天維持檔案中的順序）。"""
+        lo = bisect.bisect_left(self._date_keys, start_date.toordinal())
+        hi = bisect.bisect_right(self._date_keys, end_date.toordinal())
+        records = self.records
+        positions = self._date_positions
+        for i in range(lo, hi):
+            if not i & 0x3FFF:
+                _check_cancelled()
+            record = records[positions[i]]
+            if record is not None:
+                yield record
+
+    def live_records(self):
+        """依檔案順序產生目前有效（沒被刪除）的紀錄。"""
+        if not self.tombstones:
+            return iter(self.records)
+        return (record for record in self.records if record is not None)
+
+    def find(self, transaction_id):
+        """依編號找紀錄，返回 TransactionRecord 或 None。"""
+        position = self._id_positions.get(transaction_id)
+        return None if position is None else self.records[position]
+
+    def sorted_view(self, start_date, end_date, sort_key='date', descending=False, keyword=None):
+        """
+        返回 (positions, 總收入, 總支出)（金額是分）：positions 是日期範圍內的紀錄在 records 中的位置，
+        依 sort_key 排序（其他欄位相同時維持日期順序）；有 keyword 時只留下搜尋得到的紀錄。
+        結果會保留到檔案下次變動為止，翻頁時只要切片，不必每次重新排序。
+        """
+        with self._lock:
+            lo = bisect.bisect_left(self._date_keys, start_date.toordinal())
+            hi = bisect.bisect_right(self._date_keys, end_date.toordinal())
+            view_key = (lo, hi, sort_key, descending, keyword)
+            view = self._views.get(view_key)
+            if view is not None:
+                return view
+
+            records = self.records
+            if keyword:
+                positions = self.search_positions(keyword, start_date, end_date)
+            else:
+                positions = self._date_positions[lo:hi].tolist()
+                if self.tombstones:
+                    positions = [position for position in positions if records[position] is not None]
+            income_cents = expense_cents = 0
+            for i, position in enumerate(positions):
+                if not i & 0x3FFF:
+                    _check_cancelled()
+                record = records[position]
+                if record.type == '收入':
+                    income_cents += record.cents
+                elif record.type == '支出':
+                    expense_cents += record.cents
+            _count('rows_scanned', len(positions))
+
+            if sort_key == 'amount':
+                positions.sort(key=lambda position: records[position].cents, reverse=descending)
+            elif sort_key != 'date':
+                positions.sort(key=lambda position: getattr(records[position], sort_key) or '', reverse=descending)
+            elif descending:
+                positions.reverse()
+
+            if len(self._views) >= 8: # 只留最近幾種查詢，免得佔太多記憶體
+                self._views.clear()
+            view = self._views[view_key] = (positions, income_cents, expense_cents)
+            return view
+
+    def range_totals(self, start_date, end_date):
+        """
+        返回日期範圍內的 (總收入, 總支出, 筆數, {類別: 支出})，金額都是整數的分。
+        用每日累計的前綴和索引回答，不必逐筆掃描範圍內的紀錄。
+        """
+        with self._lock:
+            if self._prefix is None:
+                self._build_prefix()
+            overall, by_category = self._prefix
+            start_day, end_day = start_date.toordinal(), end_date.toordinal()
+            total_income, total_expense, count = overall.between(start_day, end_day)
+            category_expenses = {}
+            for category, sums in by_category.items():
+                spent, category_count = sums.between(start_day, end_day)
+                if category_count:
+                    category_expenses[category] = spent
+            _count('rows_matched', count)
+            return total_income, total_expense, count, category_expenses
+
+    def search_positions(self, query, start_date=None, end_date=None):
+        """
+        找出描述或類別含有 query 裡每一個詞（以空白分隔，不分大小寫）的紀錄，返回依日期排序的 records 位置。
+        先用倒排索引找出候選（英數字找含有這段字的詞，例如 'ber' 也會找到 uber；中文比對相鄰兩字），
+        再逐筆確認真的含有整個詞。和 SQLite 後端一樣是子字串比對。
+        """
+        with self._lock:
+            if self._search_index is None:
+                self._build_search_index()
+            index = self._search_index
+            terms = query.lower().split()
+            candidates = None
+            for term in terms:
+                for is_cjk, run in _search_runs(term):
+                    if is_cjk:
+                        grams = [run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)]
+                        matched_sets = [set(index.get(gram, ())) for gram in grams]
+                    else:
+                        # 不同的詞通常遠比紀錄少，逐一比對詞比逐筆比對紀錄快得多
+                        matched = set()
+                        for word in self._search_words:
+                            if run in word:
+                                matched.update(index[word])
+                        matched_sets = [matched]
+                    for matched in matched_sets:
+                        candidates = matched if candidates is None else candidates & matched
+                    if not candidates:
+                        return []
+            if candidates is None:
+                # 查詢裡沒有可以查索引的字（例如只有標點符號），只好逐筆比對日期範圍內的紀錄
+                lo = bisect.bisect_left(self._date_keys, start_date.toordinal()) if start_date else 0
+                hi = bisect.bisect_right(self._date_keys, end_date.toordinal()) if end_date else len(self._date_keys)
+                candidates = self._date_positions[lo:hi]
+
+            start_day = start_date.toordinal() if start_date else None
+            end_day = end_date.toordinal() if end_date else None
+            records = self.records
+            results = []
+            for position in candidates:
+                record = records[position]
+                if record is None:
+                    continue
+                if (start_day and record.day < start_day) or (end_day and record.day > end_day):
+                    continue
+                description = (record.description or '').lower()
+                category = (record.category or '').lower()
+                if all(term in description or term in category for term in terms):
+                    results.append(position)
+            _count('rows_scanned', len(candidates))
+            # 同一天的紀錄在日期索引裡是依加入的先後（也就是位置）排列
+            results.sort(key=lambda position: (records[position].day, position))
+            return results
+
+    def _build_search_index(self):
+        self._search_index = {}
+        self._search_words = []
+        for position, record in enumerate(self.records):
+            if not position & 0x3FFF:
+                _check_cancelled()
+            if record is not None:
+                self._index_text(position, record)
+
+    def _index_text(self, position, record):
+        for token in _index_tokens(f"{record.description or ''} {record.category or ''}"):
+            postings = self._search_index.get(token)
+            if postings is None:
+                postings = self._search_index[token] = []
+                if token[0] <= '\u024f':
+                    self._search_words.append(token)
+            if not postings or postings[-1] != position:
+                postings.append(position)
+
+    def columns(self):
+        """取得欄式檢視（需要時才建立，檔案變動後的第一次呼叫會重建）。"""
+        with self._lock:
+            if self._columns is None:
+                self._columns = _LedgerColumns(self.records, self._date_positions)
+            return self._columns
+
+    def _build_prefix(self):
+        self._prefix = (_PrefixSums(3), {})
+        for day in sorted(self.daily_totals):
+            for (category, trans_type), (total, count) in self.daily_totals[day].items():
+                self._add_to_prefix(day, category, trans_type, total, count)
+        _count('rows_scanned', len(self.daily_totals))
+
+    def _add_to_prefix(self, day, category, trans_type, cents, count):
+        overall, by_category = self._prefix
+        overall.add(day, (cents if trans_type == '收入' else 0, cents if trans_type == '支出' else 0, count))
+        if trans_type == '支出':
+            sums = by_category.get(category)
+            if sums is None:
+                sums = by_category[category] = _PrefixSums(2)
+            sums.add(day, (cents, count))
+
+    def _add_totals(self, day, cents, trans_type, category, count=1):
+        """更新月彙總與每日合計；照日期順序新增時順便接在前綴和尾端，其他情況等下次查詢再重建。"""
+        _add_to_rollups(self.monthly_rollups, _day_month(day), cents, trans_type, category, count)
+        day_totals = self.daily_totals.setdefault(day, {})
+        key = (category or "未分類", trans_type)
+        bucket = day_totals.setdefault(key, [0, 0])
+        bucket[0] += cents
+        bucket[1] += count
+        if bucket[1] <= 0:
+            del day_totals[key]
+            if not day_totals:
+                del self.daily_totals[day]
+        if self._prefix is not None:
+            days = self._prefix[0].days
+            if count > 0 and (not days or day >= days[-1]):
+                self._add_to_prefix(day, key[0], trans_type, cents, count)
+            else:
+                self._prefix = None
+
+    def refresh(self):
+        """檢查檔案是否變動，必要時重新載入或只讀取新增的部分。"""
+        with self._lock:
+            signature = _file_signature(self.path)
+            if signature == self.signature:
+                return self
+
+            self._views.clear()
+            self._columns = None
+            try:
+                with open(self.path, 'rb') as f:
+                    if self._can_tail(f, signature):
+                        f.seek(self._offset)
+                        self._ingest(f.read(), self._offset)
+                    else:
+                        self._reset()
+                        f.seek(0) # _can_tail 可能已經移動過讀取位置
+                        self._ingest(f.read(), 0)
+                self._load_amendments()
+            except BaseException:
+                # 解析到一半出錯或被取消時，內容可能只更新了一部分，下次整份重新載入
+                self._reset()
+                raise
+            self.signature = signature
+            return self
+
+    def _can_tail(self, f, signature):
+        """
+        交易紀錄檔沒動（只有修改紀錄檔變長），或只是變長、而且先前讀過的結尾沒被改動時，才能只讀新增的部分。
+        大小沒變（或變小）但修改時間變了表示被原地改寫過，要整份重新載入。
+        """
+        if self._offset is None or self.fieldnames is None:
+            return False
+        size, mtime, amend_size, amend_mtime = signature
+        if amend_size < self._amend_offset:
+            return False # 修改紀錄檔變短表示被整理過，交易紀錄檔也一定重寫了
+        if self.signature is not None:
+            if amend_size == self.signature[2] and amend_mtime != self.signature[3]:
+                return False # 修改紀錄檔被原地改寫過
+            if (size, mtime) == self.signature[:2]:
+                return True
+            if size <= self._offset:
+                return False
+        elif size < self._offset: # 剛從快照載入：快照之前的內容已經比對過雜湊
+            return False
+        f.seek(self._offset - len(self._tail_marker))
+        return f.read(len(self._tail_marker)) == self._tail_marker
+
+    def _ingest(self, data, start_offset):
+        if not data and start_offset:
+            return # 只有修改時間變了，內容沒有增加
+        _count('bytes_read', len(data))
+        text = data.decode('utf-8')
+        if start_offset == 0:
+            reader = csv.DictReader(io.StringIO(text, newline=''))
+            self.fieldnames = reader.fieldnames
+        else:
+            reader = csv.DictReader(io.StringIO(text, newline=''), fieldnames=self.fieldnames)
+
+        malformed_before = self.malformed_count
+        date_keys = self._date_keys
+        date_positions = self._date_positions
+        last_day = date_keys[-1] if date_keys else None
+        out_of_order = False
+        if self.has_fields(['date', 'amount']):
+            extra_fields = [field for field in self.fieldnames if field not in TransactionRecord.FIELDS]
+            for line_count, row in enumerate(reader):
+                if not line_count & 0x3FFF:
+                    _check_cancelled()
+                self._row_count += 1
+                try:
+                    day = _parse_day(row['date'])
+                except (ValueError, TypeError) as e:
+                    self._record_malformed('missing_field' if row['date'] is None else 'bad_date', row, e)
+                    continue
+                try:
+                    cents = _to_cents(row['amount'])
+                except (ValueError, TypeError, OverflowError) as e:
+                    self._record_malformed('missing_field' if row['amount'] is None else 'bad_amount', row, e)
+                    continue
+                record = TransactionRecord.from_row(row, day, cents, row.get('id') or f"r{self._row_count}", extra_fields)
+                if record.id in self._id_positions:
+                    self._supersede(record.id)
+                self._id_positions[record.id] = len(self.records)
+                # 先照檔案順序接在日期索引尾端，讀完再一次排序；逐筆插入在日期倒著排的檔案（例如銀行對帳單）會變成 O(n²)
+                if last_day is not None and day < last_day:
+                    out_of_order = True
+                last_day = day
+                date_keys.append(day)
+                date_positions.append(len(self.records))
+                self.records.append(record)
+                self._add_totals(day, cents, record.type, record.category)
+                if self._search_index is not None:
+                    self._index_text(len(self.records) - 1, record)
+
+        if out_of_order:
+            self._sort_date_index()
+
+        # 不再每筆都印警告，整批讀完後只印一行摘要，細節可用 get_ledger_stats() 查
+        skipped = self.malformed_count - malformed_before
+        if skipped:
+            _count('rows_skipped', skipped)
+            print(f"警告：{self.path} 中有 {skipped} 筆格式錯誤的紀錄已略過，可用 get_ledger_stats() 查看明細。", file=sys.stderr)
+
+        # 最後一行沒有換行符號時，可能是寫到一半的資料，下次就整份重新載入比較保險
+        if data.endswith(b'\n'):
+            self._offset = start_offset + len(data)
+            self._tail_marker = data[-64:]
+        else:
+            self._offset = None
+
+    def _supersede(self, transaction_id):
+        """同一個編號在檔案裡又出現一次時，以後面那列為準：前面那列當作刪掉，整理時只會留下一份。"""
+        position = self._id_positions.pop(transaction_id)
+        old = self.records[position]
+        self._add_totals(old.day, -old.cents, old.type, old.category, count=-1)
+        self.records[position] = None
+        self.tombstones += 1
+        self.amended_ids.add(transaction_id)
+
+    def _load_amendments(self):
+        """讀取修改紀錄檔裡還沒套用的部分（只處理完整的行）。"""
+        try:
+            with open(_amendments_path(self.path), 'rb') as f:
+                f.seek(self._amend_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        _count('bytes_read', end)
+        for fields in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')):
+            if fields and fields[0] in ('edit', 'delete'): # 略過標題列
+                self._apply_amendment(fields[0], fields[1], fields[2:])
+        self._amend_offset += end
+
+    def _apply_amendment(self, op, transaction_id, values):
+        position = self._id_positions.get(transaction_id)
+        if position is None:
+            return # 已經刪掉了（例如整理到一半時中斷，修改紀錄被重新套用一次）
+        old = self.records[position]
+        if op == 'edit':
+            row = dict(zip(AMENDMENT_FIELDS[2:], values), id=transaction_id)
+            try:
+                record = TransactionRecord.from_row(row, _parse_day(row['date']), _to_cents(row['amount']), transaction_id)
+            except (ValueError, TypeError, KeyError, OverflowError) as e:
+                self._record_malformed('bad_amendment', row, e)
+                return
+            record.extra = old.extra
+
+        self._add_totals(old.day, -old.cents, old.type, old.category, count=-1)
+        self.amended_ids.add(transaction_id)
+        self.amendment_count += 1
+        if op == 'delete':
+            self.records[position] = None
+            self.tombstones += 1
+            del self._id_positions[transaction_id]
+            return
+
+        if record.day == old.day:
+            self.records[position] = record
+        else:
+            # 換了日期：原位置留空，改接在最後面並重新放進日期索引
+            self.records[position] = None
+            self.tombstones += 1
+            position = self._id_positions[transaction_id] = len(self.records)
+            self._index_date(record.day, position)
+            self.records.append(record)
+        self._add_totals(record.day, record.cents, record.type, record.category)
+        if self._search_index is not None:
+            # 舊的詞留在索引裡也沒關係，搜尋時會再確認一次紀錄的內容
+            self._index_text(position, record)
+
+    def _record_malformed(self, kind, row, error):
+        self.malformed_count += 1
+        self.malformed_by_kind[kind] += 1
+        if len(self.malformed_samples) < MALFORMED_SAMPLE_LIMIT:
+            self.malformed_samples.append({'kind': kind, 'row': dict(row), 'error': str(error)})
+
+    def _sort_date_index(self):
+        # 穩定排序：同一天維持原本（檔案中）的順序
+        keys = self._date_keys
+        positions = self._date_positions
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._date_keys = array('l', [keys[i] for i in order])
+        self._date_positions = array('l', [positions[i] for i in order])
+
+    def _index_date(self, day, position):
+        # 帳通常是照日期記的，大部分情況直接接在索引尾端即可
+        if not self._date_keys or day >= self._date_keys[-1]:
+            self._date_keys.append(day)
+            self._date_positions.append(position)
+        else:
+            i = bisect.bisect_right(self._date_keys, day)
+            self._date_keys.insert(i, day)
+            self._date_positions.insert(i, position)
+
+    def _snapshot_payload(self):
+        """
+        把解析好的內容與彙總編成快照（marshal 格式，不會像 pickle 那樣在載入時執行程式碼）。
+        紀錄拆成一欄一欄：日期、金額各一個 array，類型、類別、描述存成字串表的代碼。
+        """
+        strings = {}
+        days, cents, texts = array('i'), array('q'), array('i')
+        ids = []
+        extras = {}
+        for position, record in enumerate(self.records):
+            if not position & 0x3FFF:
+                _check_cancelled()
+            if record is None:
+                days.append(0) # 沒有日期的序數是 0，拿來表示已刪除
+                cents.append(0)
+                texts.extend((0, 0, 0))
+                ids.append(None)
+                continue
+            days.append(record.day)
+            cents.append(record.cents)
+            texts.extend((strings.setdefault(record.type, len(strings)), strings.setdefault(record.category, len(strings)),
+                          strings.setdefault(record.description, len(strings))))
+            ids.append(record.id)
+            if record.extra:
+                extras[position] = record.extra
+        return marshal.dumps({
+            'fieldnames': self.fieldnames, 'strings': list(strings), 'days': days.tobytes(), 'cents': cents.tobytes(),
+            'texts': texts.tobytes(), 'ids': ids, 'extras': extras, 'row_count': self._row_count,
+            'amended_ids': self.amended_ids, 'amendment_count': self.amendment_count,
+            'malformed_count': self.malformed_count, 'malformed_by_kind': dict(self.malformed_by_kind),
+            'malformed_samples': self.malformed_samples, 'date_keys': self._date_keys.tobytes(),
+            'date_positions': self._date_positions.tobytes(), 'monthly_rollups': self.monthly_rollups,
+            'daily_totals': self.daily_totals, 'offset': self._offset, 'tail_marker': self._tail_marker,
+            'amend_offset': self._amend_offset,
+        })
+
+    def _restore_snapshot(self, payload):
+        """把 _snapshot_payload() 的內容載回來；之後的 refresh() 只需要讀快照之後新增的部分。"""
+        state = marshal.loads(payload)
+        self._reset()
+        strings = [_intern(value) for value in state['strings']]
+        days, cents, texts = array('i'), array('q'), array('i')
+        days.frombytes(state['days'])
+        cents.frombytes(state['cents'])
+        texts.frombytes(state['texts'])
+        ids = state['ids']
+        shared_days = {day: day for day in set(days)} # 同一天的紀錄共用同一個整數物件
+        shared_days[0] = 0
+        records = self.records
+        make_record = TransactionRecord
+        for start in range(0, len(days), 0x4000):
+            _check_cancelled()
+            end = start + 0x4000
+            records.extend(make_record(shared_days[day], amount_cents, strings[type_code], strings[category_code],
+                                       strings[description_code], transaction_id) if day else None
+                           for day, amount_cents, type_code, category_code, description_code, transaction_id in zip(
+                               days[start:end], cents[start:end], texts[3 * start:3 * end:3],
+                               texts[3 * start + 1:3 * end:3], texts[3 * start + 2:3 * end:3], ids[start:end]))
+        for position, extra in state['extras'].items():
+            records[position].extra = extra
+        self.tombstones = records.count(None)
+        self._id_positions = {record.id: position for position, record in enumerate(records) if record is not None}
+        self.fieldnames = state['fieldnames']
+        self._row_count = state['row_count']
+        self.amended_ids = state['amended_ids']
+        self.amendment_count = state['amendment_count']
+        self.malformed_count = state['malformed_count']
+        self.malformed_by_kind.update(state['malformed_by_kind'])
+        self.malformed_samples = state['malformed_samples']
+        self._date_keys.frombytes(state['date_keys'])
+        self._date_positions.frombytes(state['date_positions'])
+        self.monthly_rollups = state['monthly_rollups']
+        self.daily_totals = state['daily_totals']
+        self._offset = state['offset']
+        self._tail_marker = state['tail_marker']
+        self._amend_offset = state['amend_offset']
+
+
+_LEDGERS = {}
+
+
+def get_ledger(path=None):
+    """取得指定交易紀錄檔（預設為 TRANSACTIONS_FILE）的帳本引擎，並確保內容是最新的。"""
+    path = path or TRANSACTIONS_FILE
+    key = os.path.abspath(path)
+    ledger = _LEDGERS.get(key)
+    if ledger is None:
+        ledger = _LEDGERS[key] = LedgerEngine(path)
+    return ledger.refresh()
+
+
+def _ledger_is_loaded(path):
+    """帳本引擎已經載入過這個檔案、而且檔案之後沒有變動。"""
+    ledger = _LEDGERS.get(os.path.abspath(path))
+    return ledger is not None and ledger.signature is not None and ledger.signature == _file_signature(path)
+
+
+def _split_byte_ranges(path, chunks):
+    """
+    把交易紀錄檔（標題列之後）切成大約 chunks 段、每段都從行首開始的位元組範圍。
+    返回 (標題列, [(start, end), ...])。
+    注意：切點只對齊行首，描述欄裡有換行的紀錄可能剛好被切開；
+    parallel_scan 會用各段的引號數檢查，有切在引號裡的就改回逐筆解析。
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        bounds = [len(header)]
+        step = max(1, (size - len(header)) // chunks)
+        for i in range(1, chunks):
+            f.seek(len(header) + i * step - 1)
+            f.readline() # 跳到下一行開頭
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+        bounds.append(size)
+    return header, [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _scan_chunk(path, fieldnames, start, end, date_range):
+    """
+    平行掃描的工作（放在模組最上層，子行程才叫得到）：解析 path 中 [start, end) 這段。
+    返回 ({(月份, 類別, 類型): [分, 筆數]}, 掃描筆數, 格式錯誤筆數, 日期範圍內的 [(段內第幾列, TransactionRecord), ...],
+    讀到的列數, 引號數)；date_range 為 None 時不收集紀錄，只算月彙總。沒有 id 欄位時紀錄的編號先留空，由 parallel_scan 依列號補上。
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    quotes = data.count(b'"')
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8'), newline=''), fieldnames=fieldnames)
+    extra_fields = [field for field in fieldnames if field not in TransactionRecord.FIELDS]
+    first_day, last_day = (date_range[0].toordinal(), date_range[1].toordinal()) if date_range else (None, None)
+    totals = {}
+    matched = []
+    scanned = malformed = rows_read = 0
+    for rows_read, row in enumerate(reader, start=1):
+        try:
+            day = _parse_day(row['date'])
+            cents = _to_cents(row['amount'])
+        except (ValueError, TypeError, OverflowError):
+            malformed += 1
+            continue
+        scanned += 1
+        key = (_day_month(day), row['category'] or "未分類", row['type'])
+        bucket = totals.get(key)
+        if bucket is None:
+            totals[key] = [cents, 1]
+        else:
+            bucket[0] += cents
+            bucket[1] += 1
+        if first_day is not None and first_day <= day <= last_day:
+            matched.append((rows_read, TransactionRecord.from_row(row, day, cents, row.get('id') or None, extra_fields)))
+    return totals, scanned, malformed, matched, rows_read, quotes
+
+
+def parallel_scan(path, date_range=None, workers=None):
+    """
+    用多個行程平行掃描交易紀錄檔：依行切成多段，各段分別解析與彙總後再合併。
+    date_range 為 (開始 datetime, 結束 datetime) 時，另外收集範圍內的紀錄（依日期排序，同一天維持檔案順序）。
+    返回 {'monthly_rollups': 同 get_monthly_rollups 的格式, 'records': list, 'malformed_count': int}；沒有 id 欄位的檔案，
+    紀錄編號和帳本引擎一樣是「r+第幾筆」。
+    有紀錄跨在切點上（描述欄裡有換行）時結果不可靠，返回 None，呼叫端請改用帳本引擎逐筆解析。
+    缺少必要欄位時丟出 LedgerError。
+    """
+    workers = workers or max(PARALLEL_SCAN_WORKERS, 1)
+    header, ranges = _split_byte_ranges(path, workers * 4) # 多切幾段，各行程的工作量比較平均
+    fieldnames = next(csv.reader([header.decode('utf-8')]), [])
+    if not all(field in fieldnames for field in ['date', 'amount', 'type', 'category']):
+        raise LedgerError(f"交易紀錄檔 {path} 格式不正確或缺少必要欄位。")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_scan_chunk, path, fieldnames, start, end, date_range) for start, end in ranges]
+        try:
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                _check_cancelled()
+            partials = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    # 引號數累計到某個切點是奇數，表示那個切點落在引號欄位裡，有紀錄被切成兩半
+    quotes = 0
+    for partial in partials[:-1]:
+        quotes += partial[5]
+        if quotes & 1:
+            return None
+
+    totals = defaultdict(lambda: [0, 0])
+    records = []
+    scanned = malformed = rows_before = 0
+    for chunk_totals, chunk_scanned, chunk_malformed, chunk_records, chunk_rows, _ in partials:
+        for key, (cents, count) in chunk_totals.items():
+            bucket = totals[key]
+            bucket[0] += cents
+            bucket[1] += count
+        scanned += chunk_scanned
+        malformed += chunk_malformed
+        for row_number, record in chunk_records:
+            if record.id is None:
+                record.id = f"r{rows_before + row_number}"
+            records.append(record)
+        rows_before += chunk_rows
+    records.sort(key=lambda record: record.day) # 穩定排序，同一天維持檔案中的順序
+    monthly_rollups = {}
+    for (month, category, trans_type), (cents, count) in totals.items():
+        monthly_rollups.setdefault(month, {})[(category, trans_type)] = [cents, count]
+
+    _count('bytes_read', os.path.getsize(path))
+    _count('rows_scanned', scanned)
+    if malformed:
+        _count('rows_skipped', malformed)
+        print(f"警告：{path} 中有 {malformed} 筆格式錯誤的紀錄已略過。", file=sys.stderr)
+    return {'monthly_rollups': monthly_rollups, 'records': records, 'malformed_count': malformed}
+
+
+# 依列號隨機存取：只記下每一列從檔案的第幾個位元組開始，要哪幾列再從記憶體對映的檔案切出那幾列解析，
+# 翻到第幾頁、看最近記的幾筆都不必用 csv.DictReader 從頭讀起。
+class TransactionRowReader:
+    """
+    以 mmap 依列號讀取交易紀錄檔。reader[i] 是第 i 筆資料列（從 0 起算、依檔案順序）的 TransactionRecord，
+    支援負數索引、切片與 reversed()（最新記的在前）；格式錯誤或已刪除的列是 None，修改過的列是改過的內容，
+    所以列號不會因為刪除而移動。編號規則和帳本引擎相同（舊檔案沒有 id 欄位時是「r+第幾筆」）。
+    列號索引是 array('q')，每列只佔 8 個位元組；檔案只在檔尾新增時只索引新增的部分，被整理（重寫）過就重建。
+    檔案不會一直開著，每次讀取才重新對映，不會擋到整理時的 os.replace（Windows 上開著的檔案不能被取代）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.fieldnames = None
+        self._extra_fields = []
+        self.offsets = array('q') # 每筆資料列的起始位元組位置
+        self._end = 0 # 已索引的最後一列結束的位置
+        self._tail_marker = b''
+        self._amendments = {} # 交易編號 -> 修改後的 TransactionRecord；刪除的是 None
+        self._amend_offset = 0
+        self.signature = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def has_fields(self, required_fields):
+        return bool(self.fieldnames) and all(field in self.fieldnames for field in required_fields)
+
+    def refresh(self):
+        """檔案有變動才更新索引：只在檔尾新增時接著索引新的列，否則整份重建。"""
+        with self._lock:
+            signature = _file_signature(self.path)
+            if signature == self.signature:
+                return self
+            try:
+                with self._mapped() as mm:
+                    if not self._can_tail(mm, signature):
+                        self._reset()
+                    self._index_rows(mm)
+                self._load_amendments()
+            except BaseException:
+                self._reset()
+                raise
+            self.signature = signature
+            return self
+
+    @contextmanager
+    def _mapped(self):
+        with open(self.path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                yield b'' # 空檔案不能 mmap；bytes 的 find/切片用法一樣
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    def _can_tail(self, mm, signature):
+        """規則同 LedgerEngine._can_tail：大小沒變（或變小）但修改時間變了表示被原地改寫過，要整份重建索引。"""
+        if self.fieldnames is None or self.signature is None or len(mm) < self._end:
+            return False
+        size, mtime, amend_size, amend_mtime = signature
+        if amend_size < self._amend_offset:
+            return False # 修改紀錄檔變短表示被整理過，交易紀錄檔也一定重寫了
+        if amend_size == self.signature[2] and amend_mtime != self.signature[3]:
+            return False # 修改紀錄檔被原地改寫過
+        if (size, mtime) == self.signature[:2]:
+            return True
+        if size <= self.signature[0]:
+            return False
+        return mm[self._end - len(self._tail_marker):self._end] == self._tail_marker
+
+    def _index_rows(self, mm):
+        size = len(mm)
+        if self.fieldnames is None:
+            header_end = mm.find(b'\n') + 1
+            if not header_end:
+                return # 連標題列都還沒寫完
+            self.fieldnames = next(csv.reader(io.StringIO(mm[:header_end].decode('utf-8'), newline='')), [])
+            self._extra_fields = [field for field in self.fieldnames if field not in TransactionRecord.FIELDS]
+            self._end = header_end
+
+        offsets = self.offsets
+        position = start = self._end
+        in_quotes = False # 描述欄裡有換行時，一列會跨好幾行
+        while position < size:
+            _check_cancelled()
+            end = mm.rfind(b'\n', position, position + ROW_INDEX_CHUNK_BYTES) + 1
+            if not end: # 這一段裡沒有換行（有一列特別長），找到下一個換行為止
+                end = mm.find(b'\n', position) + 1
+                if not end:
+                    break # 最後一行還沒寫完
+            chunk = mm[position:end]
+            lines = chunk.split(b'\n')
+            lines.pop() # chunk 以換行結尾，最後一段是空的
+            if (not in_quotes and b'"' not in chunk and lines[0] not in (b'', b'\r')
+                    and b'\n\n' not in chunk and b'\n\r\n' not in chunk):
+                # 常見情況：沒有引號也沒有空行，一行就是一列，直接由各行長度累加出起始位置
+                offsets.extend(accumulate([len(line) + 1 for line in lines[:-1]], initial=position))
+            else:
+                line_start = position
+                for line in lines:
+                    if not in_quotes and line not in (b'', b'\r'): # csv.DictReader 會跳過空行，編號也不算它
+                        offsets.append(line_start)
+                        start = line_start
+                    if line.count(b'"') & 1:
+                        in_quotes = not in_quotes
+                    line_start += len(line) + 1
+            position = end
+        if in_quotes: # 最後一列的引號欄位還沒寫完，下次再從這列開始索引
+            offsets.pop()
+            position = start
+        _count('bytes_read', position - self._end)
+        self._end = position
+        self._tail_marker = mm[max(0, position - 64):position]
+
+    def _load_amendments(self):
+        """讀取修改紀錄檔裡還沒讀過的部分；規則同 LedgerEngine._apply_amendment。"""
+        try:
+            with open(_amendments_path(self.path), 'rb') as f:
+                f.seek(self._amend_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        _count('bytes_read', end)
+        for fields in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')):
+            if not fields or fields[0] not in ('edit', 'delete'): # 略過標題列
+                continue
+            transaction_id = fields[1]
+            if transaction_id in self._amendments and self._amendments[transaction_id] is None:
+                continue # 已經刪掉了
+            if fields[0] == 'delete':
+                self._amendments[transaction_id] = None
+                continue
+            row = dict(zip(AMENDMENT_FIELDS[2:], fields[2:]), id=transaction_id)
+            try:
+                self._amendments[transaction_id] = TransactionRecord.from_row(
+                    row, _parse_day(row['date']), _to_cents(row['amount']), transaction_id)
+            except (ValueError, TypeError, KeyError, OverflowError):
+                continue # 格式錯誤的修改不套用，和帳本引擎一樣保留前一次的內容
+        self._amend_offset += end
+
+    def _record(self, mm, index):
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self._end
+        fields = next(csv.reader(io.StringIO(mm[start:end].decode('utf-8'), newline='')), [])
+        row = dict.fromkeys(self.fieldnames)
+        row.update(zip(self.fieldnames, fields))
+        try:
+            record = TransactionRecord.from_row(row, _parse_day(row['date']), _to_cents(row['amount']),
+                                                row.get('id') or f"r{index + 1}", self._extra_fields)
+        except (ValueError, TypeError, KeyError, OverflowError):
+            return None
+        if record.id in self._amendments:
+            amended = self._amendments[record.id]
+            if amended is None:
+                return None
+            record = TransactionRecord(amended.day, amended.cents, amended.type, amended.category,
+                                       amended.description, amended.id, record.extra)
+        return record
+
+    def rows(self, indexes):
+        """一次讀出多個列號（不可為負數）的紀錄，檔案只對映一次。返回 [TransactionRecord 或 None, ...]。"""
+        with self._lock, self._mapped() as mm:
+            records = [self._record(mm, index) for index in indexes]
+        _count('rows_scanned', len(records))
+        return records
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.rows(range(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"列號 {index} 超出範圍（共 {len(self)} 列）。")
+        return self.rows([index])[0]
+
+    def __iter__(self):
+        return self._iter_indexes(range(len(self)))
+
+    def __reversed__(self):
+        return self._iter_indexes(range(len(self) - 1, -1, -1))
+
+    def _iter_indexes(self, indexes):
+        for i in range(0, len(indexes), ROW_READ_BATCH):
+            yield from self.rows(indexes[i:i + ROW_READ_BATCH])
+
+    def latest(self, count):
+        """最近記的 count 筆有效紀錄（最新的在前），略過格式錯誤與已刪除的列。"""
+        return list(islice((record for record in reversed(self) if record is not None), count))
+
+
+_ROW_READERS = {}
+
+
+def get_row_reader(path=None):
+    """取得指定交易紀錄檔（預設為 TRANSACTIONS_FILE）的列號索引，並確保是最新的。"""
+    path = path or TRANSACTIONS_FILE
+    key = os.path.abspath(path)
+    reader = _ROW_READERS.get(key)
+    if reader is None:
+        reader = _ROW_READERS[key] = TransactionRowReader(path)
+    return reader.refresh()
+
+
+# 月彙總：(月份, 類別, 類型) → [總額（整數的分）, 筆數]，另外存一份在交易紀錄檔旁邊，
+# 讓預算查詢不必載入整份交易紀錄。
+def _add_to_rollups(monthly_rollups, month, cents, trans_type, category, count=1):
+    # month 為 'YYYY-MM'；刪除或修改紀錄時以負的金額與 count=-1 扣回去
+    month_rollups = monthly_rollups.setdefault(month, {})
+    key = (category or "未分類", trans_type)
+    bucket = month_rollups.setdefault(key, [0, 0])
+    bucket[0] += cents
+    bucket[1] += count
+    if bucket[1] <= 0:
+        del month_rollups[key]
+
+
+def _rollups_path(transactions_path):
+    return os.path.splitext(transactions_path)[0] + '_rollups.json'
+
+
+def _amendments_path(transactions_path):
+    return os.path.splitext(transactions_path)[0] + '_amendments.csv'
+
+
+def _new_transaction_id():
+    return uuid.uuid4().hex[:16]
+
+
+def _stat_signature(path):
+    """檔案的 (大小, 修改時間)，不存在時是 None。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _file_signature(path):
+    """交易紀錄檔與它的修改紀錄檔的 (大小, 修改時間)，任何一個變了內容就可能不同。"""
+    st = os.stat(path)
+    try:
+        amend_st = os.stat(_amendments_path(path))
+        amend_signature = (amend_st.st_size, amend_st.st_mtime_ns)
+    except FileNotFoundError:
+        amend_signature = (0, 0)
+    return (st.st_size, st.st_mtime_ns) + amend_signature
+
+
+def _read_rollups_file(rollups_path):
+    """讀取彙總檔，返回 (來源檔簽章, 月彙總)；檔案不存在或內容有問題時返回 None。"""
+    try:
+        with open(rollups_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('unit') != 'cents': # 舊版的彙總檔存的是浮點數的元，重建
+            return None
+        monthly_rollups = {
+            month: {(category, trans_type): [total, count] for category, trans_type, total, count in entries}
+            for month, entries in data['months'].items()
+        }
+        return tuple(data['source']), monthly_rollups
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_rollups_file(rollups_path, source_signature, monthly_rollups):
+    data = {
+        'source': list(source_signature),
+        'unit': 'cents',
+        'months': {
+            month: [[category, trans_type, total, count] for (category, trans_type), (total, count) in entries.items()]
+            for month, entries in sorted(monthly_rollups.items())
+        }
+    }
+    tmp_path = rollups_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, rollups_path)
+
+
+def _update_rollups_file(transactions_path, previous_signature, entries):
+    """
+    新增交易後順手更新彙總檔，entries 為 [(datetime, amount, type, category), ...]。
+    彙總檔本來就過期（或不存在）時不處理，等下次查詢時再重建。
+    """
+    rollups_path = _rollups_path(transactions_path)
+    try:
+        stored = _read_rollups_file(rollups_path)
+        if stored is None or stored[0] != previous_signature:
+            return
+        monthly_rollups = stored[1]
+        for transaction_date, amount, trans_type, category in entries:
+            _add_to_rollups(monthly_rollups, transaction_date.strftime('%Y-%m'), _to_cents(amount), trans_type, category)
+        _write_rollups_file(rollups_path, _file_signature(transactions_path), monthly_rollups)
+    except OSError as e:
+        print(f"警告：更新月彙總檔 {rollups_path} 失敗，下次查詢時會重建：{e}", file=sys.stderr)
+
+
+def get_monthly_rollups(path=None):
+    """
+    取得 {'YYYY-MM': {(類別, 類型): [總額（分）, 筆數]}} 形式的月彙總。
+    帳本引擎已載入且是最新狀態時直接用記憶體中的彙總；否則先看彙總檔是否還有效，
+    都不行才載入整份交易紀錄並重寫彙總檔。返回的字典請勿修改。
+    """
+    path = path or TRANSACTIONS_FILE
+    signature = _file_signature(path)
+    ledger = _LEDGERS.get(os.path.abspath(path))
+    if ledger is not None and ledger.signature == signature:
+        return ledger.monthly_rollups
+
+    rollups_path = _rollups_path(path)
+    stored = _read_rollups_file(rollups_path)
+    if stored is not None and stored[0] == signature:
+        return stored[1]
+
+    ledger = get_ledger(path)
+    if not ledger.has_fields(['date', 'type', 'amount', 'category']):
+        raise LedgerError(f"交易紀錄檔 {path} 格式不正確或缺少必要欄位。")
+    _write_rollups_file(rollups_path, ledger.signature, ledger.monthly_rollups)
+    return ledger.monthly_rollups
+
+
+@_instrumented
+def rebuild_monthly_rollups():
+    """
+    從 TRANSACTIONS_FILE 重新計算月彙總並覆寫彙總檔。
+    返回 (success_boolean, message_string)。
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return True, "SQLite 資料庫直接用索引彙總，不需要重算月統計。"
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+    try:
+        if isinstance(storage, PartitionedCsvStorage):
+            paths = [partition.transactions_path for _, partition in storage.partitions()]
+        else:
+            paths = [storage.transactions_path]
+        months = rows = 0
+        for path in paths:
+            _LEDGERS.pop(os.path.abspath(path), None) # 丟掉快取，確實從檔案重新解析
+            ledger = get_ledger(path)
+            if not ledger.has_fields(['date', 'type', 'amount', 'category']):
+                return False, f"交易紀錄檔 {path} 格式不正確或缺少必要欄位。"
+            _write_rollups_file(_rollups_path(path), ledger.signature, ledger.monthly_rollups)
+            months += len(ledger.monthly_rollups)
+            rows += len(ledger.records) - ledger.tombstones
+        return True, f"月彙總重建完成，共 {months} 個月份、{rows} 筆交易。"
+    except Exception as e:
+        return False, f"重建月彙總時發生錯誤：{str(e)}"
+
+
+# 帳本快照：把解析好的帳本存在交易紀錄檔旁邊（<檔名>_snapshot.bin），下次啟動直接載入，不必重新解析。
+# 檔案第一行是 JSON 標頭（格式版本、快照涵蓋到的位元組數與那一段的雜湊），之後是 _snapshot_payload() 的內容。
+# 交易紀錄檔與修改紀錄檔的前段內容和快照當時一樣才算有效；之後新增的部分由 refresh() 接著讀。
+def _snapshot_path(transactions_path):
+    return os.path.splitext(transactions_path)[0] + '_snapshot.bin'
+
+
+def _hash_prefix(path, length):
+    """檔案前 length 個位元組的雜湊；檔案不存在時當成空的。"""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            while length > 0:
+                chunk = f.read(min(length, 1 << 20))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                length -= len(chunk)
+                _check_cancelled()
+    except FileNotFoundError:
+        pass
+    return digest.hexdigest()
+
+
+def _read_snapshot_header(snapshot_path):
+    try:
+        with open(snapshot_path, 'rb') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT or header.get('itemsize') != array('l').itemsize:
+        return None
+    return header
+
+
+def _save_snapshot(ledger):
+    """把帳本引擎存成快照；快照已經是最新的、或檔案最後一行不完整時不存。返回有沒有寫入。"""
+    path = ledger.path
+    snapshot_path = _snapshot_path(path)
+    with ledger._lock:
+        ledger.refresh()
+        if ledger._offset is None or ledger.fieldnames is None:
+            return False
+        stored = _read_snapshot_header(snapshot_path)
+        if stored is not None and stored['source'] == list(ledger.signature):
+            return False
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'itemsize': array('l').itemsize,
+            'source': list(ledger.signature),
+            'offset': ledger._offset,
+            'hash': _hash_prefix(path, ledger._offset),
+            'amend_offset': ledger._amend_offset,
+            'amend_hash': _hash_prefix(_amendments_path(path), ledger._amend_offset),
+        }
+        payload = ledger._snapshot_payload()
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(payload)
+    os.replace(tmp_path, snapshot_path)
+    return True
+
+
+def _load_snapshot(path):
+    """
+    驗證快照後載入到 path 的帳本引擎，返回有沒有用上快照。
+    引擎已經載入過（例如使用者搶先查了一次）時就不用快照。
+    """
+    snapshot_path = _snapshot_path(path)
+    header = _read_snapshot_header(snapshot_path)
+    if header is None:
+        return False
+    amendments_path = _amendments_path(path)
+    try:
+        if os.path.getsize(path) < header['offset']:
+            return False
+        if header['amend_offset'] and os.path.getsize(amendments_path) < header['amend_offset']:
+            return False
+    except OSError:
+        return False
+    if (_hash_prefix(path, header['offset']) != header['hash']
+            or _hash_prefix(amendments_path, header['amend_offset']) != header['amend_hash']):
+        return False
+
+    ledger = _LEDGERS.setdefault(os.path.abspath(path), LedgerEngine(path))
+    with ledger._lock:
+        if ledger.signature is not None:
+            return False
+        try:
+            with open(snapshot_path, 'rb') as f:
+                f.readline()
+                ledger._restore_snapshot(f.read())
+        except OperationCancelled:
+            ledger._reset()
+            raise
+        except (OSError, ValueError, EOFError, TypeError, KeyError) as e:
+            ledger._reset()
+            print(f"警告：帳本快照 {snapshot_path} 無法載入，改為重新解析：{e}", file=sys.stderr)
+            return False
+        ledger.refresh() # signature 是 None，會只讀快照之後新增的資料與修改
+    return True
+
+
+def _snapshot_paths(storage):
+    if isinstance(storage, PartitionedCsvStorage):
+        return [partition.transactions_path for _, partition in storage.partitions()]
+    return [storage.transactions_path]
+
+
+@_instrumented
+def save_ledger_snapshot():
+    """
+    把目前已載入的帳本（依月份分檔時是各個月份檔）存成快照，下次啟動時可用 load_ledger_snapshot() 直接載入。
+    快照已經是最新的就不重寫。SQLite 後端不需要快照。
+    返回 (success_boolean, message_string)。
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return True, "SQLite 資料庫不需要快照。"
+    try:
+        flush_writes()
+        saved = sum(_save_snapshot(ledger) for ledger in list(_LEDGERS.values()) if os.path.exists(ledger.path))
+        return True, f"帳本快照已儲存（更新了 {saved} 個檔案）。"
+    except Exception as e:
+        return False, f"儲存帳本快照時發生錯誤：{str(e)}"
+
+
+@_instrumented
+def load_ledger_snapshot():
+    """
+    啟動時呼叫：有有效的快照就直接載入帳本，之後的第一個查詢不必再解析整份交易紀錄；
+    快照無效或不存在時什麼都不做，查詢時照常解析。
+    返回 (success_boolean, message_string)。
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return True, "SQLite 資料庫不需要快照。"
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return True, "還沒有交易紀錄，不需要載入快照。"
+    try:
+        paths = _snapshot_paths(storage)
+        loaded = sum(_load_snapshot(path) for path in paths)
+        return True, f"已從快照載入 {loaded} 個帳本檔（共 {len(paths)} 個）。"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"載入帳本快照時發生錯誤：{str(e)}"
+
+
+# 儲存層：公開函式只透過 get_storage() 取得的物件讀寫資料，
+# 兩種後端提供相同的方法，換後端時上層函式不用改。
+class CsvStorage:
+    """以 CSV 檔案儲存交易紀錄與預算（預設後端）。"""
+
+    def __init__(self, transactions_path, budgets_path):
+        self.transactions_path = transactions_path
+        self.budgets_path = budgets_path
+        self.location = transactions_path
+
+    def initialize(self):
+        if not os.path.exists(self.transactions_path):
+            with open(self.transactions_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(TRANSACTION_FIELDS)
+        self._initialize_budgets()
+
+    def _initialize_budgets(self):
+        if not os.path.exists(self.budgets_path):
+            with open(self.budgets_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['category', 'budget'])
+
+    def exists(self):
+        return os.path.exists(self.transactions_path)
+
+    def version(self):
+        """內容的版本：交易紀錄檔、修改紀錄檔或預算檔有變動就不同。只看檔案的大小與修改時間，不讀內容。"""
+        return (os.path.abspath(self.transactions_path), _stat_signature(self.transactions_path),
+                _stat_signature(_amendments_path(self.transactions_path)), _stat_signature(self.budgets_path))
+
+    def _use_parallel_scan(self):
+        # 引擎已經載入的話記憶體裡就有資料，不必再掃一次檔案
+        # 有修改紀錄時要靠引擎套用，也不平行掃描
+        return (PARALLEL_SCAN_WORKERS > 1
+                and os.path.getsize(self.transactions_path) >= PARALLEL_SCAN_MIN_BYTES
+                and not os.path.exists(_amendments_path(self.transactions_path))
+                and not _ledger_is_loaded(self.transactions_path))
+
+    def _monthly_rollups(self):
+        """
+        同 get_monthly_rollups，但彙總檔過期而且檔案大到值得平行掃描時，用 parallel_scan 重算並寫回彙總檔，
+        不必在這個行程裡逐筆載入帳本引擎。
+        """
+        path = self.transactions_path
+        if self._use_parallel_scan():
+            signature = _file_signature(path)
+            stored = _read_rollups_file(_rollups_path(path))
+            if stored is not None and stored[0] == signature:
+                return stored[1]
+            scan = parallel_scan(path)
+            # 掃描途中檔案又變了的話，算出來的彙總對不上任何一個版本，交給帳本引擎
+            if scan is not None and _file_signature(path) == signature:
+                try:
+                    _write_rollups_file(_rollups_path(path), signature, scan['monthly_rollups'])
+                except OSError as e:
+                    print(f"警告：寫入月彙總檔失敗，下次查詢時會重建：{e}", file=sys.stderr)
+                return scan['monthly_rollups']
+        return get_monthly_rollups(path)
+
+    def _ledger(self, required_fields):
+        ledger = get_ledger(self.transactions_path)
+        if not ledger.has_fields(required_fields):
+            raise LedgerError(f"交易紀錄檔 {self.transactions_path} 格式不正確或缺少必要欄位。")
+        return ledger
+
+    def append_transactions(self, rows):
+        """
+        rows 為 [(date_str, amount, type, category, desc), ...]，一次附加到檔尾。
+        檔案有 id 欄位時會配發新的交易編號；row 多給第六個值時則沿用該編號。
+        """
+        previous_signature = _file_signature(self.transactions_path) if self.exists() else None
+        with open(self.transactions_path, 'a+', newline='', encoding='utf-8') as f:
+            f.seek(0)
+            fieldnames = next(csv.reader([f.readline()]), None) or TRANSACTION_FIELDS[:5]
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writerows(dict(zip(TRANSACTION_FIELDS, row if len(row) > 5 else tuple(row) + (_new_transaction_id(),)))
+                             for row in rows)
+            if WRITE_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        _update_rollups_file(self.transactions_path, previous_signature,
+                             [(_parse_date(row[0]), row[1], row[2], row[3]) for row in rows])
+
+    def iter_transactions_between(self, start_date, end_date, trans_type=None, category=None):
+        """依日期順序逐筆產生範圍內的 (amount, TransactionRecord)。紀錄為共用物件，請勿修改。"""
+        scan = parallel_scan(self.transactions_path, (start_date, end_date)) if self._use_parallel_scan() else None
+        parallel = scan is not None
+        if parallel:
+            records = scan['records']
+        else:
+            records = self._ledger(['date', 'amount', 'type']).iter_records_between(start_date, end_date)
+        scanned = matched = 0
+        try:
+            for record in records:
+                scanned += 1
+                if trans_type is not None and record.type != trans_type:
+                    continue
+                if category is not None and record.category != category:
+                    continue
+                matched += 1
+                yield record.amount, record
+        finally:
+            if not parallel: # 平行掃描已經算過整份檔案的掃描筆數
+                _count('rows_scanned', scanned)
+            _count('rows_matched', matched)
+
+    def amend_transaction(self, transaction_id, new_row=None):
+        """
+        修改（new_row 為 (date_str, amount, type, category, desc)）或刪除（new_row 為 None）一筆交易。
+        只在修改紀錄檔加一行，交易紀錄檔不動；找不到該編號時丟出 LedgerError。
+        """
+        amendments_path = _amendments_path(self.transactions_path)
+        with _WRITE_LOCK: # 背景整理正在把修改紀錄併回去時，要等它做完再寫，免得這筆被刪掉
+            ledger = self._ledger(['date', 'amount', 'type'])
+            if ledger.find(transaction_id) is None:
+                raise LedgerError(f"找不到編號 {transaction_id} 的交易紀錄。")
+            is_new_file = not os.path.exists(amendments_path)
+            with open(amendments_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if is_new_file:
+                    writer.writerow(AMENDMENT_FIELDS)
+                writer.writerow(['delete', transaction_id] if new_row is None else ['edit', transaction_id] + list(new_row))
+                if WRITE_FSYNC:
+                    f.flush()
+                    os.fsync(f.fileno())
+        if ledger.amendment_count + 1 >= AMENDMENT_COMPACT_THRESHOLD:
+            _compact_in_background(self)
+
+    def compact(self):
+        """
+        把修改紀錄併回交易紀錄檔（舊檔案順便補上 id 欄位，沿用原本的編號），再刪掉修改紀錄檔。
+        格式錯誤的紀錄原樣保留。返回併入的修改筆數。
+        """
+        amendments_path = _amendments_path(self.transactions_path)
+        with _WRITE_LOCK: # 整理期間不讓這個程式寫入新交易
+            ledger = self._ledger(['date', 'amount', 'type'])
+            with ledger._lock:
+                ledger.refresh()
+                if not ledger.amended_ids and 'id' in ledger.fieldnames:
+                    return 0
+                tmp_path = self.transactions_path + '.tmp'
+                with open(self.transactions_path, 'r', newline='', encoding='utf-8') as src, \
+                        open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+                    reader = csv.DictReader(src)
+                    fieldnames = reader.fieldnames + ([] if 'id' in reader.fieldnames else ['id'])
+                    writer = csv.DictWriter(dst, fieldnames=fieldnames, extrasaction='ignore')
+                    writer.writeheader()
+                    written = set() # 同一個編號只寫一次：寫的是套用所有修改後的最新內容
+                    for row_number, row in enumerate(reader, start=1):
+                        transaction_id = row.get('id') or f"r{row_number}"
+                        if transaction_id in written:
+                            continue
+                        if transaction_id in ledger.amended_ids:
+                            record = ledger.find(transaction_id)
+                            if record is None:
+                                continue # 已刪除
+                            row = record.to_dict()
+                        else:
+                            row['id'] = transaction_id
+                        written.add(transaction_id)
+                        writer.writerow(row)
+                    if WRITE_FSYNC:
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                merged = ledger.amendment_count
+                os.replace(tmp_path, self.transactions_path)
+                if os.path.exists(amendments_path):
+                    os.remove(amendments_path)
+            get_monthly_rollups(self.transactions_path) # 順便重新載入並重寫月彙總，下次查詢就不用等
+        return merged
+
+    def page_transactions_between(self, start_date, end_date, offset, limit, sort_key='date', descending=False, keyword=None):
+        """
+        依 sort_key 排序後取出第 offset 筆起的 limit 筆 (amount, TransactionRecord)；有 keyword 時只算搜尋得到的紀錄。
+        返回 (該頁紀錄, 範圍內總筆數, 總收入, 總支出)，金額合計是整數的分。
+        """
+        ledger = self._ledger(['date', 'amount', 'type'])
+        positions, total_income, total_expense = ledger.sorted_view(start_date, end_date, sort_key, descending, keyword)
+        records = ledger.records
+        page = [(records[position].amount, records[position]) for position in positions[offset:offset + limit]]
+        _count('rows_matched', len(page))
+        return page, len(positions), total_income, total_expense
+
+    def _row_reader(self):
+        reader = get_row_reader(self.transactions_path)
+        if not reader.has_fields(['date', 'amount', 'type']):
+            raise LedgerError(f"交易紀錄檔 {self.transactions_path} 格式不正確或缺少必要欄位。")
+        return reader
+
+    def transaction_rows(self, offset, limit, newest_first=True):
+        """
+        依記帳順序（newest_first 時最新的在前）取出第 offset 列起的 limit 列，不必載入整份帳本。
+        返回 ([TransactionRecord 或 None, ...], 總列數)；格式錯誤或已刪除的列是 None。
+        """
+        reader = self._row_reader()
+        indexes = range(len(reader))
+        if newest_first:
+            indexes = indexes[::-1]
+        return reader.rows(indexes[offset:offset + limit]), len(reader)
+
+    def latest_transactions(self, count):
+        """最近記的 count 筆 TransactionRecord（最新的在前），略過格式錯誤與已刪除的紀錄。"""
+        return self._row_reader().latest(count)
+
+    def search_transactions(self, query, start_date=None, end_date=None):
+        """返回描述或類別含有 query 的 [(amount, TransactionRecord), ...]，依日期排序；日期範圍不給就是全部。"""
+        ledger = self._ledger(['date', 'amount', 'type'])
+        records = ledger.records
+        found = [(records[position].amount, records[position]) for position in ledger.search_positions(query, start_date, end_date)]
+        _count('rows_matched', len(found))
+        return found
+
+    def group_totals(self, dimensions, measures=('sum',), start_date=None, end_date=None, trans_type=None):
+        """
+        分組統計，返回 {維度值的 tuple: [總額, 筆數, 最小值, 最大值]}（金額都是整數的分；沒要求 min/max 時後兩個值不一定有意義）。
+        只用到類別、類型、月份，又只要總額、筆數、平均，而且日期範圍是整月時，直接加總月彙總，
+        彙總檔有效的話連交易紀錄檔都不用解析（過期時大檔案用平行掃描重算）；其他情況才用帳本引擎的欄式檢視走一遍。
+        """
+        if (set(dimensions) <= {'category', 'type', 'month'} and set(measures) <= {'sum', 'count', 'mean'}
+                and _covers_whole_months(start_date, end_date)):
+            first = start_date.strftime('%Y-%m') if start_date else None
+            last = end_date.strftime('%Y-%m') if end_date else None
+            stats = {}
+            rows_scanned = 0
+            for month, month_rollups in self._monthly_rollups().items():
+                if (first and month < first) or (last and month > last):
+                    continue
+                rows_scanned += len(month_rollups)
+                for (category, rollup_type), (total, count) in month_rollups.items():
+                    if trans_type is not None and rollup_type != trans_type:
+                        continue
+                    fields = {'category': category, 'type': rollup_type, 'month': month}
+                    entry = stats.setdefault(tuple(fields[dimension] for dimension in dimensions), [0, 0, None, None])
+                    entry[0] += total
+                    entry[1] += count
+            _count('rows_scanned', rows_scanned)
+            _count('rows_matched', sum(entry[1] for entry in stats.values()))
+            return stats
+        extremes = 'min' in measures or 'max' in measures
+        stats = self._ledger(['date', 'amount', 'type']).columns().group(dimensions, start_date, end_date, trans_type, extremes)
+        _count('rows_matched', sum(entry[1] for entry in stats.values()))
+        return stats
+
+    def range_totals(self, start_date, end_date):
+        """返回日期範圍內的 (總收入, 總支出, 筆數, {類別: 支出})，金額都是整數的分，不產生任何一筆紀錄。"""
+        return self._ledger(['date', 'amount', 'type']).range_totals(start_date, end_date)
+
+    def daily_totals_between(self, start_date, end_date):
+        """返回範圍內每天各類別、類型的合計 [(日期, 類別, 類型, 總額（分）, 筆數), ...]，順序不固定。"""
+        ledger = self._ledger(['date', 'amount', 'type'])
+        start_day, end_day = start_date.toordinal(), end_date.toordinal()
+        with ledger._lock:
+            daily = [(_day_date(day), category, trans_type, total, count)
+                     for day, day_totals in ledger.daily_totals.items() if start_day <= day <= end_day
+                     for (category, trans_type), (total, count) in day_totals.items()]
+        _count('rows_scanned', len(ledger.daily_totals))
+        return daily
+
+    def dashboard_totals(self, start_date, end_date, month_str):
+        """
+        總覽畫面要的所有數字一次取齊，返回 (範圍內的 [(amount, TransactionRecord), ...], 總收入, 總支出,
+        各類別總支出, month_str 那個月的各類別支出)，合計都是整數的分。
+        先載入帳本引擎，範圍查詢走日期索引、兩種類別統計都讀同一份記憶體中的月彙總，
+        整份檔案最多只解析一次（不會因為檔案大而改走平行掃描、同一份檔案讀好幾遍）。
+        """
+        self._ledger(['date', 'amount', 'type', 'category'])
+        return _collect_dashboard_totals(self, start_date, end_date, month_str)
+
+    def load_budgets(self):
+        return self._read_budgets()[0]
+
+    def _read_budgets(self):
+        """返回 ({類別: 預算}, 預算檔的資料列數)；只讀不寫，整理預算檔交給 save_budget。"""
+        budgets = {}
+        if not os.path.exists(self.budgets_path):
+            # Consider it not an error, just no budgets set yet. init_csvs ensures file exists with header.
+            return budgets, 0
+
+        with open(self.budgets_path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            # Check for header, though init_csvs should guarantee it
+            if not reader.fieldnames or not all(field in reader.fieldnames for field in ['category', 'budget']):
+                 # If file is empty (only header or nothing), return empty dict
+                if os.stat(self.budgets_path).st_size <= len(','.join(['category', 'budget'])) + 2: # approx header length
+                    return budgets, 0
+                raise LedgerError(f"預算檔 {self.budgets_path} 格式不正確或缺少必要欄位 ('category', 'budget')。")
+
+            row_count = 0
+            for row in reader:
+                row_count += 1
+                try:
+                    category = row['category']
+                    budget_amount = float(row['budget'])
+                    if not category: # Skip rows with empty category
+                        print(f"警告：預算檔中發現沒有類別的預算紀錄：{row}", file=sys.stderr)
+                        continue
+                    budgets[category] = budget_amount # 同一類別出現多次時以後面（較新）的為準
+                except (ValueError, TypeError) as e: # Catch if budget_amount is not a float
+                    print(f"警告：跳過預算檔中格式錯誤的紀錄：{row}, 錯誤：{e}", file=sys.stderr)
+                    continue
+
+        return budgets, row_count
+
+    def save_budget(self, category, budget_amount):
+        # 預算檔當成變更紀錄：只在檔尾加一行，不必重寫整個檔案；讀取時後面的紀錄會蓋過前面的
+        with _WRITE_LOCK: # 整理預算檔時不能有別的預算寫進來，否則會被取代掉
+            self._initialize_budgets()
+            with open(self.budgets_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow([category, budget_amount])
+                if WRITE_FSYNC:
+                    f.flush()
+                    os.fsync(f.fileno())
+            budgets, row_count = self._read_budgets()
+            if row_count > len(budgets) + BUDGET_LOG_SLACK:
+                self._write_budgets(budgets) # 被蓋掉的舊紀錄太多了，整理成每個類別一行
+
+    def _write_budgets(self, budgets):
+        # 暫存檔名每次都不同，就算別的程式同時在整理也不會寫到同一個檔案
+        directory = os.path.dirname(os.path.abspath(self.budgets_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.budgets_path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['category', 'budget']) # Write header first
+                for category_key, budget_val in sorted(budgets.items()): # Write sorted by category
+                    writer.writerow([category_key, budget_val])
+            os.chmod(tmp_path, os.stat(self.budgets_path).st_mode & 0o777) # mkstemp 建的檔案只有自己能讀
+            os.replace(tmp_path, self.budgets_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class PartitionedCsvStorage(CsvStorage):
+    """
+    依月份分檔的 CSV 儲存：directory 裡每個月一個 YYYY-MM.csv，manifest.json 記錄有哪些月份。
+    查詢只打開和日期範圍重疊的月份檔，所以花的時間取決於查多久的資料，而不是全部的歷史。
+    每個月份檔本身就是一般的交易紀錄檔，交給 CsvStorage 處理（各有自己的帳本引擎與月彙總檔）；
+    預算檔和單一檔案時一樣。
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, directory, budgets_path):
+        super().__init__(directory, budgets_path)
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, self.MANIFEST_NAME)
+
+    def initialize(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.manifest_path):
+            self._write_manifest([])
+        self._initialize_budgets()
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def version(self):
+        # 月份檔、修改紀錄檔與 manifest 都是資料夾裡的 .csv / .json；月彙總檔只是快取，不算。
+        # 每次查快取都會呼叫，所以每個檔案只 stat 一次
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.csv') or entry.name == self.MANIFEST_NAME:
+                        st = entry.stat()
+                        entries.append((entry.name, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            pass
+        entries.sort()
+        return os.path.abspath(self.directory), tuple(entries), _stat_signature(self.budgets_path)
+
+    def months(self):
+        """manifest 中記錄的月份（'YYYY-MM'），由舊到新排列。"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return sorted(json.load(f)['months'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise LedgerError(f"月份分檔的索引 {self.manifest_path} 已損毀：{e}")
+
+    def _write_manifest(self, months):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'months': sorted(months)}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _partition(self, month):
+        return CsvStorage(os.path.join(self.directory, f'{month}.csv'), self.budgets_path)
+
+    def partitions(self, start_date=None, end_date=None):
+        """依月份順序產生與日期範圍重疊的 (月份, CsvStorage)，不給範圍就是全部月份。"""
+        first = start_date.strftime('%Y-%m') if start_date else None
+        last = end_date.strftime('%Y-%m') if end_date else None
+        for month in self.months():
+            if (first and month < first) or (last and month > last):
+                continue
+            partition = self._partition(month)
+            if partition.exists(): # manifest 先寫，月份檔可能還沒建立
+                yield month, partition
+
+    def append_transactions(self, rows):
+        rows_by_month = defaultdict(list)
+        for row in rows:
+            rows_by_month[_parse_date(row[0]).strftime('%Y-%m')].append(row)
+        months = self.months()
+        new_months = [month for month in rows_by_month if month not in months]
+        if new_months:
+            # 先更新 manifest 再寫月份檔，中途出錯時最多是 manifest 多列一個空月份
+            self._write_manifest(months + new_months)
+        for month, month_rows in sorted(rows_by_month.items()):
+            partition = self._partition(month)
+            partition.initialize()
+            partition.append_transactions(month_rows)
+
+    def amend_transaction(self, transaction_id, new_row=None):
+        # 從最近的月份找起，通常改的都是最近的帳
+        for month, partition in reversed(list(self.partitions())):
+            if partition._ledger(['date', 'amount', 'type']).find(transaction_id) is None:
+                continue
+            target_month = None if new_row is None else _parse_date(new_row[0]).strftime('%Y-%m')
+            if target_month is None or target_month == month:
+                partition.amend_transaction(transaction_id, new_row)
+                return
+            # 改到別的月份：先放進新月份（沿用編號）再從原月份刪掉，中途出錯頂多重複不會遺失
+            target = self._partition(target_month)
+            target_ledger = target._ledger(['date', 'amount', 'type']) if target.exists() else None
+            if target_ledger is not None and target_ledger.find(transaction_id) is not None:
+                target.amend_transaction(transaction_id, new_row) # 新月份已經有這筆了，改它就好，不要再多一列
+            else:
+                if target_ledger is not None and transaction_id in target_ledger.amended_ids:
+                    # 這筆以前從新月份搬走過，檔案裡還留著那列和它的刪除紀錄；直接接一列同編號的，
+                    # 重新載入時那筆刪除紀錄會把新的這列也刪掉，所以先整理掉舊的那列
+                    target.compact()
+                self.append_transactions([tuple(new_row) + (transaction_id,)])
+            partition.amend_transaction(transaction_id, None)
+            return
+        raise LedgerError(f"找不到編號 {transaction_id} 的交易紀錄。")
+
+    def compact(self):
+        return sum(partition.compact() for _, partition in self.partitions())
+
+    def iter_transactions_between(self, start_date, end_date, trans_type=None, category=None):
+        for _, partition in self.partitions(start_date, end_date):
+            yield from partition.iter_transactions_between(start_date, end_date, trans_type, category)
+
+    def page_transactions_between(self, start_date, end_date, offset, limit, sort_key='date', descending=False, keyword=None):
+        views = []
+        total_count = 0
+        total_income = total_expense = 0
+        for _, partition in self.partitions(start_date, end_date):
+            ledger = partition._ledger(['date', 'amount', 'type'])
+            positions, income, expense = ledger.sorted_view(start_date, end_date, sort_key, descending, keyword)
+            views.append((ledger.records, positions))
+            total_count += len(positions)
+            total_income += income
+            total_expense += expense
+
+        if sort_key == 'date':
+            # 月份之間不會重疊，依序（倒序時反過來）接起來就是排好的結果，直接跳到 offset 所在的月份
+            page = []
+            for records, positions in (reversed(views) if descending else views):
+                if offset >= len(positions):
+                    offset -= len(positions)
+                    continue
+                page.extend((records[position].amount, records[position])
+                            for position in positions[offset:offset + limit - len(page)])
+                offset = 0
+                if len(page) >= limit:
+                    break
+        else:
+            # 各月份已各自排好，合併時只需要走到 offset + limit 為止
+            def sorted_records(records, positions):
+                for position in positions:
+                    record = records[position]
+                    yield (record.cents if sort_key == 'amount' else getattr(record, sort_key) or ''), record
+            merged = heapq.merge(*(sorted_records(records, positions) for records, positions in views),
+                                 key=lambda item: item[0], reverse=descending)
+            page = [(record.amount, record) for _, record in islice(merged, offset, offset + limit)]
+        _count('rows_matched', len(page))
+        return page, total_count, total_income, total_expense
+
+    def transaction_rows(self, offset, limit, newest_first=True):
+        # 月份檔依月份接起來當成一份（newest_first 時從最新的月份倒著排），直接跳到 offset 所在的月份
+        readers = [partition._row_reader() for _, partition in self.partitions()]
+        if newest_first:
+            readers.reverse()
+        page = []
+        for reader in readers:
+            if len(page) >= limit:
+                break
+            if offset >= len(reader):
+                offset -= len(reader)
+                continue
+            indexes = range(len(reader))
+            if newest_first:
+                indexes = indexes[::-1]
+            page.extend(reader.rows(indexes[offset:offset + limit - len(page)]))
+            offset = 0
+        return page, sum(len(reader) for reader in readers)
+
+    def latest_transactions(self, count):
+        # 依月份由新到舊，同一個月份內後記的在前
+        found = []
+        for _, partition in reversed(list(self.partitions())):
+            if len(found) >= count:
+                break
+            found.extend(partition.latest_transactions(count - len(found)))
+        return found
+
+    def search_transactions(self, query, start_date=None, end_date=None):
+        found = []
+        for _, partition in self.partitions(start_date, end_date):
+            found.extend(partition.search_transactions(query, start_date, end_date))
+        return found
+
+    def group_totals(self, dimensions, measures=('sum',), start_date=None, end_date=None, trans_type=None):
+        # 各月份各自統計（整月的走月彙總）後合併；總額、筆數相加，最小、最大值取兩邊比較
+        stats = {}
+        for _, partition in self.partitions(start_date, end_date):
+            for key, entry in partition.group_totals(dimensions, measures, start_date, end_date, trans_type).items():
+                merged = stats.get(key)
+                if merged is None:
+                    stats[key] = list(entry)
+                    continue
+                merged[0] += entry[0]
+                merged[1] += entry[1]
+                if entry[2] is not None:
+                    merged[2] = entry[2] if merged[2] is None else min(merged[2], entry[2])
+                    merged[3] = entry[3] if merged[3] is None else max(merged[3], entry[3])
+        return stats
+
+    def range_totals(self, start_date, end_date):
+        # 整個月都在範圍內的月份直接讀月彙總（彙總檔有效時連月份檔都不用解析），
+        # 只有頭尾沒涵蓋整個月的那兩個月份才載入引擎查前綴和
+        total_income = total_expense = 0
+        count = 0
+        category_expenses = defaultdict(int)
+        for month, partition in self.partitions(start_date, end_date):
+            month_start, month_end = _month_bounds(month)
+            if start_date <= month_start and end_date >= month_end:
+                month_rollups = get_monthly_rollups(partition.transactions_path).get(month, {})
+                for (category, trans_type), (total, rollup_count) in month_rollups.items():
+                    count += rollup_count
+                    if trans_type == '收入':
+                        total_income += total
+                    elif trans_type == '支出':
+                        total_expense += total
+                        category_expenses[category] += total
+                _count('rows_matched', sum(rollup_count for _, rollup_count in month_rollups.values()))
+            else:
+                income, expense, partial_count, partial_categories = partition.range_totals(start_date, end_date)
+                total_income += income
+                total_expense += expense
+                count += partial_count
+                for category, spent in partial_categories.items():
+                    category_expenses[category] += spent
+        return total_income, total_expense, count, dict(category_expenses)
+
+    def daily_totals_between(self, start_date, end_date):
+        daily = []
+        for _, partition in self.partitions(start_date, end_date):
+            daily.extend(partition.daily_totals_between(start_date, end_date))
+        return daily
+
+    def dashboard_totals(self, start_date, end_date, month_str):
+        # 各月份檔的引擎在用到時才各自載入，類別統計本來就只讀月彙總
+        return _collect_dashboard_totals(self, start_date, end_date, month_str)
+
+
+def _month_bounds(month_str):
+    """'YYYY-MM' → (當月第一天, 當月最後一天)。"""
+    month_start = datetime.strptime(month_str, '%Y-%m')
+    next_month = (month_start + timedelta(days=31)).replace(day=1)
+    return month_start, next_month - timedelta(days=1)
+
+
+def _covers_whole_months(start_date, end_date):
+    """日期範圍的頭尾是否剛好落在月初、月底（沒給的那一端視為不限）。"""
+    return ((start_date is None or start_date.day == 1)
+            and (end_date is None or (end_date + timedelta(days=1)).day == 1))
+
+
+def _category_expenses(storage, start_date=None, end_date=None):
+    """{類別: 總支出（分）}。"""
+    stats = storage.group_totals(('category',), ('sum',), start_date, end_date, '支出')
+    return {key[0]: entry[0] for key, entry in stats.items()}
+
+
+def _collect_dashboard_totals(storage, start_date, end_date, month_str):
+    transactions = []
+    total_income = total_expense = 0
+    for amount, row in storage.iter_transactions_between(start_date, end_date):
+        transactions.append((amount, row))
+        if row.type == '收入':
+            total_income += row.cents
+        elif row.type == '支出':
+            total_expense += row.cents
+    return (transactions, total_income, total_expense,
+            _category_expenses(storage), _category_expenses(storage, *_month_bounds(month_str)))
+
+
+_SQLITE_READY = set()
+
+
+class SqliteStorage:
+    """以 SQLite 資料庫（WAL 模式）儲存交易紀錄與預算，彙總直接交給 SQL 的 GROUP BY。"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL DEFAULT '',
+            description TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (category, type);
+        CREATE TABLE IF NOT EXISTS budgets (
+            category TEXT PRIMARY KEY,
+            budget REAL NOT NULL
+        );
+    """
+
+    # 金額欄是 REAL，合計時先逐筆轉成整數的分再加，結果和 CSV 後端一模一樣
+    CENTS = 'CAST(round(amount * 100) AS INTEGER)'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.location = db_path
+
+    def initialize(self):
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+        _SQLITE_READY.add(os.path.abspath(self.db_path))
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    def version(self):
+        # WAL 模式下寫入先進 -wal 檔，兩個都要看
+        return (os.path.abspath(self.db_path), _stat_signature(self.db_path), _stat_signature(self.db_path + '-wal'))
+
+    def _connect(self):
+        if os.path.abspath(self.db_path) not in _SQLITE_READY:
+            self.initialize()
+        conn = sqlite3.connect(self.db_path)
+        # SQLite 內建的 lower() 只轉 ASCII，搜尋時改用 Python 的，讓 É、Ü 這類字母也和 CSV 後端一樣不分大小寫
+        conn.create_function('py_lower', 1, lambda text: text.lower() if isinstance(text, str) else text, deterministic=True)
+        return closing(conn)
+
+    @staticmethod
+    def _insert_transactions(conn, rows):
+        # 日期統一存成補零的 YYYY-MM-DD，字串比較才會等於日期比較
+        conn.executemany(
+            'INSERT INTO transactions (date, amount, type, category, description) VALUES (?, ?, ?, ?, ?)',
+            [(_parse_date(date_str).strftime('%Y-%m-%d'), float(amount), trans_type, category or '', desc or '')
+             for date_str, amount, trans_type, category, desc in rows]
+        )
+
+    def append_transactions(self, rows):
+        with self._connect() as conn, conn:
+            # WAL 模式下 NORMAL 不會損壞資料庫，只是斷電時可能少掉最後幾次寫入
+            conn.execute(f"PRAGMA synchronous = {'FULL' if WRITE_FSYNC else 'NORMAL'}")
+            self._insert_transactions(conn, rows)
+
+    def iter_transactions_between(self, start_date, end_date, trans_type=None, category=None):
+        sql = 'SELECT date, amount, type, category, description, id FROM transactions WHERE date BETWEEN ? AND ?'
+        params = [start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')]
+        if trans_type is not None:
+            sql += ' AND type = ?'
+            params.append(trans_type)
+        if category is not None:
+            sql += ' AND category = ?'
+            params.append(category)
+        # 游標一次只取一筆，連線會保持開啟直到產生器結束
+        matched = 0
+        try:
+            with self._connect() as conn:
+                for date_str, amount, row_type, row_category, desc, row_id in conn.execute(sql + ' ORDER BY date, id', params):
+                    matched += 1
+                    if not matched & 0x3FFF:
+                        _check_cancelled()
+                    yield amount, self._row_record(date_str, amount, row_type, row_category, desc, row_id)
+        finally:
+            _count('rows_scanned', matched)
+            _count('rows_matched', matched)
+
+    @staticmethod
+    def _row_record(date_str, amount, trans_type, category, desc, row_id):
+        return TransactionRecord(_parse_day(date_str), _to_cents(amount), trans_type, category, desc, str(row_id))
+
+    def amend_transaction(self, transaction_id, new_row=None):
+        # 資料庫直接改就好，不需要修改紀錄
+        if not str(transaction_id).isdigit():
+            raise LedgerError(f"找不到編號 {transaction_id} 的交易紀錄。")
+        with self._connect() as conn, conn:
+            if new_row is None:
+                cursor = conn.execute('DELETE FROM transactions WHERE id = ?', (int(transaction_id),))
+            else:
+                date_str, amount, trans_type, category, desc = new_row
+                cursor = conn.execute(
+                    'UPDATE transactions SET date = ?, amount = ?, type = ?, category = ?, description = ? WHERE id = ?',
+                    (_parse_date(date_str).strftime('%Y-%m-%d'), float(amount), trans_type, category or '', desc or '',
+                     int(transaction_id)))
+            if cursor.rowcount == 0:
+                raise LedgerError(f"找不到編號 {transaction_id} 的交易紀錄。")
+
+    def compact(self):
+        return 0
+
+    @staticmethod
+    def _keyword_filter(keyword):
+        """搜尋條件的 SQL 片段與參數：每個詞都要是描述或類別的一部分（子字串，不分大小寫）。"""
+        sql, params = '', []
+        for term in (keyword or '').lower().split():
+            sql += ' AND (instr(py_lower(description), ?) > 0 OR instr(py_lower(category), ?) > 0)'
+            params += [term, term]
+        return sql, tuple(params)
+
+    def search_transactions(self, query, start_date=None, end_date=None):
+        # SQLite 內建的全文索引不會切中文，這裡直接比對字串，靠日期索引縮小範圍
+        keyword_sql, keyword_params = self._keyword_filter(query)
+        bounds = (start_date.strftime('%Y-%m-%d') if start_date else '0000-00-00',
+                  end_date.strftime('%Y-%m-%d') if end_date else '9999-99-99')
+        with self._connect() as conn:
+            found = [(amount, self._row_record(date_str, amount, row_type, row_category, desc, row_id))
+                     for date_str, amount, row_type, row_category, desc, row_id in conn.execute(
+                         'SELECT date, amount, type, category, description, id FROM transactions '
+                         f'WHERE date BETWEEN ? AND ?{keyword_sql} ORDER BY date, id', bounds + keyword_params)]
+        _count('rows_matched', len(found))
+        return found
+
+    def page_transactions_between(self, start_date, end_date, offset, limit, sort_key='date', descending=False, keyword=None):
+        if sort_key not in TRANSACTION_SORT_KEYS:
+            raise LedgerError(f"不支援的排序欄位：{sort_key}")
+        keyword_sql, keyword_params = self._keyword_filter(keyword)
+        bounds = (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) + keyword_params
+        direction = 'DESC' if descending else 'ASC'
+        # 排序欄位相同時和 CSV 後端一樣維持日期順序
+        if sort_key == 'date':
+            order_by = f'date {direction}, id {direction}'
+        else:
+            order_by = f'{sort_key} {direction}, date, id'
+        with self._connect() as conn:
+            total_count, total_income, total_expense = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(CASE WHEN type = '收入' THEN {self.CENTS} END), 0), "
+                f"COALESCE(SUM(CASE WHEN type = '支出' THEN {self.CENTS} END), 0) "
+                f"FROM transactions WHERE date BETWEEN ? AND ?{keyword_sql}", bounds
+            ).fetchone()
+            page = [(amount, self._row_record(date_str, amount, row_type, row_category, desc, row_id))
+                    for date_str, amount, row_type, row_category, desc, row_id in conn.execute(
+                        'SELECT date, amount, type, category, description, id FROM transactions '
+                        f'WHERE date BETWEEN ? AND ?{keyword_sql} ORDER BY {order_by} LIMIT ? OFFSET ?', bounds + (limit, offset))]
+        _count('rows_scanned', total_count)
+        _count('rows_matched', len(page))
+        return page, total_count, total_income, total_expense
+
+    def transaction_rows(self, offset, limit, newest_first=True):
+        # 資料庫裡刪掉的就真的不在了，不會有 None
+        with self._connect() as conn:
+            total_rows = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+            page = [self._row_record(*row) for row in conn.execute(
+                'SELECT date, amount, type, category, description, id FROM transactions '
+                f"ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ? OFFSET ?", (limit, offset))]
+        _count('rows_scanned', len(page))
+        return page, total_rows
+
+    def latest_transactions(self, count):
+        return self.transaction_rows(0, count)[0]
+
+    # 各分組維度在 SQL 裡的寫法；strftime('%w') 的 0 是星期日，轉成和 datetime.weekday() 一樣以星期一為 0
+    GROUP_EXPRESSIONS = {
+        'category': "CASE WHEN category = '' THEN '未分類' ELSE category END",
+        'type': 'type',
+        'month': 'substr(date, 1, 7)',
+        'weekday': "(CAST(strftime('%w', date) AS INTEGER) + 6) % 7",
+        'keyword': "CASE WHEN instr(trim(description), ' ') > 0 "
+                   "THEN substr(trim(description), 1, instr(trim(description), ' ') - 1) ELSE trim(description) END",
+    }
+
+    def group_totals(self, dimensions, measures=('sum',), start_date=None, end_date=None, trans_type=None):
+        key_sql = [self.GROUP_EXPRESSIONS[dimension] for dimension in dimensions]
+        sql = (f"SELECT {''.join(expr + ', ' for expr in key_sql)}"
+               f"SUM({self.CENTS}), COUNT(*), MIN({self.CENTS}), MAX({self.CENTS}) FROM transactions")
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append('date >= ?')
+            params.append(start_date.strftime('%Y-%m-%d'))
+        if end_date is not None:
+            conditions.append('date <= ?')
+            params.append(end_date.strftime('%Y-%m-%d'))
+        if trans_type is not None:
+            conditions.append('type = ?')
+            params.append(trans_type)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if key_sql:
+            sql += ' GROUP BY ' + ', '.join(str(i + 1) for i in range(len(key_sql)))
+        stats = {}
+        with self._connect() as conn:
+            for row in conn.execute(sql, params):
+                if row[-3]: # 沒有任何一筆時 SQL 仍會傳回一列 COUNT(*) = 0
+                    stats[tuple(row[:-4])] = list(row[-4:])
+        _count('rows_matched', sum(entry[1] for entry in stats.values()))
+        return stats
+
+    def range_totals(self, start_date, end_date):
+        total_income = total_expense = 0
+        count = 0
+        category_expenses = {}
+        with self._connect() as conn:
+            for trans_type, category, total, type_count in conn.execute(
+                    f"SELECT type, CASE WHEN category = '' THEN '未分類' ELSE category END AS cat, SUM({self.CENTS}), COUNT(*) "
+                    "FROM transactions WHERE date BETWEEN ? AND ? GROUP BY type, cat",
+                    (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))):
+                count += type_count
+                if trans_type == '收入':
+                    total_income += total
+                elif trans_type == '支出':
+                    total_expense += total
+                    category_expenses[category] = total
+        _count('rows_matched', count)
+        return total_income, total_expense, count, category_expenses
+
+    def daily_totals_between(self, start_date, end_date):
+        with self._connect() as conn:
+            daily = [(_parse_date(date_str), category, trans_type, total, count)
+                     for date_str, category, trans_type, total, count in conn.execute(
+                         f"SELECT date, CASE WHEN category = '' THEN '未分類' ELSE category END AS cat, type, SUM({self.CENTS}), COUNT(*) "
+                         "FROM transactions WHERE date BETWEEN ? AND ? GROUP BY date, cat, type",
+                         (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))]
+        _count('rows_scanned', len(daily))
+        return daily
+
+    def dashboard_totals(self, start_date, end_date, month_str):
+        # 同一個連線、同一個讀取交易裡做完三個查詢，三份數字一定是同一個時間點的資料
+        category_sql = (f"SELECT CASE WHEN category = '' THEN '未分類' ELSE category END AS cat, SUM({self.CENTS}) "
+                        "FROM transactions WHERE type = '支出'")
+        with self._connect() as conn, conn:
+            conn.execute('BEGIN')
+            transactions = [
+                (amount, self._row_record(date_str, amount, row_type, row_category, desc, row_id))
+                for date_str, amount, row_type, row_category, desc, row_id in conn.execute(
+                    'SELECT date, amount, type, category, description, id FROM transactions '
+                    'WHERE date BETWEEN ? AND ? ORDER BY date, id',
+                    (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+            ]
+            category_totals = dict(conn.execute(category_sql + ' GROUP BY cat'))
+            month_totals = dict(conn.execute(category_sql + ' AND date BETWEEN ? AND ? GROUP BY cat',
+                                             (f"{month_str}-01", f"{month_str}-31")))
+        total_income = sum(row.cents for _, row in transactions if row.type == '收入')
+        total_expense = sum(row.cents for _, row in transactions if row.type == '支出')
+        _count('rows_scanned', len(transactions))
+        _count('rows_matched', len(transactions))
+        return transactions, total_income, total_expense, category_totals, month_totals
+
+    def load_budgets(self):
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT category, budget FROM budgets'))
+
+    def save_budget(self, category, budget_amount):
+        with self._connect() as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO budgets (category, budget) VALUES (?, ?)', (category, budget_amount))
+
+
+def get_storage():
+    """
+    依 STORAGE_BACKEND 設定取得目前使用的儲存後端。
+    寫入緩衝區裡還沒寫出去的交易會先寫入，所以拿到的後端一定讀得到剛記的帳；
+    寫不進去時丟出 LedgerError（資料還留在緩衝區，下次再試）。
+    """
+    try:
+        flush_writes()
+    except LedgerError:
+        raise
+    except Exception as e:
+        raise LedgerError(f"緩衝區裡的 {len(_pending_rows)} 筆交易寫入失敗（資料還在記憶體中，下次會再試）：{str(e)}") from e
+    return _open_storage()
+
+
+def _open_storage():
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStorage(SQLITE_FILE)
+    if STORAGE_BACKEND == 'partitioned':
+        return PartitionedCsvStorage(PARTITIONS_DIR, BUDGETS_FILE)
+    return CsvStorage(TRANSACTIONS_FILE, BUDGETS_FILE)
+
+
+# 寫入緩衝區：新增的交易先放在這裡，由 flush_writes() 一次寫進儲存後端
+_WRITE_LOCK = threading.RLock()
+_pending_rows = []
+_flush_timer = None
+
+
+def set_write_buffering(max_rows=1, max_delay=0.0, fsync=False):
+    """
+    設定新增交易的寫入方式：緩衝區累積到 max_rows 筆、或第一筆已經等了 max_delay 秒（0 表示不限時間），
+    就一次寫進儲存後端。max_rows=1 表示每筆立刻寫入（預設）。
+    fsync=True 時每次寫入後都要求作業系統確實寫到磁碟（比較慢，但斷電也不會少資料）。
+    不論怎麼設定，任何查詢之前、程式結束時、呼叫 flush_writes() 時都會先把緩衝區寫出去。
+    """
+    global WRITE_BUFFER_ROWS, WRITE_BUFFER_SECONDS, WRITE_FSYNC
+    if max_rows < 1 or max_delay < 0:
+        raise ValueError("max_rows 至少要是 1，max_delay 不能是負數。")
+    with _WRITE_LOCK:
+        flush_writes()
+        WRITE_BUFFER_ROWS = max_rows
+        WRITE_BUFFER_SECONDS = max_delay
+        WRITE_FSYNC = fsync
+
+
+def flush_writes():
+    """
+    把緩衝區裡的交易一次寫進儲存後端，返回寫入的筆數。
+    寫入失敗時資料會留在緩衝區（下次再試），並丟出原本的例外。
+    """
+    global _flush_timer
+    with _WRITE_LOCK:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        if not _pending_rows:
+            return 0
+        storage = _open_storage()
+        # 預算提醒的累計值在交易放進緩衝區時就加過了；寫出去之前是最新的，寫出去之後也還是
+        tracker_current = _budget_tracker['version'] is not None and _budget_tracker['version'] == storage.version()
+        try:
+            storage.append_transactions(_pending_rows)
+        finally:
+            _note_ledger_write() # 寫到一半失敗時檔案也可能已經變了
+        if tracker_current:
+            _budget_tracker['version'] = storage.version()
+        written = len(_pending_rows)
+        del _pending_rows[:]
+        return written
+
+
+def _flush_quietly():
+    # 計時器和程式結束時用的：沒有人可以回報錯誤，只能印警告
+    try:
+        flush_writes()
+    except Exception as e:
+        print(f"警告：寫入緩衝區裡的 {len(_pending_rows)} 筆交易失敗，資料還在記憶體中：{e}", file=sys.stderr)
+
+
+atexit.register(_flush_quietly)
+
+
+def _append_transactions(rows):
+    """
+    新增交易的寫入路徑：放進緩衝區，達到 WRITE_BUFFER_ROWS 筆就寫出去，否則等計時器。
+    順便檢查有沒有類別因此跨過預算提醒門檻，有的話通知 add_budget_alert_listener() 註冊的函式。
+    """
+    global _flush_timer
+    with _WRITE_LOCK:
+        expense_rows = [row for row in rows if row[2] == '支出']
+        tracking = bool(expense_rows) and _prepare_budget_tracker(expense_rows)
+        _pending_rows.extend(rows)
+        if len(_pending_rows) >= WRITE_BUFFER_ROWS:
+            try:
+                flush_writes()
+            except BaseException:
+                # 呼叫端會收到失敗訊息，這幾筆就不該之後又偷偷寫進去
+                del _pending_rows[len(_pending_rows) - len(rows):]
+                raise
+        elif WRITE_BUFFER_SECONDS > 0 and _flush_timer is None:
+            _flush_timer = threading.Timer(WRITE_BUFFER_SECONDS, _flush_quietly)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+        alerts = _add_budget_spend(expense_rows) if tracking else []
+    # 在鎖外面通知，監聽的函式要查帳或寫入都不會卡住
+    for alert in alerts:
+        for callback in list(_budget_alert_listeners):
+            try:
+                callback(alert)
+            except Exception as e:
+                print(f"警告：預算提醒的處理函式出錯：{e}", file=sys.stderr)
+
+
+# 預算提醒：記住各月份各類別的累計支出，新增支出時直接累加、和預算比較，不必重新掃描帳本。
+# 某個月份第一次用到時才從儲存後端的月彙總取一次；帳本或預算被其他方式改過（修改、刪除、
+# 改預算、其他程式寫入，也就是儲存後端的 version() 變了）就整個重新取。
+_budget_alert_listeners = []
+_budget_tracker = {'version': None, 'budgets': None, 'spent': {}} # spent: {'YYYY-MM': {類別: 支出（分）}}
+
+
+def add_budget_alert_listener(callback):
+    """
+    註冊預算提醒：新增的支出讓某個類別當月的預算使用率達到 BUDGET_WARNING_PERCENT% 或超過 100% 時，
+    呼叫 callback(alert)。alert 為 {'category', 'month', 'budget', 'spent', 'percentage_used', 'level', 'message'}，
+    level 是 'warning'（快用完）或 'over'（超支）；同一個等級只在跨過去的那一筆通知一次。
+    callback 是在寫入的那個執行緒裡呼叫的。
+    """
+    if callback not in _budget_alert_listeners:
+        _budget_alert_listeners.append(callback)
+
+
+def remove_budget_alert_listener(callback):
+    """取消 add_budget_alert_listener() 註冊的函式。"""
+    if callback in _budget_alert_listeners:
+        _budget_alert_listeners.remove(callback)
+
+
+def _budget_alert_level(spent, budget):
+    if budget <= 0:
+        return None
+    percentage_used = spent / budget * 100
+    if percentage_used > 100:
+        return 'over'
+    if percentage_used >= BUDGET_WARNING_PERCENT:
+        return 'warning'
+    return None
+
+
+def _prepare_budget_tracker(expense_rows):
+    """
+    寫入前呼叫（要拿著 _WRITE_LOCK）：確定這些支出所在月份的累計支出都已經取得，返回要不要檢查提醒。
+    取不到資料（例如檔案格式有問題）時只印警告，不能因此擋下記帳。
+    """
+    tracker = _budget_tracker
+    try:
+        if tracker['version'] != _open_storage().version():
+            tracker.update(budgets=None, spent={})
+        if tracker['budgets'] is None:
+            tracker['budgets'] = get_storage().load_budgets()
+        if tracker['budgets']:
+            for month in {_parse_date(row[0]).strftime('%Y-%m') for row in expense_rows}:
+                if month not in tracker['spent']:
+                    storage = get_storage() # 緩衝區裡的交易要先寫出去，累計值才算得到
+                    tracker['spent'][month] = _category_expenses(storage, *_month_bounds(month)) if storage.exists() else {}
+        tracker['version'] = _open_storage().version()
+        return bool(tracker['budgets'])
+    except Exception as e:
+        tracker.update(version=None, budgets=None, spent={})
+        print(f"警告：無法取得預算使用情況，這次不檢查預算提醒：{e}", file=sys.stderr)
+        return False
+
+
+def _add_budget_spend(expense_rows):
+    """寫入後呼叫（要拿著 _WRITE_LOCK）：把新的支出加進累計值，返回跨過門檻的提醒。"""
+    tracker = _budget_tracker
+    budgets = tracker['budgets']
+    alerts = []
+    for date_str, amount, _, category, _ in expense_rows:
+        month = _parse_date(date_str).strftime('%Y-%m')
+        category = category or "未分類"
+        month_spent = tracker['spent'][month]
+        before = month_spent.get(category, 0)
+        after_cents = month_spent[category] = before + _to_cents(amount)
+        budget = budgets.get(category)
+        if budget is None:
+            continue
+        after = after_cents / 100
+        level = _budget_alert_level(after, budget)
+        if level is None or level == _budget_alert_level(before / 100, budget):
+            continue
+        percentage_used = after / budget * 100
+        if level == 'over':
+            message = f"警告！{category} {month} 已超支（{after:.2f} / {budget:.2f}，{percentage_used:.1f}%）！"
+        else:
+            message = f"注意！{category} {month} 快沒錢了（已使用 {percentage_used:.1f}% 的預算）！"
+        alerts.append({'category': category, 'month': month, 'budget': budget, 'spent': after,
+                       'percentage_used': percentage_used, 'level': level, 'message': message})
+    # 自己這次寫入造成的變動已經算進去了，不必重新取
+    tracker['version'] = _open_storage().version()
+    return alerts
+
+
+_compaction_thread = None
+
+
+def _compact_in_background(storage):
+    """修改紀錄累積太多時，在背景執行緒把它併回交易紀錄檔；已經在整理時就不重複啟動。"""
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return
+
+    def compact_quietly():
+        try:
+            storage.compact()
+            _note_ledger_write()
+        except Exception as e:
+            print(f"警告：背景整理修改紀錄失敗，下次再試：{e}", file=sys.stderr)
+
+    # 中途被結束也沒關係：暫存檔整個寫完才會取代原檔，修改紀錄重新套用一次的結果也一樣
+    _compaction_thread = threading.Thread(target=compact_quietly, name='ledger-compaction', daemon=True)
+    _compaction_thread.start()
+
+
+# 查詢結果快取（LRU）：鍵是 (函式名稱, 參數, 帳本版本)。帳本版本由這個程式的寫入次數
+# 和儲存後端的 version()（檔案大小與修改時間）組成，任何寫入之後舊的鍵就不會再被查到，
+# 也就不會拿到過期的結果；用不到的舊結果會依 LRU 順序被擠出去。
+_QUERY_CACHE = OrderedDict() # 鍵 -> (結果, 估計大小)，最近用到的在最後面
+_QUERY_CACHE_LOCK = threading.Lock()
+_query_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+_ledger_generation = 0 # 這個程式寫入帳本（交易或預算）的次數
+
+
+def _note_ledger_write():
+    global _ledger_generation
+    with _QUERY_CACHE_LOCK:
+        _ledger_generation += 1
+
+
+def _approx_size(value):
+    """粗估結果佔的記憶體；很長的串列只量前面幾個再乘上長度，免得估大小比查詢還慢。"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_approx_size(key) + _approx_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)) and value:
+        sample = value[:32]
+        size += sum(_approx_size(item) for item in sample) * len(value) // len(sample)
+    return size
+
+
+def _cached_query(func):
+    """
+    把查詢函式的成功結果放進快取，同樣的參數、帳本也沒變動時直接返回上次的結果。
+    快取的結果是共用物件，呼叫端請勿修改。
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if QUERY_CACHE_MAX_BYTES <= 0:
+            return func(*args, **kwargs)
+        # 版本要在查詢之前取得：查詢途中有新的寫入時，結果只會存在舊版本底下，不會被當成新的
+        try:
+            storage = get_storage() # 順便把寫入緩衝區寫出去
+        except LedgerError:
+            return func(*args, **kwargs) # 寫入緩衝區寫不出去：不快取，由查詢函式自己回報錯誤
+        key = (name, args, tuple(sorted(kwargs.items())), _ledger_generation, storage.version())
+        with _QUERY_CACHE_LOCK:
+            entry = _QUERY_CACHE.get(key)
+            if entry is not None:
+                _QUERY_CACHE.move_to_end(key)
+                _query_cache_stats['hits'] += 1
+                return entry[0]
+            _query_cache_stats['misses'] += 1
+
+        result = func(*args, **kwargs)
+        if not (isinstance(result, tuple) and result and result[0] is True):
+            return result # 失敗的結果不快取
+        size = _approx_size(result)
+        if size > QUERY_CACHE_MAX_BYTES // 4:
+            return result # 太大的結果放進來只會把其他結果全擠掉
+        with _QUERY_CACHE_LOCK:
+            if key not in _QUERY_CACHE:
+                _QUERY_CACHE[key] = (result, size)
+                _query_cache_stats['bytes'] += size
+            while _query_cache_stats['bytes'] > QUERY_CACHE_MAX_BYTES:
+                _, (_, evicted_size) = _QUERY_CACHE.popitem(last=False)
+                _query_cache_stats['bytes'] -= evicted_size
+                _query_cache_stats['evictions'] += 1
+        return result
+
+    return wrapper
+
+
+def get_query_cache_stats():
+    """返回查詢結果快取的統計：{'hits', 'misses', 'evictions', 'entries', 'bytes', 'max_bytes'}。"""
+    with _QUERY_CACHE_LOCK:
+        return dict(_query_cache_stats, entries=len(_QUERY_CACHE), max_bytes=QUERY_CACHE_MAX_BYTES)
+
+
+def clear_query_cache():
+    """清空查詢結果快取（統計數字也歸零）。"""
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE.clear()
+        _query_cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
+
+
+@_instrumented
+def migrate_csv_to_sqlite(db_path=None):
+    """
+    把 TRANSACTIONS_FILE 和 BUDGETS_FILE 的資料一次搬進 SQLite 資料庫（預設為 SQLITE_FILE）。
+    資料庫裡已經有交易紀錄時不會重複搬。
+    返回 (success_boolean, message_string)。
+    """
+    flush_writes()
+    csv_storage = CsvStorage(TRANSACTIONS_FILE, BUDGETS_FILE)
+    sqlite_storage = SqliteStorage(db_path or SQLITE_FILE)
+    if not csv_storage.exists():
+        return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 不存在。"
+
+    try:
+        ledger = csv_storage._ledger(['date', 'amount', 'type', 'category', 'description'])
+        budgets = csv_storage.load_budgets()
+        rows = [(record['date'], record.amount, record.type, record.category, record.description)
+                for record in ledger.live_records()]
+        with sqlite_storage._connect() as conn, conn:
+            if conn.execute('SELECT 1 FROM transactions LIMIT 1').fetchone():
+                return False, f"資料庫 {sqlite_storage.db_path} 裡已經有交易紀錄了，為了避免重複就不搬了。"
+            sqlite_storage._insert_transactions(conn, rows)
+            conn.executemany('INSERT OR REPLACE INTO budgets (category, budget) VALUES (?, ?)', budgets.items())
+        return True, f"搬家完成！共 {len(rows)} 筆交易、{len(budgets)} 筆預算已存進 {sqlite_storage.db_path}。"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"搬移資料到 SQLite 時發生錯誤：{str(e)}"
+
+
+@_instrumented
+def migrate_csv_to_partitions(directory=None):
+    """
+    把 TRANSACTIONS_FILE 的交易紀錄依月份拆進分檔資料夾（預設為 PARTITIONS_DIR），預算檔維持原樣。
+    資料夾裡已經有月份檔時不會重複搬。原本的 TRANSACTIONS_FILE 不會被刪除。
+    返回 (success_boolean, message_string)。
+    """
+    flush_writes()
+    csv_storage = CsvStorage(TRANSACTIONS_FILE, BUDGETS_FILE)
+    partitioned_storage = PartitionedCsvStorage(directory or PARTITIONS_DIR, BUDGETS_FILE)
+    if not csv_storage.exists():
+        return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 不存在。"
+
+    try:
+        ledger = csv_storage._ledger(['date', 'amount', 'type', 'category', 'description'])
+        partitioned_storage.initialize()
+        if partitioned_storage.months():
+            return False, f"資料夾 {partitioned_storage.directory} 裡已經有月份檔了，為了避免重複就不搬了。"
+        # 沿用原本的交易編號，分檔前後同一筆交易的編號不變
+        rows = [(record['date'], record.amount, record.type, record.category, record.description, record.id)
+                for record in ledger.live_records()]
+        partitioned_storage.append_transactions(rows)
+        return True, f"分檔完成！共 {len(rows)} 筆交易，分成 {len(partitioned_storage.months())} 個月份存進 {partitioned_storage.directory}。"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"依月份分檔時發生錯誤：{str(e)}"
+
+
+def get_ledger_stats():
+    """
+    返回效能統計：
+    {'operations': {函式名稱: {'calls', 'failures', 'total_seconds', 'max_seconds', 'rows_scanned', 'rows_matched',
+                               'rows_skipped', 'bytes_read', 'last': 最近一次呼叫的同樣數據}},
+     'malformed_rows': {'total': int, 'by_kind': {錯誤種類: 筆數}, 'samples': [{'kind', 'row', 'error'}, ...]},
+     'query_cache': get_query_cache_stats() 的結果}
+    malformed_rows 為目前已載入的交易紀錄檔（依月份分檔時為各月份檔的合計）中被略過的紀錄，
+    範例最多 MALFORMED_SAMPLE_LIMIT 筆。
+    """
+    with _STATS_LOCK:
+        operations = {name: dict(stats, last=dict(stats['last'])) for name, stats in _OPERATION_STATS.items()}
+
+    malformed_rows = {'total': 0, 'by_kind': defaultdict(int), 'samples': []}
+    for ledger in list(_LEDGERS.values()):
+        malformed_rows['total'] += ledger.malformed_count
+        for kind, count in ledger.malformed_by_kind.items():
+            malformed_rows['by_kind'][kind] += count
+        malformed_rows['samples'].extend(ledger.malformed_samples[:MALFORMED_SAMPLE_LIMIT - len(malformed_rows['samples'])])
+    malformed_rows['by_kind'] = dict(malformed_rows['by_kind'])
+    return {'operations': operations, 'malformed_rows': malformed_rows, 'query_cache': get_query_cache_stats()}
+
+
+def reset_ledger_stats():
+    """清除所有函式的效能統計。"""
+    with _STATS_LOCK:
+        _OPERATION_STATS.clear()
+
+
+def format_operation_stats(name):
+    """把某個函式最近一次呼叫的統計整理成一行文字，沒有紀錄時返回空字串。"""
+    with _STATS_LOCK:
+        stats = _OPERATION_STATS.get(name)
+        last = dict(stats['last']) if stats else None
+    if last is None:
+        return ""
+    text = f"{last['seconds'] * 1000:.1f} ms，掃描 {last['rows_scanned']} 筆、符合 {last['rows_matched']} 筆"
+    if last['rows_skipped']:
+        text += f"、略過 {last['rows_skipped']} 筆"
+    if last['bytes_read']:
+        text += f"、讀取 {last['bytes_read'] / 1024:.1f} KB"
+    return text
+
 
 def init_csvs():
-    """確保 CSV 檔案存在，如果不存在就建立新的。"""
-    if not os.path.exists(TRANSACTIONS_FILE):
-        with open(TRANSACTIONS_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['date', 'amount', 'type', 'category', 'description'])
-    
-    if not os.path.exists(BUDGETS_FILE):
-        with open(BUDGETS_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['category', 'budget'])
+    """確保資料檔案存在，如果不存在就建立新的（CSV 檔案或 SQLite 資料庫）。"""
+    get_storage().initialize()
+
+
+def _validate_transaction(date_str, amount, trans_type):
+    """
+    檢查一筆交易的日期、金額和類型。
+    返回 (金額 float, None)，或驗證失敗時返回 (None, 錯誤訊息)。
+    """
+    try:
+        _parse_date(date_str) # 檢查日期格式
+        val_amount = float(amount)
+    except (ValueError, TypeError):
+        return None, f"日期格式 '{date_str}' 不太對，請用 YYYY-MM-DD 格式，或者金額 '{amount}' 不是有效的數字。"
+
+    if val_amount <= 0:
+        return None, "喔喔！金額要輸入大於0的數字啦！"
+
+    if trans_type not in ['收入', '支出']:
+        return None, "類型不對喔，只能是 '收入' 或 '支出'"
+
+    return val_amount, None
+
+
+@_instrumented
+def add_transaction_record(date_str, amount, trans_type, category, desc):
+    """
+    驗證輸入並將交易紀錄寫入目前的儲存後端（預設為 TRANSACTIONS_FILE）。
+    返回 (bool, str) 表示成功/失敗狀態和訊息。
+    """
+    val_amount, error = _validate_transaction(date_str, amount, trans_type)
+    if error:
+        return False, error
+
+    try:
+        # 寫入檔案
+        _append_transactions([(date_str, val_amount, trans_type, category, desc)])
+        
+        return True, "好耶！記好帳了！"
+    except Exception as e:
+        return False, f"糟糕，存檔時出錯了：{str(e)}"
+
+
+@_instrumented
+def add_transactions_batch(records):
+    """
+    一次新增多筆交易紀錄。records 為 dict 的序列，鍵值同交易紀錄檔欄位
+    ('date', 'amount', 'type', 'category', 'description')。
+    所有紀錄先一次驗證完，再把有效的紀錄用單次寫入存檔；無效的紀錄不會寫入。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'added': int, 'errors': [(第幾筆, 錯誤訊息), ...]}，筆數從 1 開始
+    失敗時 message_or_data 為 error_message_string
+    """
+    valid_rows = []
+    errors = []
+    for row_number, record in enumerate(records, start=1):
+        val_amount, error = _validate_transaction(record.get('date'), record.get('amount'), record.get('type'))
+        if error:
+            errors.append((row_number, error))
+            continue
+        valid_rows.append((record['date'], val_amount, record['type'], record.get('category') or '', record.get('description') or ''))
+
+    if valid_rows:
+        try:
+            _append_transactions(valid_rows)
+        except Exception as e:
+            return False, f"糟糕，批次存檔時出錯了：{str(e)}"
+
+    return True, {'added': len(valid_rows), 'errors': errors}
+
+
+@_instrumented
+def edit_transaction(transaction_id, date_str, amount, trans_type, category, desc):
+    """
+    修改一筆交易（transaction_id 為查詢結果中的 'id'）。
+    只在修改紀錄檔加一行，不會重寫整個交易紀錄檔。
+    返回 (bool, str) 表示成功/失敗狀態和訊息。
+    """
+    val_amount, error = _validate_transaction(date_str, amount, trans_type)
+    if error:
+        return False, error
+
+    try:
+        get_storage().amend_transaction(transaction_id, (date_str, val_amount, trans_type, category or '', desc or ''))
+        _note_ledger_write()
+        return True, "改好了！"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"糟糕，修改交易時出錯了：{str(e)}"
+
+
+@_instrumented
+def delete_transaction(transaction_id):
+    """
+    刪除一筆交易（transaction_id 為查詢結果中的 'id'）。
+    返回 (bool, str) 表示成功/失敗狀態和訊息。
+    """
+    try:
+        get_storage().amend_transaction(transaction_id, None)
+        _note_ledger_write()
+        return True, "刪掉了！"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"糟糕，刪除交易時出錯了：{str(e)}"
+
+
+@_instrumented
+def compact_transactions():
+    """
+    把累積的修改與刪除併回交易紀錄檔。修改紀錄太多時會自動在背景執行，平常不需要手動呼叫。
+    返回 (success_boolean, message_string)。
+    """
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+    try:
+        merged = storage.compact()
+        _note_ledger_write()
+        return True, f"整理完成，併入了 {merged} 筆修改。"
+    except LedgerError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"整理交易紀錄時發生錯誤：{str(e)}"
+
+
+@_instrumented
+def import_transactions_from_csv(filepath, column_mapping=None, date_format='%Y-%m-%d'):
+    """
+    從其他 CSV 檔（例如銀行對帳單）匯入交易紀錄。
+    column_mapping 把本程式的欄位對應到來源檔的欄位名稱，例如
+    {'date': '交易日期', 'amount': '金額', 'description': '摘要'}；沒給的欄位預設用同名欄位。
+    來源檔沒有 'type' 欄位時依金額正負判斷：負數為支出、正數為收入。
+    日期會依 date_format 解析後轉成 YYYY-MM-DD。
+    返回 (success_boolean, message_or_data)，成功時的資料格式同 add_transactions_batch，
+    錯誤清單中的編號為來源檔的行號。
+    """
+    mapping = {field: field for field in ['date', 'amount', 'type', 'category', 'description']}
+    mapping.update(column_mapping or {})
+
+    try:
+        with open(filepath, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            missing = [mapping[field] for field in ['date', 'amount'] if mapping[field] not in (reader.fieldnames or [])]
+            if missing:
+                return False, f"檔案 {filepath} 缺少欄位：{', '.join(missing)}"
+            has_type = mapping['type'] in reader.fieldnames
+
+            records = []
+            line_numbers = []
+            errors = []
+            for row in reader:
+                try:
+                    date_str = datetime.strptime(row[mapping['date']].strip(), date_format).strftime('%Y-%m-%d')
+                    amount = float(row[mapping['amount']].replace(',', '').strip())
+                except (ValueError, AttributeError) as e:
+                    errors.append((reader.line_num, f"日期或金額格式不正確：{e}"))
+                    continue
+                if has_type:
+                    trans_type = row[mapping['type']].strip()
+                else:
+                    trans_type = '支出' if amount < 0 else '收入'
+                    amount = abs(amount)
+                records.append({
+                    'date': date_str,
+                    'amount': amount,
+                    'type': trans_type,
+                    'category': (row.get(mapping['category']) or '').strip(),
+                    'description': (row.get(mapping['description']) or '').strip(),
+                })
+                line_numbers.append(reader.line_num)
+    except FileNotFoundError:
+        return False, f"找不到要匯入的檔案 {filepath}。"
+    except Exception as e:
+        return False, f"讀取匯入檔案時發生錯誤：{str(e)}"
+
+    success, data_or_message = add_transactions_batch(records)
+    if not success:
+        return False, data_or_message
+    errors.extend((line_numbers[index - 1], message) for index, message in data_or_message['errors'])
+    errors.sort()
+    return True, {'added': data_or_message['added'], 'errors': errors}
+
+
+def new_transaction():
+    """透過命令列界面新增一筆新的交易紀錄。"""
+    try:
+        date = input("日期 (YYYY-MM-DD) 打這邊: ")
+        amount_str = input("金額多少？: ")
+        trans_type = input("是收入還是支出啊？ (收入/支出): ")
+        category = input("這是什麼類別的？ (例如：吃飯、車錢、玩樂): ")
+        desc = input("要寫點什麼嗎？: ")
+
+        # 先嘗試轉換金額，以便早期發現錯誤
+        try:
+            amount = float(amount_str)
+        except ValueError:
+            print(f"呃，金額 '{amount_str}' 看起來不是數字喔。")
+            return
+
+        success, message = add_transaction_record(date, amount, trans_type, category, desc)
+        print(message)
+
+    except Exception as e: # 處理 input() 可能發生的意外錯誤
+        print(f"輸入時發生未預期的錯誤：{str(e)}")
+
+
+@_instrumented
+@_cached_query
+def fetch_transactions(start_date_str, end_date_str):
+    """
+    依指定的日期範圍查詢交易紀錄，並計算總收入、總支出和淨餘額。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'transactions': list, 'total_income': float, 'total_expense': float, 'net_balance': float}
+    失敗時 message_or_data 為 error_message_string
+    結果會被快取（見 _cached_query），請勿修改。
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+
+    if start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+
+    transactions_found = []
+    total_income = 0 # 分
+    total_expense = 0
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        for _, row in storage.iter_transactions_between(start_date, end_date):
+            transactions_found.append(row.to_dict())
+            if row.type == '收入':
+                total_income += row.cents
+            elif row.type == '支出':
+                total_expense += row.cents
+
+        return True, {
+            'transactions': transactions_found,
+            'total_income': total_income / 100,
+            'total_expense': total_expense / 100,
+            'net_balance': (total_income - total_expense) / 100
+        }
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"讀取交易紀錄時發生未預期錯誤：{str(e)}"
+
+
+@_instrumented
+def get_range_totals(start_date_str, end_date_str):
+    """
+    只要日期範圍內的收支合計、不需要明細時用這個：靠每日累計的前綴和索引回答，
+    不管查一週還是十年、帳本多大，都不用逐筆讀出範圍內的交易。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'total_income': float, 'total_expense': float, 'net_balance': float,
+    'transaction_count': int, 'category_expenses': {類別: 支出}}
+    失敗時 message_or_data 為 error_message_string
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+
+    if start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        total_income, total_expense, count, category_expenses = storage.range_totals(start_date, end_date)
+        return True, {
+            'total_income': total_income / 100,
+            'total_expense': total_expense / 100,
+            'net_balance': (total_income - total_expense) / 100,
+            'transaction_count': count,
+            'category_expenses': {category: spent / 100 for category, spent in category_expenses.items()}
+        }
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"計算收支合計時發生未預期錯誤：{str(e)}"
 
 
-def add_transaction_record(date_str, amount, trans_type, category, desc):
+@_instrumented
+@_cached_query
+def fetch_transactions_page(start_date_str, end_date_str, offset=0, limit=100, sort_key='date', descending=False, keyword=None):
     """
-    驗證輸入並將交易紀錄寫入 TRANSACTIONS_FILE。
-    返回 (bool, str) 表示成功/失敗狀態和訊息。
+    分頁查詢：依 sort_key（TRANSACTION_SORT_KEYS 之一）排序後，只取出第 offset 筆起的 limit 筆交易。
+    排序在後端做，結果會快取到檔案變動為止，所以捲動翻頁不用每次重新排序。
+    有 keyword 時只列出描述或類別含有這些詞的交易（規則同 search_transactions）。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'transactions': list, 'offset': int, 'total_count': int,
+    'total_income': float, 'total_expense': float, 'net_balance': float}，總額是整個日期範圍的。
+    失敗時 message_or_data 為 error_message_string
+    結果會被快取，請勿修改。
     """
     try:
-        # 基本驗證
-        datetime.strptime(date_str, '%Y-%m-%d') # 檢查日期格式
-        
-        val_amount = float(amount)
-        if val_amount <= 0:
-            return False, "喔喔！金額要輸入大於0的數字啦！"
-        
-        if trans_type not in ['收入', '支出']:
-            return False, "類型不對喔，只能是 '收入' 或 '支出'"
-        
-        # 寫入檔案
-        with open(TRANSACTIONS_FILE, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([date_str, val_amount, trans_type, category, desc])
-        
-        return True, "好耶！記好帳了！"
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
     except ValueError:
-        return False, f"日期格式 '{date_str}' 不太對，請用 YYYY-MM-DD 格式，或者金額 '{amount}' 不是有效的數字。"
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+
+    if start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+    if sort_key not in TRANSACTION_SORT_KEYS:
+        return False, f"不支援的排序欄位：{sort_key}（可用：{', '.join(TRANSACTION_SORT_KEYS)}）"
+    if offset < 0 or limit < 0:
+        return False, "offset 和 limit 不能是負數。"
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        page, total_count, total_income, total_expense = storage.page_transactions_between(
+            start_date, end_date, offset, limit, sort_key, descending, (keyword or '').strip() or None)
+        return True, {
+            'transactions': [row.to_dict() for _, row in page],
+            'offset': offset,
+            'total_count': total_count,
+            'total_income': total_income / 100,
+            'total_expense': total_expense / 100,
+            'net_balance': (total_income - total_expense) / 100
+        }
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
     except Exception as e:
-        return False, f"糟糕，存檔時出錯了：{str(e)}"
+        return False, f"讀取交易紀錄時發生未預期錯誤：{str(e)}"
 
 
-def new_transaction():
-    """透過命令列界面新增一筆新的交易紀錄。"""
+@_instrumented
+def fetch_transaction_rows(offset=0, limit=100, newest_first=True):
+    """
+    依記帳順序翻頁：不限日期也不排序，直接取出第 offset 列起的 limit 列（newest_first 時最新記的在前）。
+    CSV 後端靠列號索引直接跳到那幾列，不必先載入整份帳本，翻到第幾頁花的時間都一樣。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'transactions': [交易 dict 或 None, ...], 'offset': int, 'total_rows': int}，
+    格式錯誤或已刪除的列是 None（列號不會因為刪除而移動）。
+    失敗時 message_or_data 為 error_message_string
+    """
+    if offset < 0 or limit < 0:
+        return False, "offset 和 limit 不能是負數。"
+
     try:
-        date = input("日期 (YYYY-MM-DD) 打這邊: ")
-        amount_str = input("金額多少？: ")
-        trans_type = input("是收入還是支出啊？ (收入/支出): ")
-        category = input("這是什麼類別的？ (例如：吃飯、車錢、玩樂): ")
-        desc = input("要寫點什麼嗎？: ")
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
 
-        # 先嘗試轉換金額，以便早期發現錯誤
-        try:
-            amount = float(amount_str)
-        except ValueError:
-            print(f"呃，金額 '{amount_str}' 看起來不是數字喔。")
-            return
+    try:
+        rows, total_rows = storage.transaction_rows(offset, limit, newest_first)
+        return True, {
+            'transactions': [None if row is None else row.to_dict() for row in rows],
+            'offset': offset,
+            'total_rows': total_rows
+        }
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+        return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"讀取交易紀錄時發生未預期錯誤：{str(e)}"
 
-        success, message = add_transaction_record(date, amount, trans_type, category, desc)
-        print(message)
 
-    except Exception as e: # 處理 input() 可能發生的意外錯誤
-        print(f"輸入時發生未預期的錯誤：{str(e)}")
+@_instrumented
+def fetch_latest_transactions(count=10):
+    """
+    最近記的 count 筆交易（最新的在前），略過格式錯誤與已刪除的紀錄；花的時間和帳本大小無關。
+    依月份分檔時是最新月份的檔案裡後記的在前。
+    返回 (success_boolean, message_or_data)，成功時 message_or_data 為 [交易 dict, ...]。
+    """
+    if count < 0:
+        return False, "count 不能是負數。"
 
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
 
-def fetch_transactions(start_date_str, end_date_str):
+    try:
+        return True, [row.to_dict() for row in storage.latest_transactions(count)]
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+        return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"讀取交易紀錄時發生未預期錯誤：{str(e)}"
+
+
+@_instrumented
+def search_transactions(query, start_date_str=None, end_date_str=None):
     """
-    依指定的日期範圍查詢交易紀錄，並計算總收入、總支出和淨餘額。
+    搜尋描述或類別含有 query 的交易，例如 search_transactions('uber') 或 search_transactions('午餐 便當', '2024-01-01', '2024-12-31')。
+    以空白分隔的每個詞都要是描述或類別的一部分（子字串比對、不分大小寫，例如 'ber' 也找得到 Uber），
+    每種後端都是同樣的規則；日期範圍不給就是全部。
+    CSV 後端用倒排索引（英數字以詞為單位、中文以相鄰兩字為單位）找候選，不必逐筆掃描。
+    返回 (success_boolean, message_or_data)，成功時的格式同 fetch_transactions。
+    """
+    if not query or not query.strip():
+        return False, "請輸入要搜尋的關鍵字。"
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+    if start_date and end_date and start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        found = storage.search_transactions(query.strip(), start_date, end_date)
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"搜尋交易紀錄時發生未預期錯誤：{str(e)}"
+
+    total_income = sum(row.cents for _, row in found if row.type == '收入')
+    total_expense = sum(row.cents for _, row in found if row.type == '支出')
+    return True, {
+        'transactions': [row.to_dict() for _, row in found],
+        'total_income': total_income / 100,
+        'total_expense': total_expense / 100,
+        'net_balance': (total_income - total_expense) / 100
+    }
+
+
+@_instrumented
+def group_transactions(group_by, measures=('sum',), start_date_str=None, end_date_str=None, trans_type=None):
+    """
+    依任意維度分組統計交易，例如 group_transactions(['category', 'month'], ['sum', 'count'], trans_type='支出')
+    就是「每個類別每個月花了多少、幾筆」。
+    group_by 可用 GROUP_DIMENSIONS 裡的維度（可以不給，就是全部算在一起），measures 可用 GROUP_MEASURES；
+    日期範圍不給就是全部。只用到類別、類型、月份的總額、筆數、平均時直接讀月彙總，其他情況在帳本的欄式檢視上走一遍。
     返回 (success_boolean, message_or_data)。
-    成功時 message_or_data 為 {'transactions': list, 'total_income': float, 'total_expense': float, 'net_balance': float}
+    成功時 message_or_data 為 [{維度: 值, ..., 統計量: 值, ...}, ...]，依維度值排序
+    失敗時 message_or_data 為 error_message_string
+    """
+    group_by, measures = tuple(group_by), tuple(measures)
+    unknown = [name for name in group_by if name not in GROUP_DIMENSIONS] + [name for name in measures if name not in GROUP_MEASURES]
+    if unknown:
+        return False, f"不認得的維度或統計量：{'、'.join(unknown)}。維度可用 {'、'.join(GROUP_DIMENSIONS)}，統計量可用 {'、'.join(GROUP_MEASURES)}。"
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+    if start_date and end_date and start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        stats = storage.group_totals(group_by, measures, start_date, end_date, trans_type)
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"分組統計時發生未預期錯誤：{str(e)}"
+
+    results = []
+    for key in sorted(stats, key=lambda key: tuple((value is None, value if value is not None else '') for value in key)):
+        total, count, minimum, maximum = stats[key] # 金額是分
+        measure_values = {'sum': total / 100, 'count': count, 'mean': total / count / 100 if count else 0.0,
+                          'min': None if minimum is None else minimum / 100,
+                          'max': None if maximum is None else maximum / 100}
+        item = dict(zip(group_by, key))
+        item.update((measure, measure_values[measure]) for measure in measures)
+        results.append(item)
+    return True, results
+
+
+def pivot_transactions(row_dimension, column_dimension, measure='sum', start_date_str=None, end_date_str=None, trans_type=None):
+    """
+    把 group_transactions 的結果排成交叉表，例如 pivot_transactions('category', 'month', trans_type='支出')。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'rows': [列的值], 'columns': [欄的值], 'cells': [[值, ...], ...]}，
+    沒有資料的格子總額、筆數為 0，其他統計量為 None
+    失敗時 message_or_data 為 error_message_string
+    """
+    success, data_or_message = group_transactions((row_dimension, column_dimension), (measure,),
+                                                  start_date_str, end_date_str, trans_type)
+    if not success:
+        return False, data_or_message
+    rows = list(dict.fromkeys(item[row_dimension] for item in data_or_message))
+    columns = sorted(set(item[column_dimension] for item in data_or_message), key=lambda value: (value is None, value if value is not None else ''))
+    row_index = {value: i for i, value in enumerate(rows)}
+    column_index = {value: i for i, value in enumerate(columns)}
+    empty = 0 if measure in ('sum', 'count') else None
+    cells = [[empty] * len(columns) for _ in rows]
+    for item in data_or_message:
+        cells[row_index[item[row_dimension]]][column_index[item[column_dimension]]] = item[measure]
+    return True, {'rows': rows, 'columns': columns, 'cells': cells}
+
+
+def _trend_buckets(period, start_date, end_date):
+    """返回 (各時段的標籤, 日期 → 時段序號的函式)；週以星期一為起點，標籤用 ISO 週次。"""
+    if period == 'day':
+        base = start_date.toordinal()
+        count = end_date.toordinal() - base + 1
+        labels = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(count)]
+        return labels, lambda day: day.toordinal() - base
+    if period == 'week':
+        base = start_date.toordinal() - start_date.weekday()
+        count = (end_date.toordinal() - base) // 7 + 1
+        labels = ["{0:04d}-W{1:02d}".format(*datetime.fromordinal(base + 7 * i).isocalendar()[:2]) for i in range(count)]
+        return labels, lambda day: (day.toordinal() - base) // 7
+    if period == 'month':
+        base = start_date.year * 12 + start_date.month - 1
+        count = end_date.year * 12 + end_date.month - base
+        labels = [f"{(base + i) // 12:04d}-{(base + i) % 12 + 1:02d}" for i in range(count)]
+        return labels, lambda day: day.year * 12 + day.month - 1 - base
+    labels = [str(year) for year in range(start_date.year, end_date.year + 1)]
+    return labels, lambda day: day.year - start_date.year
+
+
+@_instrumented
+def get_trend_report(start_date_str, end_date_str, period='month'):
+    """
+    依時間單位（day/week/month/year）統計日期範圍內每個時段的收支，以及各類別、各類型的走勢。
+    資料來源是每天的合計，只走過一次；每條走勢是一個固定長度的 array，記憶體只和時段數、類別數有關，
+    十幾年的帳也不會變多。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'period': str, 'labels': [時段標籤], 'income': [...], 'expense': [...], 'net': [...],
+    'top_expense': [(類別, 金額) 或 None], 'series': [{'category', 'type', 'values', 'total'}, ...]}
+    （各串列與 labels 一一對應；series 依類型、總額由大到小排列）
     失敗時 message_or_data 為 error_message_string
     """
+    if period not in TREND_PERIODS:
+        return False, f"不支援的時間單位 '{period}'，可用的有：{'、'.join(TREND_PERIODS)}。"
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
@@ -91,55 +3429,99 @@ def fetch_transactions(start_date_str, end_date_str):
     if start_date > end_date:
         return False, "開始日期不能晚於結束日期啦！"
 
-    transactions_found = []
-    total_income = 0.0
-    total_expense = 0.0
-
-    if not os.path.exists(TRANSACTIONS_FILE):
-        return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 不存在。"
-
     try:
-        with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            if not reader.fieldnames or not all(field in reader.fieldnames for field in ['date', 'amount', 'type']):
-                return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 格式不正確或缺少必要欄位。"
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
 
-            for row in reader:
-                try:
-                    transaction_date = datetime.strptime(row['date'], '%Y-%m-%d')
-                    amount = float(row['amount'])
-                except (ValueError, KeyError) as e:
-                    # 跳過格式錯誤的行，或你可以決定是否要報錯
-                    print(f"警告：跳過一筆格式錯誤的紀錄：{row}, 錯誤：{e}", file=sys.stderr)
-                    continue
+    try:
+        labels, bucket_of = _trend_buckets(period, start_date, end_date)
+        # 各時段先用整數的分累加，最後才換成元
+        zeros = array('q', [0]) * len(labels)
+        income = array('q', zeros)
+        expense = array('q', zeros)
+        series = {}
+        matched = 0
+        for i, (day, category, trans_type, total, count) in enumerate(storage.daily_totals_between(start_date, end_date)):
+            if not i & 0x3FFF:
+                _check_cancelled()
+            bucket = bucket_of(day)
+            values = series.get((category, trans_type))
+            if values is None:
+                values = series[(category, trans_type)] = array('q', zeros)
+            values[bucket] += total
+            if trans_type == '收入':
+                income[bucket] += total
+            elif trans_type == '支出':
+                expense[bucket] += total
+            matched += count
+        _count('rows_matched', matched)
 
-                if start_date <= transaction_date <= end_date:
-                    transactions_found.append(row)
-                    if row['type'] == '收入':
-                        total_income += amount
-                    elif row['type'] == '支出':
-                        total_expense += amount
-        
-        net_balance = total_income - total_expense
+        top_expense = [None] * len(labels)
+        for (category, trans_type), values in series.items():
+            if trans_type != '支出':
+                continue
+            for bucket, total in enumerate(values):
+                if total > 0 and (top_expense[bucket] is None or total > top_expense[bucket][1]):
+                    top_expense[bucket] = (category, total)
+        top_expense = [None if top is None else (top[0], top[1] / 100) for top in top_expense]
 
+        series_list = [{'category': category, 'type': trans_type, 'values': [value / 100 for value in values],
+                        'total': sum(values) / 100}
+                       for (category, trans_type), values in series.items()]
+        series_list.sort(key=lambda item: (item['type'] or '', -item['total']))
         return True, {
-            'transactions': sorted(transactions_found, key=lambda x: x['date']),
-            'total_income': total_income,
-            'total_expense': total_expense,
-            'net_balance': net_balance
+            'period': period,
+            'labels': labels,
+            'income': [value / 100 for value in income],
+            'expense': [value / 100 for value in expense],
+            'net': [(inc - exp) / 100 for inc, exp in zip(income, expense)],
+            'top_expense': top_expense,
+            'series': series_list
         }
+    except LedgerError as e:
+        return False, str(e)
     except FileNotFoundError:
-         return False, f"嗯？ {TRANSACTIONS_FILE} 檔案不見了耶。"
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
     except Exception as e:
-        return False, f"讀取交易紀錄時發生未預期錯誤：{str(e)}"
+        return False, f"計算趨勢報表時發生未預期錯誤：{str(e)}"
+
+
+def trend_report():
+    """依日、週、月或年看收支走勢 (CLI 版本)。"""
+    period_choices = {'1': 'day', '2': 'week', '3': 'month', '4': 'year'}
+    period = period_choices.get(input("要用什麼單位看？ (1.日 2.週 3.月 4.年，預設月): ").strip() or '3')
+    if period is None:
+        print("沒有這個單位喔。")
+        return
+    s_date_str = input("從哪天開始 (YYYY-MM-DD): ")
+    e_date_str = input("看到哪天為止 (YYYY-MM-DD): ")
+
+    success, data_or_message = get_trend_report(s_date_str, e_date_str, period)
+    if not success:
+        print(f"計算趨勢失敗：{data_or_message}")
+        return
+
+    print(f"\n=== {s_date_str} 至 {e_date_str} 收支趨勢 ===")
+    print(f"{'時段':<12}{'收入':>12}{'支出':>12}{'淨額':>12}  花最多的類別")
+    for label, inc, exp, net, top in zip(data_or_message['labels'], data_or_message['income'], data_or_message['expense'],
+                                         data_or_message['net'], data_or_message['top_expense']):
+        top_text = f"{top[0]} ({top[1]:.2f})" if top else "-"
+        print(f"{label:<14}{inc:>14.2f}{exp:>14.2f}{net:>14.2f}  {top_text}")
 
 
 def get_transactions_by_date():
     """依指定的日期範圍查詢交易紀錄 (CLI版本)。"""
     s_date_str = input("開始查帳的日期 (YYYY-MM-DD): ")
     e_date_str = input("查到哪天為止 (YYYY-MM-DD): ")
+    keyword = input("只看描述或類別含有哪些字？ (不用的話直接按 Enter): ").strip()
 
-    success, data_or_message = fetch_transactions(s_date_str, e_date_str)
+    if keyword:
+        success, data_or_message = search_transactions(keyword, s_date_str, e_date_str)
+    else:
+        success, data_or_message = fetch_transactions(s_date_str, e_date_str)
 
     if success:
         print("\n=== 查詢結果 ===")
@@ -158,53 +3540,81 @@ def get_transactions_by_date():
         print(f"查詢失敗：{data_or_message}")
 
 
+def iter_transactions(start_date_str, end_date_str, trans_type=None, category=None):
+    """
+    依日期順序逐筆產生指定範圍內的交易紀錄，可再依類型或類別篩選。
+    不會先把結果整批放進串列，適合匯出或自訂報表這類要處理大量紀錄的情況。
+    每筆紀錄為 {'date', 'amount', 'type', 'category', 'description', 'id'} 字典，其中 amount 為 float，
+    id 可以拿來呼叫 edit_transaction() / delete_transaction()。
+    日期格式錯誤或找不到交易紀錄時丟出 LedgerError。
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        raise LedgerError(f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。")
+
+    if start_date > end_date:
+        raise LedgerError("開始日期不能晚於結束日期啦！")
+
+    storage = get_storage()
+    if not storage.exists():
+        raise LedgerError(f"交易紀錄檔 {storage.location} 不存在。")
+
+    for amount, row in storage.iter_transactions_between(start_date, end_date, trans_type, category):
+        yield {
+            'date': row['date'],
+            'amount': amount,
+            'type': row['type'],
+            'category': row.get('category'),
+            'description': row.get('description'),
+            'id': row.get('id'),
+        }
+
+
+def _summarize_category_totals(category_totals):
+    """{類別: 總支出（分）} → {'category_summary': [...], 'total_expenses': float}，依金額由大到小。"""
+    total_cents = sum(category_totals.values())
+    total_expenses = total_cents / 100
+
+    summary_list = []
+    if total_cents > 0:
+        for category, cents in category_totals.items():
+            percentage = (cents / total_cents) * 100
+            summary_list.append({'category': category, 'amount': cents / 100, 'percentage': percentage})
+    
+    # Sort by amount descending
+    summary_list.sort(key=lambda x: x['amount'], reverse=True)
+
+    return {
+        'category_summary': summary_list,
+        'total_expenses': total_expenses
+    }
+
+
+@_instrumented
+@_cached_query
 def get_category_expense_summary():
     """
     計算各類別的總支出及百分比。
     返回 (success_boolean, message_or_data)。
     成功時 message_or_data 為 {'category_summary': list_of_dicts, 'total_expenses': float}
     失敗時 message_or_data 為 error_message_string
+    結果會被快取，請勿修改。
     """
-    category_totals = defaultdict(float)
-    total_expenses = 0.0
-
-    if not os.path.exists(TRANSACTIONS_FILE):
-        return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 不存在。"
-
     try:
-        with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            if not reader.fieldnames or not all(field in reader.fieldnames for field in ['type', 'amount', 'category']):
-                return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 格式不正確或缺少必要欄位 ('type', 'amount', 'category')。"
-
-            for row in reader:
-                try:
-                    if row['type'] == '支出':
-                        amount = float(row['amount'])
-                        category = row['category']
-                        if not category: # Handle empty category string
-                            category = "未分類"
-                        category_totals[category] += amount
-                        total_expenses += amount
-                except (ValueError, KeyError) as e:
-                    print(f"警告：跳過一筆格式錯誤的支出紀錄：{row}, 錯誤：{e}", file=sys.stderr)
-                    continue
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
 
-        summary_list = []
-        if total_expenses > 0:
-            for category, amount in category_totals.items():
-                percentage = (amount / total_expenses) * 100
-                summary_list.append({'category': category, 'amount': amount, 'percentage': percentage})
-        
-        # Sort by amount descending
-        summary_list.sort(key=lambda x: x['amount'], reverse=True)
-
-        return True, {
-            'category_summary': summary_list,
-            'total_expenses': total_expenses
-        }
+    try:
+        return True, _summarize_category_totals(_category_expenses(storage))
+    except LedgerError as e:
+        return False, str(e)
     except FileNotFoundError:
-         return False, f"嗯？ {TRANSACTIONS_FILE} 檔案不見了耶。"
+         return False, f"嗯？ {storage.location} 檔案不見了耶。"
     except Exception as e:
         return False, f"計算類別支出時發生未預期錯誤：{str(e)}"
 
@@ -227,44 +3637,23 @@ def category_summary():
         print(f"統計失敗：{data_or_message}")
 
 
+@_instrumented
 def get_all_budgets():
     """
-    讀取 BUDGETS_FILE 並返回一個包含所有預算的字典。
+    從目前的儲存後端（預設為 BUDGETS_FILE）讀取所有預算，返回一個字典。
     返回 (True, budgets_dict) 或 (False, error_message)。
     """
-    budgets = {}
-    if not os.path.exists(BUDGETS_FILE):
-        # Consider it not an error, just no budgets set yet. init_csvs ensures file exists with header.
-        return True, {}
-
     try:
-        with open(BUDGETS_FILE, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            # Check for header, though init_csvs should guarantee it
-            if not reader.fieldnames or not all(field in reader.fieldnames for field in ['category', 'budget']):
-                 # If file is empty (only header or nothing), return empty dict
-                if os.stat(BUDGETS_FILE).st_size <= len(','.join(['category', 'budget'])) + 2: # approx header length
-                    return True, {}
-                return False, f"預算檔 {BUDGETS_FILE} 格式不正確或缺少必要欄位 ('category', 'budget')。"
-
-            for row in reader:
-                try:
-                    category = row['category']
-                    budget_amount = float(row['budget'])
-                    if not category: # Skip rows with empty category
-                        print(f"警告：預算檔中發現沒有類別的預算紀錄：{row}", file=sys.stderr)
-                        continue
-                    budgets[category] = budget_amount
-                except (ValueError, TypeError) as e: # Catch if budget_amount is not a float
-                    print(f"警告：跳過預算檔中格式錯誤的紀錄：{row}, 錯誤：{e}", file=sys.stderr)
-                    continue
-        return True, budgets
+        return True, get_storage().load_budgets()
+    except LedgerError as e:
+        return False, str(e)
     except FileNotFoundError: # Should be caught by os.path.exists, but as a safeguard
         return True, {}
     except Exception as e:
         return False, f"讀取預算檔時發生錯誤：{str(e)}"
 
 
+@_instrumented
 def update_budget(category_str, budget_amount_float):
     """
     更新或新增一個類別的預算金額。
@@ -280,21 +3669,12 @@ def update_budget(category_str, budget_amount_float):
     except ValueError:
         return False, f"預算金額 '{budget_amount_float}' 不是有效的數字。"
 
-    success, budgets_or_error = get_all_budgets()
-    if not success:
-        # budgets_or_error here is an error message from get_all_budgets
-        return False, budgets_or_error
-
-    budgets = budgets_or_error # Now it's the budgets dictionary
-    budgets[category_str] = budget_amount
-
     try:
-        with open(BUDGETS_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['category', 'budget']) # Write header first
-            for category_key, budget_val in sorted(budgets.items()): # Write sorted by category
-                writer.writerow([category_key, budget_val])
+        get_storage().save_budget(category_str, budget_amount)
+        _note_ledger_write()
         return True, f"好！ {category_str} 的預算已更新為 {budget_amount:.2f} 元。"
+    except LedgerError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"儲存預算到檔案時出錯了：{str(e)}"
 
@@ -308,12 +3688,14 @@ def set_my_budget():
     print(message)
 
 
+@_instrumented
 def get_budget_usage_details(target_month_str=None):
     """
     計算指定月份（預設當前月份）各預算類別的使用情況。
     返回 (success_boolean, message_or_data_list)。
     成功時 message_or_data_list 為 [{'category': str, 'budget': float, 'spent': float, 'remaining': float, 'percentage_used': float}, ...]
     失敗時 message_or_data_list 為 error_message_string
+    結果會被快取，請勿修改。
     """
     if target_month_str:
         try:
@@ -323,7 +3705,11 @@ def get_budget_usage_details(target_month_str=None):
             return False, f"目標月份格式 '{target_month_str}' 不正確，請使用 YYYY-MM 格式。"
     else:
         target_month_str = datetime.now().strftime('%Y-%m')
+    return _budget_usage_for_month(target_month_str) # 先決定月份再查快取，跨月後「本月」才不會拿到上個月的結果
+
 
+@_cached_query
+def _budget_usage_for_month(target_month_str):
     success, budgets = get_all_budgets()
     if not success:
         return False, budgets # budgets is an error message here
@@ -331,32 +3717,32 @@ def get_budget_usage_details(target_month_str=None):
     if not budgets:
         return True, [] # No budgets set, so no usage to report; not an error.
 
-    expenses_by_category = defaultdict(float)
-    if not os.path.exists(TRANSACTIONS_FILE):
+    expenses_by_category = {}
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
         # No transactions means no expenses, so all budgets are 0% used.
         pass # Continue to report budgets with 0 spent
     else:
         try:
-            with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                if not reader.fieldnames or not all(field in reader.fieldnames for field in ['date', 'type', 'amount', 'category']):
-                    return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 格式不正確或缺少必要欄位。"
-                for row in reader:
-                    try:
-                        if row['type'] == '支出' and row['date'].startswith(target_month_str):
-                            category = row['category'] if row['category'] else "未分類"
-                            expenses_by_category[category] += float(row['amount'])
-                    except (ValueError, KeyError) as e:
-                        print(f"警告：讀取交易紀錄時跳過格式錯誤的支出紀錄：{row}, 錯誤：{e}", file=sys.stderr)
-                        continue
+            expenses_by_category = _category_expenses(storage, *_month_bounds(target_month_str))
+        except LedgerError as e:
+            return False, str(e)
         except FileNotFoundError: # Should be caught by os.path.exists, but as safeguard
              pass # No transactions, so expenses are 0
         except Exception as e:
             return False, f"讀取交易紀錄檔時發生錯誤：{str(e)}"
 
+    return True, _budget_usage_rows(budgets, expenses_by_category)
+
+
+def _budget_usage_rows(budgets, expenses_by_category):
+    """依預算與當月各類別支出（分）算出使用情況，依使用率由高到低。"""
     usage_details = []
     for category, budget_amount in sorted(budgets.items()):
-        spent_amount = expenses_by_category.get(category, 0.0)
+        spent_amount = expenses_by_category.get(category, 0) / 100
         remaining_amount = budget_amount - spent_amount
         percentage_used = (spent_amount / budget_amount * 100) if budget_amount > 0 else 0.0
         
@@ -370,7 +3756,7 @@ def get_budget_usage_details(target_month_str=None):
 
     # Sort by percentage_used descending
     usage_details.sort(key=lambda x: x['percentage_used'], reverse=True)
-    return True, usage_details
+    return usage_details
 
 
 def see_budget_usage():
@@ -398,6 +3784,163 @@ def see_budget_usage():
         print(f"查詢預算使用情況失敗：{data_or_message}")
 
 
+@_instrumented
+def compute_dashboard(start_date_str, end_date_str, month_str=None):
+    """
+    一次算出總覽畫面的所有資料：日期範圍內的交易與收支合計、各類別支出統計、指定月份（預設當前月份）的預算使用情況。
+    交易紀錄只讀一次、預算也只讀一次，不必分別呼叫 fetch_transactions、get_category_expense_summary
+    和 get_budget_usage_details 各掃一遍。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'range': fetch_transactions 的結果, 'category_summary': get_category_expense_summary 的結果,
+    'budget_usage': get_budget_usage_details 的結果, 'month': 'YYYY-MM'}
+    失敗時 message_or_data 為 error_message_string
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+    if start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+    if month_str:
+        try:
+            datetime.strptime(month_str, '%Y-%m')
+        except ValueError:
+            return False, f"目標月份格式 '{month_str}' 不正確，請使用 YYYY-MM 格式。"
+    else:
+        month_str = datetime.now().strftime('%Y-%m')
+
+    try:
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+
+    try:
+        budgets = storage.load_budgets()
+        records, total_income, total_expense, category_totals, month_totals = \
+            storage.dashboard_totals(start_date, end_date, month_str)
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+        return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"計算總覽資料時發生未預期錯誤：{str(e)}"
+
+    return True, {
+        'range': {
+            'transactions': [row.to_dict() for _, row in records],
+            'total_income': total_income / 100,
+            'total_expense': total_expense / 100,
+            'net_balance': (total_income - total_expense) / 100
+        },
+        'category_summary': _summarize_category_totals(category_totals),
+        'budget_usage': _budget_usage_rows(budgets, month_totals),
+        'month': month_str
+    }
+
+
+def _storage_for_directory(directory):
+    """
+    依資料夾內容判斷帳本用的是哪種後端，不看 STORAGE_BACKEND 等全域設定：
+    有 SQLITE_FILE 就是 SQLite，有 PARTITIONS_DIR/manifest.json 就是依月份分檔，其餘當作 CSV。
+    """
+    sqlite_path = os.path.join(directory, os.path.basename(SQLITE_FILE))
+    if os.path.exists(sqlite_path):
+        return SqliteStorage(sqlite_path)
+    budgets_path = os.path.join(directory, os.path.basename(BUDGETS_FILE))
+    partitions_dir = os.path.join(directory, os.path.basename(PARTITIONS_DIR))
+    if os.path.exists(os.path.join(partitions_dir, PartitionedCsvStorage.MANIFEST_NAME)):
+        return PartitionedCsvStorage(partitions_dir, budgets_path)
+    return CsvStorage(os.path.join(directory, os.path.basename(TRANSACTIONS_FILE)), budgets_path)
+
+
+def _release_ledgers(directory):
+    """把 directory 底下的帳本引擎從快取中拿掉，返回它們略過的格式錯誤紀錄數。"""
+    prefix = os.path.join(os.path.abspath(directory), '')
+    malformed = 0
+    for key in [key for key in _LEDGERS if key.startswith(prefix)]:
+        malformed += _LEDGERS.pop(key).malformed_count
+    return malformed
+
+
+@_instrumented
+def build_ledger_report(directory, start_date_str, end_date_str, month_str=None):
+    """
+    為 directory 裡的帳本算出報表：各類別支出統計、指定月份（預設當前月份）的預算使用情況與日期範圍內的收支合計。
+    檔案路徑全部由 directory 決定（後端見 _storage_for_directory），不讀寫 TRANSACTIONS_FILE 等全域設定，
+    所以可以在多個行程裡同時對不同帳本呼叫（見 batch_report.py）。
+    算完就把這個帳本的引擎放掉，連續處理很多帳本時記憶體不會一直長。
+    返回 (success_boolean, message_or_data)。
+    成功時 message_or_data 為 {'directory': 絕對路徑, 'backend': 'csv'/'partitioned'/'sqlite', 'month': 'YYYY-MM',
+    'category_summary': 同 get_category_expense_summary, 'budget_usage': 同 get_budget_usage_details,
+    'range_totals': {'start_date', 'end_date', 'total_income', 'total_expense', 'net_balance', 'count'},
+    'malformed_rows': 略過的格式錯誤紀錄數}
+    失敗時 message_or_data 為 error_message_string
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return False, f"日期格式不對喔。請用 YYYY-MM-DD 格式 (例如: {start_date_str} 或 {end_date_str})。"
+    if start_date > end_date:
+        return False, "開始日期不能晚於結束日期啦！"
+    if month_str:
+        try:
+            datetime.strptime(month_str, '%Y-%m')
+        except ValueError:
+            return False, f"目標月份格式 '{month_str}' 不正確，請使用 YYYY-MM 格式。"
+    else:
+        month_str = datetime.now().strftime('%Y-%m')
+    if not os.path.isdir(directory):
+        return False, f"帳本資料夾 {directory} 不存在。"
+
+    storage = _storage_for_directory(directory)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
+    if isinstance(storage, SqliteStorage):
+        backend = 'sqlite'
+    elif isinstance(storage, PartitionedCsvStorage):
+        backend = 'partitioned'
+    else:
+        backend = 'csv'
+
+    try:
+        if backend != 'sqlite':
+            for path in _snapshot_paths(storage): # 有快照就直接載入，省掉解析
+                _load_snapshot(path)
+        category_summary = _summarize_category_totals(_category_expenses(storage))
+        budget_usage = _budget_usage_rows(storage.load_budgets(), _category_expenses(storage, *_month_bounds(month_str)))
+        total_income, total_expense, count, _ = storage.range_totals(start_date, end_date)
+    except LedgerError as e:
+        return False, str(e)
+    except FileNotFoundError:
+        return False, f"嗯？ {storage.location} 檔案不見了耶。"
+    except Exception as e:
+        return False, f"產生 {directory} 的報表時發生未預期錯誤：{str(e)}"
+    finally:
+        malformed = _release_ledgers(directory)
+
+    return True, {
+        'directory': os.path.abspath(directory),
+        'backend': backend,
+        'month': month_str,
+        'category_summary': category_summary,
+        'budget_usage': budget_usage,
+        'range_totals': {
+            'start_date': start_date_str,
+            'end_date': end_date_str,
+            'total_income': total_income / 100,
+            'total_expense': total_expense / 100,
+            'net_balance': (total_income - total_expense) / 100,
+            'count': count
+        },
+        'malformed_rows': malformed
+    }
+
+
+@_instrumented
 def export_transactions_to_csv(start_date_str, end_date_str, output_filepath):
     """
     將指定日期範圍內的交易紀錄匯出到指定的 CSV 檔案。
@@ -412,38 +3955,41 @@ def export_transactions_to_csv(start_date_str, end_date_str, output_filepath):
     if start_date > end_date:
         return False, "開始日期不能晚於結束日期。"
 
-    if not os.path.exists(TRANSACTIONS_FILE):
-        return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 不存在。"
-
-    transactions_to_export = []
     try:
-        with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f_in:
-            reader = csv.DictReader(f_in)
-            if not reader.fieldnames or not all(field in reader.fieldnames for field in ['date', 'amount', 'type', 'category', 'description']):
-                return False, f"交易紀錄檔 {TRANSACTIONS_FILE} 格式不正確或缺少必要欄位。"
+        storage = get_storage()
+    except LedgerError as e:
+        return False, str(e)
+    if not storage.exists():
+        return False, f"交易紀錄檔 {storage.location} 不存在。"
 
-            for row in reader:
-                try:
-                    transaction_date = datetime.strptime(row['date'], '%Y-%m-%d')
-                    if start_date <= transaction_date <= end_date:
-                        transactions_to_export.append(row)
-                except ValueError: # Skip rows with bad date format in data file
-                    print(f"警告：匯出時跳過資料中日期格式錯誤的紀錄：{row}", file=sys.stderr)
-                    continue
-        
-        if not transactions_to_export:
+    try:
+        # 邊讀邊寫，不必把整段期間的紀錄先收集起來
+        transactions_to_export = storage.iter_transactions_between(start_date, end_date)
+        first_transaction = next(transactions_to_export, None)
+        if first_transaction is None:
             return True, f"在 {start_date_str} 到 {end_date_str} 期間沒有交易紀錄可供匯出。"
 
-        with open(output_filepath, 'w', newline='', encoding='utf-8') as f_out:
-            writer = csv.DictWriter(f_out, fieldnames=['date', 'amount', 'type', 'category', 'description'])
-            writer.writeheader()
-            # Sort by date before writing
-            writer.writerows(sorted(transactions_to_export, key=lambda x: x['date']))
-        
+        # 先寫到暫存檔，全部寫完才換上去；中途出錯或被取消時不會留下只寫一半的報表
+        tmp_path = output_filepath + '.tmp'
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f_out:
+                writer = csv.DictWriter(f_out, fieldnames=['date', 'amount', 'type', 'category', 'description'], extrasaction='ignore')
+                writer.writeheader()
+                writer.writerow(first_transaction[1])
+                for _, row in transactions_to_export: # 已依日期排序
+                    writer.writerow(row)
+            os.replace(tmp_path, output_filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
         return True, f"太棒了！報表已成功匯出到： {output_filepath}"
 
+    except LedgerError as e:
+        return False, str(e)
     except FileNotFoundError: # Should be caught by os.path.exists
-        return False, f"嗯？ {TRANSACTIONS_FILE} 檔案不見了耶。"
+        return False, f"嗯？ {storage.location} 檔案不見了耶。"
     except Exception as e:
         return False, f"匯出 CSV 報表時發生錯誤： {str(e)}"
 
@@ -463,9 +4009,52 @@ def create_report_csv(): # This is now the CLI wrapper
     print(message)
 
 
+def rebuild_my_rollups():
+    """(CLI) 從交易紀錄重新計算月彙總。"""
+    success, message = rebuild_monthly_rollups()
+    print(message)
+
+
+def import_transactions_file():
+    """(CLI) 從其他 CSV 檔（例如銀行對帳單）批次匯入交易紀錄。"""
+    filepath = input("要匯入的 CSV 檔案路徑: ")
+    print("請輸入來源檔中對應的欄位名稱，直接按 Enter 表示同名欄位。")
+    column_mapping = {}
+    for field, label in [('date', '日期'), ('amount', '金額'), ('type', '類型 (收入/支出；沒有這欄就依金額正負判斷)'),
+                         ('category', '類別'), ('description', '描述')]:
+        column_name = input(f"{label} 欄位 (預設 {field}): ").strip()
+        if column_name:
+            column_mapping[field] = column_name
+    date_format = input("日期格式 (預設 %Y-%m-%d): ").strip() or '%Y-%m-%d'
+
+    success, data_or_message = import_transactions_from_csv(filepath, column_mapping, date_format)
+    if success:
+        print(f"匯入完成！成功新增 {data_or_message['added']} 筆，略過 {len(data_or_message['errors'])} 筆。")
+        for line_number, message in data_or_message['errors'][:20]:
+            print(f"  第 {line_number} 行：{message}")
+        if len(data_or_message['errors']) > 20:
+            print(f"  ……還有 {len(data_or_message['errors']) - 20} 筆錯誤沒有列出。")
+    else:
+        print(f"匯入失敗：{data_or_message}")
+
+
 def main():
     """程式的主要執行迴圈。"""
+    if sys.argv[1:] == ['--migrate-to-sqlite']:
+        success, message = migrate_csv_to_sqlite()
+        print(message)
+        sys.exit(0 if success else 1)
+    if sys.argv[1:] == ['--migrate-to-partitions']:
+        success, message = migrate_csv_to_partitions()
+        print(message)
+        sys.exit(0 if success else 1)
+    if sys.argv[1:] == ['--compact']:
+        success, message = compact_transactions()
+        print(message)
+        sys.exit(0 if success else 1)
+
     init_csvs()
+    add_budget_alert_listener(lambda alert: print(alert['message']))
     
     while True:
         print("\n=== 我的記帳小幫手 ===")
@@ -475,9 +4064,12 @@ def main():
         print("4. 設定預算目標")
         print("5. 預算還夠用嗎")
         print("6. 把帳目匯出")
+        print("7. 重算月統計")
+        print("8. 匯入對帳單")
+        print("9. 看看收支趨勢")
         print("0. 不用了，謝謝")
         
-        choice = input("\n要做什麼呢？ (選數字0-6): ")
+        choice = input("\n要做什麼呢？ (選數字0-9): ")
         
         if choice == '1':
             new_transaction()
@@ -494,6 +4086,12 @@ def main():
             see_budget_usage()
         elif choice == '6':
             create_report_csv()
+        elif choice == '7':
+            rebuild_my_rollups()
+        elif choice == '8':
+            import_transactions_file()
+        elif choice == '9':
+            trend_report()
         elif choice == '0':
             print("掰掰！下次再來記帳喔！")
             sys.exit(0)
@@ -2,19 +2,180 @@ import tkinter as tk
 from tkinter import messagebox, simpledialog, filedialog, Toplevel, Label, Entry, Radiobutton, Button, Frame, StringVar, W, E, SUNKEN, BOTTOM, X, Text, Scrollbar, LEFT, RIGHT, BOTH, Y, TOP, NO, ANCHOR, NE
 from tkinter import ttk # For Treeview
 from personal_accounting import (
-    init_csvs, add_transaction_record, fetch_transactions,
+    init_csvs, add_transaction_record,
     get_category_expense_summary, update_budget, get_all_budgets,
-    get_budget_usage_details, export_transactions_to_csv, TRANSACTIONS_FILE # Added export_transactions_to_csv
+    get_budget_usage_details, export_transactions_to_csv, TRANSACTIONS_FILE, # Added export_transactions_to_csv
+    fetch_transactions_page, fetch_transaction_rows, edit_transaction, delete_transaction,
+    import_transactions_from_csv, format_operation_stats, compute_dashboard, get_range_totals,
+    get_trend_report, load_ledger_snapshot, save_ledger_snapshot, add_budget_alert_listener,
+    run_cancellable, OperationCancelled, set_write_buffering
 )
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import queue
+import sys
+import threading
+
+POLL_INTERVAL_MS = 50 # 背景工作完成與否的檢查間隔
+
+
+class PagedTreeview:
+    """
+    只放「畫面上看得到的那幾列」的 Treeview。資料一頁一頁向後端要，捲動時只改寫
+    既有那幾列的內容，不會把整個查詢結果塞進 Treeview；點欄位標題則請後端重新排序。
+
+    fetch_page(offset, limit, sort_key, descending, on_page) 負責（非同步）取資料，
+    取到後呼叫 on_page(rows, total_count)，rows 為各列 values 的串列；失敗時呼叫 on_page(None, 0)。
+    """
+    PAGE_SIZE = 200
+    MAX_CACHED_PAGES = 20
+
+    def __init__(self, parent, columns, fetch_page, headings=None, sort_key=None, descending=False):
+        self.columns = columns
+        self.fetch_page = fetch_page
+        self.headings = headings or {col: col.capitalize() for col in columns}
+        self.sort_key = sort_key or columns[0]
+        self.descending = descending
+        self.total_count = 0
+        self.first = 0 # 畫面最上面那一列是第幾筆
+        self.pages = {}
+        self.pending = set()
+        self.generation = 0 # 每次重新查詢就加一，舊查詢晚到的資料直接丟掉
+        self.active = False
+
+        self.tree = ttk.Treeview(parent, columns=columns, show='headings', height=10)
+        for col in columns:
+            self.tree.heading(col, command=lambda c=col: self.sort_by(c))
+        self._update_headings()
+        self.vsb = ttk.Scrollbar(parent, orient="vertical", command=self._on_scrollbar)
+        self.vsb.set(0, 1)
+        rowheight = ttk.Style().lookup('Treeview', 'rowheight')
+        self.rowheight = int(rowheight) if rowheight else 20
+        self.tree.bind('<Configure>', lambda event: self._render())
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll_to(self.first - 3 * (1 if event.delta > 0 else -1)))
+        self.tree.bind('<Button-4>', lambda event: self.scroll_to(self.first - 3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll_to(self.first + 3))
+
+    def reload(self, keep_position=False):
+        """清掉快取的資料重新查詢；keep_position 為 True 時停留在目前捲動到的位置。"""
+        self.generation += 1
+        self.pages.clear()
+        self.pending.clear()
+        self.total_count = 0
+        self.first = self.first if keep_position else 0
+        self.active = True
+        self._request_page(0)
+        self._request_page(self.first // self.PAGE_SIZE)
+        self._render()
+
+    def selected_values(self):
+        """目前選取那一列的 values；沒選或還在載入中時返回 None。"""
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        values = self.tree.item(selection[0], 'values')
+        return values if len(values) == len(self.columns) else None
+
+    def sort_by(self, column):
+        if not self.active:
+            return
+        if column == self.sort_key:
+            self.descending = not self.descending
+        else:
+            self.sort_key = column
+            self.descending = False
+        self._update_headings()
+        self.reload()
+
+    def scroll_to(self, first):
+        first = max(0, min(first, self.total_count - self._visible_count()))
+        if first != self.first:
+            self.first = first
+            self._render()
+
+    def _update_headings(self):
+        for col in self.columns:
+            arrow = (" ▼" if self.descending else " ▲") if col == self.sort_key else ""
+            self.tree.heading(col, text=self.headings[col] + arrow)
+
+    def _visible_count(self):
+        # 扣掉標題列後放得下幾列
+        return max(1, self.tree.winfo_height() // self.rowheight - 1)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(amount) * self.total_count))
+        elif unit == 'pages':
+            self.scroll_to(self.first + int(amount) * self._visible_count())
+        else:
+            self.scroll_to(self.first + int(amount))
+
+    def _request_page(self, page):
+        if page in self.pages or page in self.pending:
+            return
+        self.pending.add(page)
+        generation = self.generation
+        self.fetch_page(page * self.PAGE_SIZE, self.PAGE_SIZE, self.sort_key, self.descending,
+                        lambda rows, total_count: self._on_page(generation, page, rows, total_count))
+
+    def _on_page(self, generation, page, rows, total_count):
+        if generation != self.generation or not self.tree.winfo_exists():
+            return
+        self.pending.discard(page)
+        if rows is None:
+            self.active = False # 查詢失敗就停在這裡，免得一直重試
+            return
+        if len(self.pages) >= self.MAX_CACHED_PAGES:
+            # 丟掉離目前位置最遠的那頁
+            current = self.first // self.PAGE_SIZE
+            del self.pages[max(self.pages, key=lambda p: abs(p - current))]
+        self.pages[page] = rows
+        self.total_count = total_count
+        self._render()
+
+    def _row_at(self, index):
+        page, i = divmod(index, self.PAGE_SIZE)
+        rows = self.pages.get(page)
+        if rows is None:
+            if self.active:
+                self._request_page(page)
+            return None
+        return rows[i] if i < len(rows) else None
+
+    def _render(self):
+        count = max(0, min(self._visible_count(), self.total_count - self.first))
+        items = self.tree.get_children()
+        if len(items) > count:
+            self.tree.delete(*items[count:])
+            items = items[:count]
+        for _ in range(len(items), count):
+            self.tree.insert('', 'end')
+        for i, item in enumerate(self.tree.get_children()):
+            values = self._row_at(self.first + i)
+            self.tree.item(item, values=values if values is not None else ("載入中...",))
+        if self.total_count:
+            self.vsb.set(self.first / self.total_count, (self.first + count) / self.total_count)
+        else:
+            self.vsb.set(0, 1)
 
 class AccountingApp:
     def __init__(self, root):
         self.root = root
         root.title("個人記帳應用程式")
-        root.geometry("450x400")
+        root.geometry("450x580")
 
         init_csvs()
+        # 連續記帳時不必每筆都開關一次檔案；查詢前和程式結束時都會先寫出去
+        set_write_buffering(max_rows=20, max_delay=1.0)
+
+        # 後端查詢丟到這個背景執行緒跑，畫面才不會卡住；只開一個 worker，
+        # 後端的快取同一時間只會被一個工作讀寫
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger-worker')
+        self._busy_bars = {} # 視窗 -> 進度列與執行中的工作
+        # 預算提醒是在背景執行緒寫入時發出的，先放進佇列，等工作完成回到主執行緒再顯示
+        self._budget_alerts = queue.SimpleQueue()
+        add_budget_alert_listener(self._budget_alerts.put)
+        root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         button_frame = tk.Frame(root)
         button_frame.pack(pady=15, padx=10, fill=X)
@@ -37,15 +198,172 @@ class AccountingApp:
         btn_export_report = tk.Button(button_frame, text="匯出報表", command=self.open_export_report_window) # Changed placeholder
         btn_export_report.grid(row=2, column=1, padx=5, pady=5, sticky="ew")
 
+        btn_import_file = tk.Button(button_frame, text="匯入檔案", command=self.open_import_file_window)
+        btn_import_file.grid(row=3, column=0, padx=5, pady=5, sticky="ew")
+
+        btn_dashboard = tk.Button(button_frame, text="總覽", command=self.open_dashboard_window)
+        btn_dashboard.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+
+        btn_trend = tk.Button(button_frame, text="收支趨勢", command=self.open_trend_window)
+        btn_trend.grid(row=4, column=0, padx=5, pady=5, sticky="ew")
+
+        btn_recent = tk.Button(button_frame, text="最近記的帳", command=self.open_recent_transactions_window)
+        btn_recent.grid(row=4, column=1, padx=5, pady=5, sticky="ew")
+
         button_frame.grid_columnconfigure(0, weight=1)
         button_frame.grid_columnconfigure(1, weight=1)
 
         self.quick_info_label = tk.Label(root, text="選擇一個操作或查看最新訊息。", height=3, relief=SUNKEN, wraplength=430, justify=LEFT, anchor="nw")
         self.quick_info_label.pack(pady=5, padx=10, fill=X)
 
+        self.period_totals_var = StringVar(value="本月／今年收支：計算中...")
+        tk.Label(root, textvariable=self.period_totals_var, justify=LEFT, anchor="w").pack(padx=10, fill=X)
+
         self.status_label = tk.Label(root, text="歡迎！", relief=SUNKEN, anchor=W)
         self.status_label.pack(side=BOTTOM, fill=X, ipady=2)
 
+        self.perf_label = tk.Label(root, text="", anchor=W, fg="gray")
+        self.perf_label.pack(side=BOTTOM, fill=X)
+        self.show_perf_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(root, text="在狀態列顯示效能資訊", variable=self.show_perf_var,
+                       command=lambda: self.perf_label.config(text="")).pack(side=BOTTOM, anchor=W, padx=10)
+        # 先在背景載入上次關閉時存的帳本快照；worker 只有一個，之後的查詢都排在它後面，拿到的就是載好的帳本
+        self.run_in_background(self.root, None, load_ledger_snapshot, (), self.on_snapshot_loaded)
+        self.refresh_period_totals()
+
+    def on_snapshot_loaded(self, result):
+        success, message = result
+        if not success: # 載入失敗也不要緊，第一次查詢時會照常解析
+            self.status_label.config(text=f"帳本快照沒有用上：{message}")
+
+    def refresh_period_totals(self):
+        """更新主視窗上「本月／今年」的收支合計；只查合計走前綴和索引，帳再多也是瞬間的事。"""
+        today = datetime.now()
+        month_start = today.strftime("%Y-%m-01")
+        year_start = today.strftime("%Y-01-01")
+        end_str = today.strftime("%Y-%m-%d")
+        def query_both():
+            return get_range_totals(month_start, end_str), get_range_totals(year_start, end_str)
+        def show_period_totals(results):
+            lines = []
+            for label, (success, data_or_message) in zip(("本月", "今年"), results):
+                if success:
+                    lines.append(f"{label}：收入 {data_or_message['total_income']:.2f}、支出 {data_or_message['total_expense']:.2f}、"
+                                 f"淨餘額 {data_or_message['net_balance']:.2f}")
+                else:
+                    lines.append(f"{label}：{data_or_message}")
+            self.period_totals_var.set("\n".join(lines))
+        self.run_in_background(self.root, None, query_both, (), show_period_totals)
+
+    def update_perf_label(self, operation_name):
+        """勾選顯示效能資訊時，把剛剛那次查詢的耗時與掃描筆數顯示在狀態列上方。"""
+        if self.show_perf_var.get():
+            stats_text = format_operation_stats(operation_name)
+            self.perf_label.config(text=f"{operation_name}：{stats_text}" if stats_text else "")
+
+    def run_in_background(self, owner, busy_text, func, args, on_done):
+        """
+        在背景執行緒呼叫 func(*args)，完成後回到主執行緒呼叫 on_done(結果)。
+        busy_text 為 None 時不改動狀態列與效能資訊（給順手更新畫面的小查詢用）。
+        執行期間 owner 視窗底部會出現進度列與「取消」按鈕；
+        視窗已經關掉的話就不再呼叫 on_done。
+        """
+        cancel_event = threading.Event()
+        future = self.executor.submit(run_cancellable, cancel_event, func, *args)
+        self._begin_busy(owner, future, cancel_event)
+        if busy_text:
+            self.status_label.config(text=busy_text)
+
+        def check_done():
+            if not future.done():
+                self.root.after(POLL_INTERVAL_MS, check_done)
+                return
+            self._end_busy(owner, future)
+            if not owner.winfo_exists():
+                self.show_budget_alerts()
+                return
+            try:
+                result = future.result()
+            except (OperationCancelled, CancelledError):
+                self.status_label.config(text="已取消。")
+                return
+            except Exception as e:
+                messagebox.showerror("發生錯誤", f"執行時發生未預期的錯誤：{e}", parent=owner)
+                self.status_label.config(text=f"執行失敗: {e}")
+                return
+            if busy_text:
+                self.update_perf_label(func.__name__)
+            on_done(result)
+            self.show_budget_alerts()
+
+        self.root.after(POLL_INTERVAL_MS, check_done)
+
+    def show_budget_alerts(self):
+        """顯示剛才的寫入觸發的預算提醒（快用完或超支），沒有就什麼都不做。"""
+        messages = []
+        while True:
+            try:
+                messages.append(self._budget_alerts.get_nowait()['message'])
+            except queue.Empty:
+                break
+        if messages:
+            self.quick_info_label.config(text="\n".join(messages))
+            messagebox.showwarning("預算提醒", "\n".join(messages), parent=self.root)
+
+    def _begin_busy(self, owner, future, cancel_event):
+        bar = self._busy_bars.get(owner)
+        if bar is None:
+            frame = Frame(owner)
+            progress = ttk.Progressbar(frame, mode='indeterminate')
+            progress.pack(side=LEFT, fill=X, expand=True, padx=10, pady=3)
+            Button(frame, text="取消", command=lambda: self.cancel_background_tasks(owner)).pack(side=RIGHT, padx=10, pady=3)
+            bar = self._busy_bars[owner] = {'frame': frame, 'progress': progress, 'tasks': {}}
+            if owner is not self.root:
+                # 視窗關掉時順便取消它還在跑的工作
+                owner.bind('<Destroy>', lambda event: self._forget_busy(owner) if event.widget is owner else None, add='+')
+        bar['tasks'][future] = cancel_event
+        if len(bar['tasks']) == 1:
+            pack_options = {'side': BOTTOM, 'fill': X}
+            packed = owner.pack_slaves()
+            if packed:
+                pack_options['before'] = packed[0] # 排在最前面打包，視窗再小也一定看得到
+            bar['frame'].pack(**pack_options)
+            bar['progress'].start(15)
+
+    def _end_busy(self, owner, future):
+        bar = self._busy_bars.get(owner)
+        if bar is None:
+            return
+        bar['tasks'].pop(future, None)
+        if not bar['tasks'] and owner.winfo_exists():
+            bar['progress'].stop()
+            bar['frame'].pack_forget()
+
+    def _forget_busy(self, owner):
+        self.cancel_background_tasks(owner)
+        self._busy_bars.pop(owner, None)
+
+    def cancel_background_tasks(self, owner=None):
+        """取消 owner 視窗（沒給的話就是全部視窗）還在排隊或執行中的背景工作。"""
+        if owner is None:
+            bars = list(self._busy_bars.values())
+        else:
+            bars = [self._busy_bars[owner]] if owner in self._busy_bars else []
+        for bar in bars:
+            for future, cancel_event in bar['tasks'].items():
+                cancel_event.set()
+                future.cancel()
+
+    def on_close(self):
+        self.cancel_background_tasks()
+        self.executor.shutdown(wait=False)
+        # 存快照可能要一兩秒，先把視窗藏起來；存不成功只是下次啟動慢一點
+        self.root.withdraw()
+        success, message = save_ledger_snapshot()
+        if not success:
+            print(message, file=sys.stderr)
+        self.root.destroy()
+
     def placeholder_action(self):
         messagebox.showinfo("提示", "這個功能還在努力開發中！")
         self.status_label.config(text="提示：此功能開發中。")
@@ -107,21 +425,26 @@ class AccountingApp:
                 messagebox.showerror("金額錯誤", "金額必須是有效的數字。", parent=add_window)
                 return
 
-            success, message = add_transaction_record(date_str, amount_val, trans_type, category, desc)
-            if success:
-                messagebox.showinfo("成功", message, parent=add_window)
-                self.status_label.config(text=f"交易已新增: {category} {amount_val}")
-                self.quick_info_label.config(text=f"剛新增一筆 '{trans_type}' 紀錄： {category}, 金額 {amount_val}元。")
-                date_entry.delete(0, tk.END)
-                date_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
-                amount_entry.delete(0, tk.END)
-                category_entry_add_trans.delete(0, tk.END)
-                desc_entry.delete(0, tk.END)
-                trans_type_var.set("支出")
-                add_window.destroy()
-            else:
-                messagebox.showerror("儲存失敗", message, parent=add_window)
-                self.status_label.config(text=f"新增交易失敗: {message}")
+            def on_saved(result):
+                success, message = result
+                if success:
+                    messagebox.showinfo("成功", message, parent=add_window)
+                    self.status_label.config(text=f"交易已新增: {category} {amount_val}")
+                    self.quick_info_label.config(text=f"剛新增一筆 '{trans_type}' 紀錄： {category}, 金額 {amount_val}元。")
+                    date_entry.delete(0, tk.END)
+                    date_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
+                    amount_entry.delete(0, tk.END)
+                    category_entry_add_trans.delete(0, tk.END)
+                    desc_entry.delete(0, tk.END)
+                    trans_type_var.set("支出")
+                    add_window.destroy()
+                    self.refresh_period_totals()
+                else:
+                    messagebox.showerror("儲存失敗", message, parent=add_window)
+                    self.status_label.config(text=f"新增交易失敗: {message}")
+
+            self.run_in_background(add_window, "正在儲存交易...", add_transaction_record,
+                                   (date_str, amount_val, trans_type, category, desc), on_saved)
 
         save_btn = Button(form_frame, text="儲存", command=save_transaction, width=12)
         save_btn.grid(row=5, column=0, columnspan=2, pady=20)
@@ -145,58 +468,155 @@ class AccountingApp:
         end_date_entry_view.grid(row=0, column=3, padx=5, pady=5)
         end_date_entry_view.insert(0, datetime.now().strftime("%Y-%m-%d"))
         search_btn_view = Button(input_frame, text="查詢", width=10) # Renamed
-        search_btn_view.grid(row=0, column=4, padx=10, pady=5)
+        search_btn_view.grid(row=0, column=4, rowspan=2, padx=10, pady=5)
+        Label(input_frame, text="關鍵字 (描述或類別):").grid(row=1, column=0, padx=5, pady=5, sticky=W)
+        keyword_entry_view = Entry(input_frame, width=40)
+        keyword_entry_view.grid(row=1, column=1, columnspan=3, padx=5, pady=5, sticky=W)
+        keyword_entry_view.bind('<Return>', lambda event: perform_search_view())
         input_frame.grid_columnconfigure(4, weight=1)
         results_frame_view = Frame(view_window, pady=5, padx=10) # Renamed
         results_frame_view.pack(expand=True, fill=BOTH)
         cols_view = ('date', 'type', 'amount', 'category', 'description') # Renamed
-        tree_view_trans = ttk.Treeview(results_frame_view, columns=cols_view, show='headings', height=10)
+        # 查詢結果可能有好幾萬筆，只放看得到的那幾列，資料捲到哪才向後端要到哪
+        def fetch_page_view(offset, limit, sort_key, descending, on_page):
+            start_str, end_str, keyword = query_range_view
+            def on_fetched(result):
+                success, data_or_message = result
+                if not success:
+                    on_page(None, 0)
+                    messagebox.showerror("查詢失敗", data_or_message, parent=view_window)
+                    self.status_label.config(text=f"查詢失敗: {data_or_message}")
+                    self.quick_info_label.config(text="查詢時發生錯誤。")
+                    return
+                on_page([(trans_item['date'], trans_item['type'], f"{trans_item['amount']:.2f}", trans_item['category'], trans_item['description'], trans_item['id'])
+                         for trans_item in data_or_message['transactions']], data_or_message['total_count'])
+                if offset == 0:
+                    show_search_summary(start_str, end_str, keyword, data_or_message)
+            self.run_in_background(view_window, "查詢交易紀錄中...", fetch_transactions_page,
+                                   (start_str, end_str, offset, limit, sort_key, descending, keyword), on_fetched)
+        paged_view_trans = PagedTreeview(results_frame_view, cols_view + ('id',), fetch_page_view)
+        tree_view_trans = paged_view_trans.tree
+        tree_view_trans.configure(displaycolumns=cols_view) # 交易編號只留著給修改、刪除用，不顯示
         for col_v in cols_view: # Renamed loop var
-            tree_view_trans.heading(col_v, text=col_v.capitalize())
             tree_view_trans.column(col_v, width=120, anchor='w')
         tree_view_trans.column('amount', anchor='e')
         tree_view_trans.column('description', width=200)
-        vsb_trans = ttk.Scrollbar(results_frame_view, orient="vertical", command=tree_view_trans.yview)
         hsb_trans = ttk.Scrollbar(results_frame_view, orient="horizontal", command=tree_view_trans.xview)
-        tree_view_trans.configure(yscrollcommand=vsb_trans.set, xscrollcommand=hsb_trans.set)
-        vsb_trans.pack(side=RIGHT, fill=Y)
+        tree_view_trans.configure(xscrollcommand=hsb_trans.set)
+        paged_view_trans.vsb.pack(side=RIGHT, fill=Y)
         tree_view_trans.pack(side=LEFT, fill=BOTH, expand=True)
         hsb_trans.pack(side=BOTTOM, fill=X)
+        query_range_view = (None, None, None)
+        actions_frame_trans = Frame(view_window, padx=10)
+        actions_frame_trans.pack(fill=X)
+        def selected_transaction_view():
+            values = paged_view_trans.selected_values()
+            if values is None:
+                messagebox.showinfo("提示", "請先在列表中選一筆交易。", parent=view_window)
+            return values
+        def edit_selected_view():
+            values = selected_transaction_view()
+            if values is not None:
+                self.open_edit_transaction_window(view_window, values, lambda: paged_view_trans.reload(keep_position=True))
+        def delete_selected_view():
+            values = selected_transaction_view()
+            if values is None:
+                return
+            date_str, trans_type, amount_str, category, _, transaction_id = values
+            if not messagebox.askyesno("確認刪除", f"確定要刪除這筆交易嗎？\n{date_str} {trans_type} {category} {amount_str} 元", parent=view_window):
+                return
+            def on_deleted(result):
+                success, message = result
+                if success:
+                    self.status_label.config(text=f"交易已刪除: {date_str} {category} {amount_str}")
+                    paged_view_trans.reload(keep_position=True)
+                    self.refresh_period_totals()
+                else:
+                    messagebox.showerror("刪除失敗", message, parent=view_window)
+                    self.status_label.config(text=f"刪除交易失敗: {message}")
+            self.run_in_background(view_window, "正在刪除交易...", delete_transaction, (transaction_id,), on_deleted)
+        Button(actions_frame_trans, text="修改選取的紀錄", command=edit_selected_view).pack(side=LEFT, padx=5)
+        Button(actions_frame_trans, text="刪除選取的紀錄", command=delete_selected_view).pack(side=LEFT, padx=5)
+        tree_view_trans.bind('<Double-1>', lambda event: edit_selected_view())
         summary_frame_trans = Frame(view_window, pady=10, padx=10)
         summary_frame_trans.pack(fill=X)
         summary_text_var_trans = StringVar()
         summary_label_trans = Label(summary_frame_trans, textvariable=summary_text_var_trans, justify=LEFT, anchor="w", font=("Arial", 10))
         summary_label_trans.pack(fill=X)
         summary_text_var_trans.set("請輸入日期範圍並點擊查詢。")
-        def perform_search_view(): # Renamed
-            start_str = start_date_entry_view.get()
-            end_str = end_date_entry_view.get()
-            for i in tree_view_trans.get_children(): tree_view_trans.delete(i)
-            summary_text_var_trans.set("")
-            success, data_or_message = fetch_transactions(start_str, end_str)
-            if success:
-                transactions = data_or_message['transactions']
-                if transactions:
-                    for trans_item in transactions: # Renamed loop var
-                        tree_view_trans.insert('', 'end', values=(trans_item['date'], trans_item['type'], f"{float(trans_item['amount']):.2f}", trans_item['category'], trans_item['description']))
-                    summary_text_var_trans.set(
-                        f"查詢期間：{start_str} 至 {end_str}\n"
-                        f"總收入：{data_or_message['total_income']:.2f}\n"
-                        f"總支出：{data_or_message['total_expense']:.2f}\n"
-                        f"淨餘額：{data_or_message['net_balance']:.2f}"
-                    )
-                    self.status_label.config(text=f"查詢完成，共 {len(transactions)} 筆交易。")
-                    self.quick_info_label.config(text=f"顯示 {start_str} 到 {end_str} 的交易。淨餘額: {data_or_message['net_balance']:.2f}")
-                else:
-                    summary_text_var_trans.set(f"在 {start_str} 至 {end_str} 期間沒有找到交易紀錄。")
-                    self.status_label.config(text="查詢完成，沒有找到交易紀錄。")
-                    self.quick_info_label.config(text=f"在 {start_str} 到 {end_str} 期間沒有交易。")
+        def show_search_summary(start_str, end_str, keyword, data_or_message):
+            total_count = data_or_message['total_count']
+            keyword_text = f"、關鍵字「{keyword}」" if keyword else ""
+            if total_count:
+                summary_text_var_trans.set(
+                    f"查詢期間：{start_str} 至 {end_str}{keyword_text}（共 {total_count} 筆，點欄位標題可排序）\n"
+                    f"總收入：{data_or_message['total_income']:.2f}\n"
+                    f"總支出：{data_or_message['total_expense']:.2f}\n"
+                    f"淨餘額：{data_or_message['net_balance']:.2f}"
+                )
+                self.status_label.config(text=f"查詢完成，共 {total_count} 筆交易。")
+                self.quick_info_label.config(text=f"顯示 {start_str} 到 {end_str} 的交易。淨餘額: {data_or_message['net_balance']:.2f}")
             else:
-                messagebox.showerror("查詢失敗", data_or_message, parent=view_window)
-                self.status_label.config(text=f"查詢失敗: {data_or_message}")
-                self.quick_info_label.config(text="查詢時發生錯誤。")
+                summary_text_var_trans.set(f"在 {start_str} 至 {end_str} 期間{keyword_text}沒有找到交易紀錄。")
+                self.status_label.config(text="查詢完成，沒有找到交易紀錄。")
+                self.quick_info_label.config(text=f"在 {start_str} 到 {end_str} 期間沒有交易。")
+        def perform_search_view(): # Renamed
+            nonlocal query_range_view
+            query_range_view = (start_date_entry_view.get(), end_date_entry_view.get(), keyword_entry_view.get().strip() or None)
+            summary_text_var_trans.set("查詢中...")
+            paged_view_trans.reload()
         search_btn_view.config(command=perform_search_view) # Use renamed function
 
+    def open_edit_transaction_window(self, parent, values, on_saved):
+        """修改一筆交易的視窗；values 為查詢列表中那一列的 (日期, 類型, 金額, 類別, 描述, 編號)。"""
+        date_str, trans_type, amount_str, category, desc, transaction_id = values
+        edit_window = Toplevel(parent)
+        edit_window.title("修改交易紀錄")
+        edit_window.geometry("380x300")
+        edit_window.transient(parent)
+        edit_window.grab_set()
+
+        form_frame = Frame(edit_window, pady=15, padx=15)
+        form_frame.pack(expand=True, fill=BOTH)
+        entries = {}
+        for row_idx, (field, label, value) in enumerate([('date', "日期 (YYYY-MM-DD):", date_str), ('amount', "金額:", amount_str),
+                                                         ('category', "類別:", category), ('description', "描述:", desc)]):
+            grid_row = row_idx if row_idx < 2 else row_idx + 1 # 類型放在第三列
+            Label(form_frame, text=label).grid(row=grid_row, column=0, sticky=W, pady=3)
+            entry = Entry(form_frame, width=28)
+            entry.grid(row=grid_row, column=1, pady=3, sticky=E)
+            entry.insert(0, value)
+            entries[field] = entry
+        Label(form_frame, text="類型:").grid(row=2, column=0, sticky=W, pady=3)
+        trans_type_var = StringVar(value=trans_type)
+        type_frame = Frame(form_frame)
+        Radiobutton(type_frame, text="收入", variable=trans_type_var, value="收入").pack(side=LEFT, padx=5)
+        Radiobutton(type_frame, text="支出", variable=trans_type_var, value="支出").pack(side=LEFT, padx=5)
+        type_frame.grid(row=2, column=1, sticky=E, pady=2)
+
+        def save_edit():
+            new_values = {field: entry.get().strip() for field, entry in entries.items()}
+            if not new_values['date'] or not new_values['amount'] or not new_values['category']:
+                messagebox.showerror("輸入錯誤", "日期、金額和類別為必填欄位。", parent=edit_window)
+                return
+            def on_edited(result):
+                success, message = result
+                if success:
+                    self.status_label.config(text=f"交易已修改: {new_values['category']} {new_values['amount']}")
+                    edit_window.destroy()
+                    parent.grab_set() # 把操作權還給原本的視窗
+                    on_saved()
+                    self.refresh_period_totals()
+                else:
+                    messagebox.showerror("修改失敗", message, parent=edit_window)
+                    self.status_label.config(text=f"修改交易失敗: {message}")
+            self.run_in_background(edit_window, "正在修改交易...", edit_transaction,
+                                   (transaction_id, new_values['date'], new_values['amount'], trans_type_var.get(),
+                                    new_values['category'], new_values['description']), on_edited)
+
+        Button(form_frame, text="儲存修改", command=save_edit, width=12).grid(row=5, column=0, columnspan=2, pady=20)
+        form_frame.grid_columnconfigure(1, weight=1)
+
     def open_category_summary_window(self):
         self.status_label.config(text="開啟類別統計視窗...")
         summary_window = Toplevel(self.root)
@@ -227,9 +647,11 @@ class AccountingApp:
         vsb_cat_sum.pack(side=RIGHT, fill=Y)
         tree_cat_sum.pack(side=LEFT, fill=BOTH, expand=True)
         def display_cat_summary_data(): # Renamed
-            self.status_label.config(text="正在更新類別統計...")
             for i in tree_cat_sum.get_children(): tree_cat_sum.delete(i)
-            success, data_or_message = get_category_expense_summary()
+            total_expenses_var_cat_sum.set("總支出：計算中...")
+            self.run_in_background(summary_window, "正在更新類別統計...", get_category_expense_summary, (), show_cat_summary_data)
+        def show_cat_summary_data(result):
+            success, data_or_message = result
             if success:
                 summary_data_list = data_or_message['category_summary'] # Renamed
                 total_expenses_val = data_or_message['total_expenses'] # Renamed
@@ -284,10 +706,11 @@ class AccountingApp:
         tree_budgets.pack(side=LEFT, fill=BOTH, expand=True)
         vsb_budgets.pack(side=RIGHT, fill=Y)
         def refresh_budgets_display_sb(): # Renamed
-            self.status_label.config(text="正在讀取預算列表...")
             for i in tree_budgets.get_children():
                 tree_budgets.delete(i)
-            success, budgets_or_error = get_all_budgets()
+            self.run_in_background(budget_window, "正在讀取預算列表...", get_all_budgets, (), show_budgets_sb)
+        def show_budgets_sb(result):
+            success, budgets_or_error = result
             if success:
                 budgets_dict = budgets_or_error # Renamed
                 if budgets_dict:
@@ -329,17 +752,19 @@ class AccountingApp:
             except ValueError:
                 messagebox.showerror("金額錯誤", "預算金額必須是有效的數字。", parent=budget_window)
                 return
-            success_upd, message_upd = update_budget(category_val, amount_float) # Renamed
-            if success_upd:
-                messagebox.showinfo("成功", message_upd, parent=budget_window)
-                self.status_label.config(text=message_upd)
-                self.quick_info_label.config(text=f"預算已更新: {category_val} = {amount_float:.2f}")
-                category_entry_budget.delete(0, tk.END)
-                amount_entry_budget.delete(0, tk.END)
-                refresh_budgets_display_sb() # Use renamed function
-            else:
-                messagebox.showerror("儲存失敗", message_upd, parent=budget_window)
-                self.status_label.config(text=f"預算儲存失敗: {message_upd}")
+            def on_budget_saved(result):
+                success_upd, message_upd = result # Renamed
+                if success_upd:
+                    messagebox.showinfo("成功", message_upd, parent=budget_window)
+                    self.status_label.config(text=message_upd)
+                    self.quick_info_label.config(text=f"預算已更新: {category_val} = {amount_float:.2f}")
+                    category_entry_budget.delete(0, tk.END)
+                    amount_entry_budget.delete(0, tk.END)
+                    refresh_budgets_display_sb() # Use renamed function
+                else:
+                    messagebox.showerror("儲存失敗", message_upd, parent=budget_window)
+                    self.status_label.config(text=f"預算儲存失敗: {message_upd}")
+            self.run_in_background(budget_window, "正在儲存預算...", update_budget, (category_val, amount_float), on_budget_saved)
         save_budget_btn.config(command=save_new_or_updated_budget_sb) # Use renamed function
         refresh_budgets_display_sb() # Call renamed function
 
@@ -380,10 +805,13 @@ class AccountingApp:
         def display_budget_usage_data_bu(): # Renamed
             target_month_bu = datetime.now().strftime('%Y-%m') # Renamed
             current_month_label_var.set(f"顯示月份：{target_month_bu}")
-            self.status_label.config(text=f"正在更新 {target_month_bu} 的預算使用情況...")
             for i in tree_usage.get_children():
                 tree_usage.delete(i)
-            success_budg_usage, data_or_message_bu = get_budget_usage_details(target_month_str=target_month_bu) # Renamed
+            self.run_in_background(usage_window, f"正在更新 {target_month_bu} 的預算使用情況...",
+                                   get_budget_usage_details, (target_month_bu,),
+                                   lambda result: show_budget_usage_data_bu(target_month_bu, result))
+        def show_budget_usage_data_bu(target_month_bu, result):
+            success_budg_usage, data_or_message_bu = result # Renamed
             if success_budg_usage:
                 usage_data_list = data_or_message_bu # Renamed
                 if usage_data_list:
@@ -410,6 +838,211 @@ class AccountingApp:
         refresh_usage_btn.config(command=display_budget_usage_data_bu) # Use renamed function
         display_budget_usage_data_bu() # Call renamed function
 
+    def open_dashboard_window(self):
+        """收支、類別統計、預算使用放在同一個視窗，三塊都由 compute_dashboard 的同一份結果填入。"""
+        self.status_label.config(text="開啟總覽視窗...")
+        dash_window = Toplevel(self.root)
+        dash_window.title("總覽")
+        dash_window.geometry("760x640")
+        dash_window.transient(self.root)
+        dash_window.grab_set()
+        input_frame_dash = Frame(dash_window, pady=10, padx=10)
+        input_frame_dash.pack(fill=X)
+        Label(input_frame_dash, text="開始日期:").grid(row=0, column=0, padx=5, pady=5, sticky=W)
+        start_date_entry_dash = Entry(input_frame_dash, width=12)
+        start_date_entry_dash.grid(row=0, column=1, padx=5, pady=5)
+        start_date_entry_dash.insert(0, (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d"))
+        Label(input_frame_dash, text="結束日期:").grid(row=0, column=2, padx=5, pady=5, sticky=W)
+        end_date_entry_dash = Entry(input_frame_dash, width=12)
+        end_date_entry_dash.grid(row=0, column=3, padx=5, pady=5)
+        end_date_entry_dash.insert(0, datetime.now().strftime("%Y-%m-%d"))
+        Label(input_frame_dash, text="預算月份:").grid(row=0, column=4, padx=5, pady=5, sticky=W)
+        month_entry_dash = Entry(input_frame_dash, width=9)
+        month_entry_dash.grid(row=0, column=5, padx=5, pady=5)
+        month_entry_dash.insert(0, datetime.now().strftime("%Y-%m"))
+        refresh_btn_dash = Button(input_frame_dash, text="重新整理", width=10)
+        refresh_btn_dash.grid(row=0, column=6, padx=10, pady=5)
+        range_text_var_dash = StringVar(value="計算中...")
+        Label(dash_window, textvariable=range_text_var_dash, justify=LEFT, anchor="w", font=("Arial", 10)).pack(fill=X, padx=15)
+        panels_frame_dash = Frame(dash_window, padx=10, pady=5)
+        panels_frame_dash.pack(expand=True, fill=BOTH)
+        cat_frame_dash = ttk.LabelFrame(panels_frame_dash, text="各類別支出")
+        cat_frame_dash.pack(side=TOP, expand=True, fill=BOTH, pady=3)
+        tree_cat_dash = ttk.Treeview(cat_frame_dash, columns=('category', 'amount', 'percentage'), show='headings', height=7)
+        for col_d, heading_d, width_d, anchor_d in (('category', '類別', 200, 'w'), ('amount', '金額 (元)', 100, 'e'), ('percentage', '百分比 (%)', 100, 'e')):
+            tree_cat_dash.heading(col_d, text=heading_d)
+            tree_cat_dash.column(col_d, width=width_d, anchor=anchor_d)
+        vsb_cat_dash = ttk.Scrollbar(cat_frame_dash, orient="vertical", command=tree_cat_dash.yview)
+        tree_cat_dash.configure(yscrollcommand=vsb_cat_dash.set)
+        vsb_cat_dash.pack(side=RIGHT, fill=Y)
+        tree_cat_dash.pack(side=LEFT, fill=BOTH, expand=True)
+        usage_frame_dash = ttk.LabelFrame(panels_frame_dash, text="預算使用情況")
+        usage_frame_dash.pack(side=TOP, expand=True, fill=BOTH, pady=3)
+        cols_usage_dash = ('category', 'budget', 'spent', 'remaining', 'percentage_used')
+        tree_usage_dash = ttk.Treeview(usage_frame_dash, columns=cols_usage_dash, show='headings', height=7)
+        for col_d, heading_d in zip(cols_usage_dash, ('預算類別', '預算金額', '已使用金額', '剩餘金額', '使用率 (%)')):
+            tree_usage_dash.heading(col_d, text=heading_d)
+            tree_usage_dash.column(col_d, width=150 if col_d == 'category' else 100, anchor='w' if col_d == 'category' else 'e')
+        tree_usage_dash.tag_configure('warning', background='yellow')
+        tree_usage_dash.tag_configure('over', background='orangered')
+        vsb_usage_dash = ttk.Scrollbar(usage_frame_dash, orient="vertical", command=tree_usage_dash.yview)
+        tree_usage_dash.configure(yscrollcommand=vsb_usage_dash.set)
+        vsb_usage_dash.pack(side=RIGHT, fill=Y)
+        tree_usage_dash.pack(side=LEFT, fill=BOTH, expand=True)
+        def display_dashboard():
+            start_str, end_str, month_str = start_date_entry_dash.get(), end_date_entry_dash.get(), month_entry_dash.get()
+            for tree_d in (tree_cat_dash, tree_usage_dash):
+                for i in tree_d.get_children():
+                    tree_d.delete(i)
+            range_text_var_dash.set("計算中...")
+            self.run_in_background(dash_window, "正在計算總覽...", compute_dashboard, (start_str, end_str, month_str),
+                                   lambda result: show_dashboard(start_str, end_str, result))
+        def show_dashboard(start_str, end_str, result):
+            success, data_or_message = result
+            if not success:
+                messagebox.showerror("總覽失敗", data_or_message, parent=dash_window)
+                range_text_var_dash.set("計算時發生錯誤。")
+                self.status_label.config(text=f"總覽計算失敗: {data_or_message}")
+                return
+            range_data = data_or_message['range']
+            cat_data = data_or_message['category_summary']
+            range_text_var_dash.set(
+                f"{start_str} 至 {end_str}：共 {len(range_data['transactions'])} 筆，"
+                f"收入 {range_data['total_income']:.2f}、支出 {range_data['total_expense']:.2f}、"
+                f"淨餘額 {range_data['net_balance']:.2f}\n"
+                f"全部支出合計：{cat_data['total_expenses']:.2f} 元；預算月份：{data_or_message['month']}"
+            )
+            for item_cs in cat_data['category_summary']:
+                tree_cat_dash.insert('', 'end', values=(item_cs['category'], f"{item_cs['amount']:.2f}", f"{item_cs['percentage']:.1f}%"))
+            for item_bu in data_or_message['budget_usage']:
+                tags_bu = ()
+                if item_bu['percentage_used'] > 100:
+                    tags_bu = ('over',)
+                elif item_bu['percentage_used'] >= 90:
+                    tags_bu = ('warning',)
+                tree_usage_dash.insert('', 'end', values=(
+                    item_bu['category'], f"{item_bu['budget']:.2f}",
+                    f"{item_bu['spent']:.2f}", f"{item_bu['remaining']:.2f}",
+                    f"{item_bu['percentage_used']:.1f}%"
+                ), tags=tags_bu)
+            self.status_label.config(text="總覽已更新。")
+            self.quick_info_label.config(text=f"總覽：{start_str} 到 {end_str} 淨餘額 {range_data['net_balance']:.2f}")
+        refresh_btn_dash.config(command=display_dashboard)
+        display_dashboard()
+
+    def open_trend_window(self):
+        self.status_label.config(text="開啟收支趨勢視窗...")
+        trend_window = Toplevel(self.root)
+        trend_window.title("收支趨勢")
+        trend_window.geometry("720x520")
+        trend_window.transient(self.root)
+        trend_window.grab_set()
+        input_frame_trend = Frame(trend_window, pady=10, padx=10)
+        input_frame_trend.pack(fill=X)
+        Label(input_frame_trend, text="開始日期:").grid(row=0, column=0, padx=5, pady=5, sticky=W)
+        start_date_entry_trend = Entry(input_frame_trend, width=12)
+        start_date_entry_trend.grid(row=0, column=1, padx=5, pady=5)
+        start_date_entry_trend.insert(0, datetime.now().replace(month=1, day=1).strftime("%Y-%m-%d"))
+        Label(input_frame_trend, text="結束日期:").grid(row=0, column=2, padx=5, pady=5, sticky=W)
+        end_date_entry_trend = Entry(input_frame_trend, width=12)
+        end_date_entry_trend.grid(row=0, column=3, padx=5, pady=5)
+        end_date_entry_trend.insert(0, datetime.now().strftime("%Y-%m-%d"))
+        Label(input_frame_trend, text="單位:").grid(row=0, column=4, padx=5, pady=5, sticky=W)
+        period_names_trend = {"日": 'day', "週": 'week', "月": 'month', "年": 'year'}
+        period_var_trend = StringVar(value="月")
+        ttk.Combobox(input_frame_trend, textvariable=period_var_trend, values=list(period_names_trend), width=4, state="readonly").grid(row=0, column=5, padx=5, pady=5)
+        show_btn_trend = Button(input_frame_trend, text="顯示", width=10)
+        show_btn_trend.grid(row=0, column=6, padx=10, pady=5)
+        tree_frame_trend = Frame(trend_window, pady=5, padx=10)
+        tree_frame_trend.pack(expand=True, fill=BOTH)
+        cols_trend = ('period', 'income', 'expense', 'net', 'top_expense')
+        tree_trend = ttk.Treeview(tree_frame_trend, columns=cols_trend, show='headings', height=15)
+        for col_t, heading_t, width_t, anchor_t in (('period', '時段', 110, 'w'), ('income', '收入', 110, 'e'), ('expense', '支出', 110, 'e'),
+                                                    ('net', '淨額', 110, 'e'), ('top_expense', '花最多的類別', 200, 'w')):
+            tree_trend.heading(col_t, text=heading_t)
+            tree_trend.column(col_t, width=width_t, anchor=anchor_t)
+        tree_trend.tag_configure('deficit', foreground='red')
+        vsb_trend = ttk.Scrollbar(tree_frame_trend, orient="vertical", command=tree_trend.yview)
+        tree_trend.configure(yscrollcommand=vsb_trend.set)
+        vsb_trend.pack(side=RIGHT, fill=Y)
+        tree_trend.pack(side=LEFT, fill=BOTH, expand=True)
+        def display_trend():
+            start_str, end_str = start_date_entry_trend.get(), end_date_entry_trend.get()
+            for i in tree_trend.get_children():
+                tree_trend.delete(i)
+            self.run_in_background(trend_window, "正在計算收支趨勢...", get_trend_report,
+                                   (start_str, end_str, period_names_trend[period_var_trend.get()]), show_trend)
+        def show_trend(result):
+            success, data_or_message = result
+            if not success:
+                messagebox.showerror("計算趨勢失敗", data_or_message, parent=trend_window)
+                self.status_label.config(text=f"計算趨勢失敗: {data_or_message}")
+                return
+            for label_t, inc_t, exp_t, net_t, top_t in zip(data_or_message['labels'], data_or_message['income'], data_or_message['expense'],
+                                                           data_or_message['net'], data_or_message['top_expense']):
+                tree_trend.insert('', 'end', values=(label_t, f"{inc_t:.2f}", f"{exp_t:.2f}", f"{net_t:.2f}",
+                                                      f"{top_t[0]} ({top_t[1]:.2f})" if top_t else "-"),
+                                  tags=('deficit',) if net_t < 0 else ())
+            self.status_label.config(text=f"收支趨勢已更新，共 {len(data_or_message['labels'])} 個時段。")
+        show_btn_trend.config(command=display_trend)
+        display_trend()
+
+    def open_recent_transactions_window(self):
+        self.status_label.config(text="開啟最近記的帳...")
+        recent_window = Toplevel(self.root)
+        recent_window.title("最近記的帳")
+        recent_window.geometry("750x500")
+        recent_window.transient(self.root)
+        recent_window.grab_set()
+        Label(recent_window, text="依記帳順序列出所有交易（點「列號」可切換新到舊／舊到新，雙擊可修改）。",
+              anchor=W, padx=10, pady=8).pack(fill=X)
+        results_frame_recent = Frame(recent_window, pady=5, padx=10)
+        results_frame_recent.pack(expand=True, fill=BOTH)
+        cols_recent = ('row', 'date', 'type', 'amount', 'category', 'description')
+        # 後端依列號直接跳到那幾列，不用先載入整份帳本，捲到多後面都一樣快
+        def fetch_page_recent(offset, limit, sort_key, descending, on_page):
+            def on_fetched(result):
+                success, data_or_message = result
+                if not success:
+                    on_page(None, 0)
+                    messagebox.showerror("讀取失敗", data_or_message, parent=recent_window)
+                    self.status_label.config(text=f"讀取交易紀錄失敗: {data_or_message}")
+                    return
+                total_rows = data_or_message['total_rows']
+                rows = []
+                for i, trans_item in enumerate(data_or_message['transactions']):
+                    row_number = total_rows - offset - i if descending else offset + i + 1
+                    if trans_item is None:
+                        rows.append((row_number, "", "", "", "", "（已刪除或格式錯誤）", ""))
+                    else:
+                        rows.append((row_number, trans_item['date'], trans_item['type'], f"{trans_item['amount']:.2f}",
+                                     trans_item['category'], trans_item['description'], trans_item['id']))
+                on_page(rows, total_rows)
+                if offset == 0:
+                    self.status_label.config(text=f"共 {total_rows} 列交易紀錄。")
+            self.run_in_background(recent_window, "讀取交易紀錄中...", fetch_transaction_rows,
+                                   (offset, limit, descending), on_fetched)
+        paged_view_recent = PagedTreeview(results_frame_recent, cols_recent + ('id',), fetch_page_recent,
+                                          headings={'row': "列號", 'date': "日期", 'type': "類型", 'amount': "金額",
+                                                    'category': "類別", 'description': "描述", 'id': "編號"},
+                                          sort_key='row', descending=True) # 預設最新記的在最上面
+        tree_recent = paged_view_recent.tree
+        tree_recent.configure(displaycolumns=cols_recent)
+        for col_r in cols_recent[1:]:
+            tree_recent.heading(col_r, command='') # 只能依記帳順序排，其他欄位不能點
+            tree_recent.column(col_r, width=110, anchor='w')
+        tree_recent.column('row', width=70, anchor='e')
+        tree_recent.column('amount', anchor='e')
+        tree_recent.column('description', width=200)
+        paged_view_recent.vsb.pack(side=RIGHT, fill=Y)
+        tree_recent.pack(side=LEFT, fill=BOTH, expand=True)
+        def edit_selected_recent():
+            values = paged_view_recent.selected_values()
+            if values is not None and values[-1]: # 已刪除或格式錯誤的列沒有編號，不能改
+                self.open_edit_transaction_window(recent_window, values[1:], lambda: paged_view_recent.reload(keep_position=True))
+        tree_recent.bind('<Double-1>', lambda event: edit_selected_recent())
+        paged_view_recent.reload()
+
     def open_export_report_window(self):
         self.status_label.config(text="開啟匯出報表視窗...")
         export_window = Toplevel(self.root)
@@ -460,19 +1093,104 @@ class AccountingApp:
                 self.status_label.config(text="匯出已取消。")
                 return
 
-            success, message = export_transactions_to_csv(start_str, end_str, filepath)
-            if success:
-                messagebox.showinfo("成功", message, parent=export_window)
-                self.status_label.config(text="報表匯出成功！")
-                self.quick_info_label.config(text=f"報表已儲存到 {filepath}")
-                export_window.destroy()
-            else:
-                messagebox.showerror("匯出失敗", message, parent=export_window)
-                self.status_label.config(text=f"報表匯出失敗: {message}")
+            def on_exported(result):
+                success, message = result
+                if success:
+                    messagebox.showinfo("成功", message, parent=export_window)
+                    self.status_label.config(text="報表匯出成功！")
+                    self.quick_info_label.config(text=f"報表已儲存到 {filepath}")
+                    export_window.destroy()
+                else:
+                    messagebox.showerror("匯出失敗", message, parent=export_window)
+                    self.status_label.config(text=f"報表匯出失敗: {message}")
+
+            self.run_in_background(export_window, "正在匯出報表...", export_transactions_to_csv,
+                                   (start_str, end_str, filepath), on_exported)
 
         export_btn = Button(form_frame_export, text="選擇位置並匯出 CSV", command=do_export_csv)
         export_btn.grid(row=2, column=0, columnspan=2, pady=20)
 
+    def open_import_file_window(self):
+        self.status_label.config(text="開啟匯入檔案視窗...")
+        import_window = Toplevel(self.root)
+        import_window.title("從 CSV 檔匯入交易紀錄")
+        import_window.geometry("520x480")
+        import_window.transient(self.root)
+        import_window.grab_set()
+
+        form_frame_import = Frame(import_window, pady=10, padx=15)
+        form_frame_import.pack(fill=X)
+
+        Label(form_frame_import, text="來源檔案:").grid(row=0, column=0, padx=5, pady=3, sticky=W)
+        filepath_entry_import = Entry(form_frame_import, width=32)
+        filepath_entry_import.grid(row=0, column=1, padx=5, pady=3, sticky="ew")
+
+        def browse_import_file():
+            filepath = filedialog.askopenfilename(
+                filetypes=[("CSV 檔案", "*.csv"), ("所有檔案", "*.*")],
+                title="選擇要匯入的檔案",
+                parent=import_window
+            )
+            if filepath:
+                filepath_entry_import.delete(0, tk.END)
+                filepath_entry_import.insert(0, filepath)
+
+        Button(form_frame_import, text="瀏覽...", command=browse_import_file).grid(row=0, column=2, padx=5, pady=3)
+
+        Label(form_frame_import, text="來源檔的欄位名稱（留白表示同名欄位）:").grid(row=1, column=0, columnspan=3, padx=5, pady=(10, 3), sticky=W)
+        mapping_entries_import = {}
+        for row_idx, (field, label) in enumerate([('date', '日期'), ('amount', '金額'), ('type', '類型'),
+                                                  ('category', '類別'), ('description', '描述')], start=2):
+            Label(form_frame_import, text=f"{label} ({field}):").grid(row=row_idx, column=0, padx=5, pady=2, sticky=W)
+            mapping_entry = Entry(form_frame_import, width=20)
+            mapping_entry.grid(row=row_idx, column=1, padx=5, pady=2, sticky=W)
+            mapping_entries_import[field] = mapping_entry
+        Label(form_frame_import, text="沒有類型欄位時，負數視為支出、正數視為收入。", fg="gray").grid(row=7, column=0, columnspan=3, padx=5, sticky=W)
+
+        Label(form_frame_import, text="日期格式:").grid(row=8, column=0, padx=5, pady=3, sticky=W)
+        date_format_entry_import = Entry(form_frame_import, width=20)
+        date_format_entry_import.grid(row=8, column=1, padx=5, pady=3, sticky=W)
+        date_format_entry_import.insert(0, "%Y-%m-%d")
+        form_frame_import.grid_columnconfigure(1, weight=1)
+
+        result_frame_import = Frame(import_window, pady=5, padx=15)
+        result_frame_import.pack(expand=True, fill=BOTH)
+        result_text_import = Text(result_frame_import, height=8, wrap="word")
+        vsb_import = Scrollbar(result_frame_import, command=result_text_import.yview)
+        result_text_import.configure(yscrollcommand=vsb_import.set)
+        vsb_import.pack(side=RIGHT, fill=Y)
+        result_text_import.pack(side=LEFT, expand=True, fill=BOTH)
+
+        def do_import_file():
+            filepath = filepath_entry_import.get().strip()
+            if not filepath:
+                messagebox.showerror("輸入錯誤", "請先選擇要匯入的檔案。", parent=import_window)
+                return
+            column_mapping = {field: entry.get().strip() for field, entry in mapping_entries_import.items() if entry.get().strip()}
+            date_format = date_format_entry_import.get().strip() or "%Y-%m-%d"
+
+            def on_imported(result):
+                success, data_or_message = result
+                result_text_import.delete("1.0", tk.END)
+                if success:
+                    errors = data_or_message['errors']
+                    result_text_import.insert(tk.END, f"成功新增 {data_or_message['added']} 筆，略過 {len(errors)} 筆。\n")
+                    for line_number, message in errors[:200]:
+                        result_text_import.insert(tk.END, f"第 {line_number} 行：{message}\n")
+                    if len(errors) > 200:
+                        result_text_import.insert(tk.END, f"……還有 {len(errors) - 200} 筆錯誤沒有列出。\n")
+                    self.status_label.config(text=f"匯入完成：新增 {data_or_message['added']} 筆。")
+                    self.quick_info_label.config(text=f"已從 {filepath} 匯入 {data_or_message['added']} 筆交易。")
+                    self.refresh_period_totals()
+                else:
+                    messagebox.showerror("匯入失敗", data_or_message, parent=import_window)
+                    self.status_label.config(text=f"匯入失敗: {data_or_message}")
+
+            self.run_in_background(import_window, "正在匯入檔案...", import_transactions_from_csv,
+                                   (filepath, column_mapping, date_format), on_imported)
+
+        Button(import_window, text="開始匯入", command=do_import_file, width=14).pack(pady=10)
+
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""batch_report 的測試：python -m unittest test_batch_report（或 pytest）。"""
+
+import csv
+import json
+import os
+import unittest
+
+import batch_report
+import personal_accounting as pa
+from test_personal_accounting import LedgerTestCase
+
+
+class BatchReportTest(LedgerTestCase):
+    ROWS = [('2024-01-05', 100, '支出', '吃飯', 'lunch'),
+            ('2024-01-20', 3000, '收入', '薪水', 'pay'),
+            ('2024-02-03', 40.5, '支出', '交通', 'bus'),
+            ('2024-02-14', 950, '支出', '吃飯', 'dinner')]
+
+    def make_ledger(self, name, backend):
+        """用一般的 API 在 name 資料夾裡建一個帳本，內容各後端都一樣。"""
+        os.mkdir(name)
+        pa.TRANSACTIONS_FILE = os.path.join(name, 'transactions.csv')
+        pa.BUDGETS_FILE = os.path.join(name, 'budgets.csv')
+        pa.SQLITE_FILE = os.path.join(name, 'ledger.db')
+        pa.PARTITIONS_DIR = os.path.join(name, 'transactions_by_month')
+        pa.STORAGE_BACKEND = backend
+        pa.init_csvs()
+        for row in self.ROWS:
+            self.assertTrue(pa.add_transaction_record(*row)[0])
+        self.assertTrue(pa.update_budget('吃飯', 900)[0])
+        self.assertTrue(pa.update_budget('交通', 100)[0])
+        self._reset_caches()
+        return os.path.abspath(name)
+
+    def snapshot_files(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    files[path] = f.read()
+        return files
+
+    def test_reports_match_across_backends(self):
+        directories = [self.make_ledger(backend, backend) for backend in ('csv', 'partitioned', 'sqlite')]
+        with self.quiet():
+            results = batch_report.run_reports(directories, '2024-01-01', '2024-01-31', '2024-02', workers=1)
+        self.assertEqual([result['directory'] for result in results], directories)
+        reports = [result['report'] for result in results]
+        self.assertEqual([report['backend'] for report in reports], ['csv', 'partitioned', 'sqlite'])
+        self.assertEqual(reports[0]['range_totals'], {'start_date': '2024-01-01', 'end_date': '2024-01-31', 'total_income': 3000.0,
+                                                      'total_expense': 100.0, 'net_balance': 2900.0, 'count': 2})
+        self.assertEqual(reports[0]['category_summary']['total_expenses'], 1090.5)
+        self.assertEqual([(item['category'], round(item['percentage_used'], 2)) for item in reports[0]['budget_usage']],
+                         [('吃飯', 105.56), ('交通', 40.5)])
+        for report in reports[1:]:
+            with self.subTest(report['backend']):
+                for key in ('range_totals', 'category_summary', 'budget_usage', 'malformed_rows', 'month'):
+                    self.assertEqual(report[key], reports[0][key], key)
+
+    def test_reports_do_not_modify_ledgers(self):
+        directories = [self.make_ledger(backend, backend) for backend in ('csv', 'partitioned', 'sqlite')]
+        before = self.snapshot_files()
+        with self.quiet():
+            batch_report.run_reports(directories, '2024-01-01', '2024-12-31', '2024-02', workers=1)
+        after = self.snapshot_files()
+        # 只多了月彙總這種可以重建的快取檔，帳本本身（交易、預算、資料庫）一個位元組都沒變
+        self.assertEqual({path: after[path] for path in before}, before)
+        self.assertTrue(all(path.endswith('_rollups.json') for path in set(after) - set(before)), sorted(after))
+        self.assertEqual(pa._LEDGERS, {}) # 算完就放掉
+
+    def test_failed_ledger_is_reported_without_stopping_the_batch(self):
+        good = self.make_ledger('good', 'csv')
+        os.mkdir('empty')
+        with self.quiet():
+            results = batch_report.run_reports(['empty', good, 'missing'], '2024-01-01', '2024-12-31', '2024-02', workers=1)
+        self.assertEqual(['report' in result for result in results], [False, True, False])
+        self.assertIn('不存在', results[0]['error'])
+        self.assertIn('不存在', results[2]['error'])
+        self.assertEqual(pa.build_ledger_report(good, '2024-12-31', '2024-01-01')[0], False)
+        self.assertEqual(pa.build_ledger_report(good, '2024-01-01', '2024-12-31', '2024-13')[0], False)
+
+    def test_malformed_rows_are_counted_and_warned(self):
+        good = self.make_ledger('good', 'csv')
+        with open(os.path.join('good', 'transactions.csv'), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['2024-03-01', 'abc', '支出', '吃飯', 'broken', 'x1'])
+        with self.quiet():
+            result, = batch_report.run_reports([good], '2024-01-01', '2024-12-31', '2024-02', workers=1)
+        self.assertEqual(result['report']['malformed_rows'], 1)
+        self.assertTrue(result['warnings'])
+
+    def test_main_writes_csv_and_returns_failure_code(self):
+        os.mkdir('ledgers')
+        os.chdir('ledgers')
+        self.make_ledger('alice', 'csv')
+        self.make_ledger('bob', 'sqlite')
+        os.chdir(self.directory)
+        with self.quiet():
+            self.assertEqual(batch_report.main(['--root', 'ledgers', '--start', '2024-01-01', '--end', '2024-12-31',
+                                                '--month', '2024-02', '--workers', '1', '--format', 'csv', '--output', 'out.csv']), 0)
+        with open('out.csv', newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(list(rows[0]), batch_report.CSV_FIELDS)
+        self.assertEqual([(os.path.basename(row['directory']), row['backend'], row['status']) for row in rows],
+                         [('alice', 'csv', 'ok'), ('bob', 'sqlite', 'ok')])
+        self.assertEqual({(row['total_expense'], row['top_category'], row['over_budget']) for row in rows},
+                         {('1090.5', '吃飯', '吃飯')})
+
+        os.mkdir(os.path.join('ledgers', 'carol'))
+        with self.quiet():
+            self.assertEqual(batch_report.main(['--root', 'ledgers', '--start', '2024-01-01', '--end', '2024-12-31',
+                                                '--month', '2024-02', '--workers', '1', '--output', 'out.json']), 1)
+        with open('out.json', encoding='utf-8') as f:
+            output = json.load(f)
+        self.assertEqual((output['meta']['ledgers'], output['meta']['failed']), (3, 1))
+        self.assertIn('error', output['ledgers'][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
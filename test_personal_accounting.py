@@ -0,0 +1,837 @@
+# -*- coding: utf-8 -*-
+"""personal_accounting 的回歸測試：python -m unittest test_personal_accounting（或 pytest）。"""
+
+import contextlib
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import personal_accounting as pa
+
+
+class LedgerTestCase(unittest.TestCase):
+    """每個測試都在自己的暫存資料夾裡跑，全域設定與快取在前後都會還原。"""
+
+    SETTINGS = ('TRANSACTIONS_FILE', 'BUDGETS_FILE', 'SQLITE_FILE', 'PARTITIONS_DIR', 'STORAGE_BACKEND')
+
+    def setUp(self):
+        self._saved = {name: getattr(pa, name) for name in self.SETTINGS}
+        self._cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        pa.TRANSACTIONS_FILE = 'transactions.csv'
+        pa.BUDGETS_FILE = 'budgets.csv'
+        pa.SQLITE_FILE = 'ledger.db'
+        pa.PARTITIONS_DIR = 'transactions_by_month'
+        pa.STORAGE_BACKEND = 'csv'
+        self._reset_caches()
+
+    def tearDown(self):
+        pa.set_write_buffering()
+        self._reset_caches()
+        for name, value in self._saved.items():
+            setattr(pa, name, value)
+        os.chdir(self._cwd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def _reset_caches():
+        pa._LEDGERS.clear()
+        pa._ROW_READERS.clear()
+        pa.clear_query_cache()
+        pa._budget_tracker.update(version=None, budgets=None, spent={})
+
+    def write_transactions(self, rows, fieldnames=('date', 'amount', 'type', 'category', 'description')):
+        with open(pa.TRANSACTIONS_FILE, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(rows)
+
+    @staticmethod
+    def touch_later(path):
+        """把修改時間往後調，檔案系統的時間精確度不夠時也看得出被改過。"""
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def quiet():
+        """格式錯誤的紀錄會在 stderr 印警告，測試時先關掉。"""
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            yield
+
+
+class RefreshTest(LedgerTestCase):
+    def test_rewrite_that_grows_file_reloads(self):
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch']])
+        self.assertTrue(pa.fetch_transactions('2024-01-01', '2024-01-31')[0])
+        self.write_transactions([['2024-01-03', '250', '支出', '房租', 'rent'],
+                                 ['2024-01-05', '100', '支出', '吃飯', 'lunch']])
+        self.touch_later(pa.TRANSACTIONS_FILE)
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertTrue(success, data)
+        self.assertEqual(data['total_expense'], 350.0)
+
+    def test_same_size_rewrite_reloads(self):
+        # 改的是第一列，檔尾那 64 個位元組完全沒變
+        rest = [['2024-01-06', '100', '支出', '房租', 'rent']] * 18
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch']] + rest)
+        self.assertEqual(pa.fetch_transactions('2024-01-01', '2024-01-31')[1]['total_expense'], 1900.0)
+        self.write_transactions([['2024-01-05', '900', '支出', '吃飯', 'lunch']] + rest)
+        self.touch_later(pa.TRANSACTIONS_FILE)
+        self.assertEqual(pa.fetch_transactions('2024-01-01', '2024-01-31')[1]['total_expense'], 2700.0)
+
+    def test_row_reader_same_size_rewrite_reindexes(self):
+        rest = [['2024-01-06', '100', '支出', '房租', 'rent']] * 18
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch']] + rest)
+        self.assertEqual(len(pa.fetch_transaction_rows(0, 100)[1]['transactions']), 19)
+        # 大小不變，但第一列變長、第二列變短，列的起點都移動了
+        self.write_transactions([['2024-01-05', '9000', '支出', '吃飯', 'lunch'],
+                                 ['2024-01-06', '100', '支出', '房租', 'ren']] + rest[1:])
+        self.touch_later(pa.TRANSACTIONS_FILE)
+        rows = pa.fetch_transaction_rows(0, 2, newest_first=False)[1]['transactions']
+        self.assertEqual([(row['amount'], row['description']) for row in rows], [(9000.0, 'lunch'), (100.0, 'ren')])
+
+
+
+class DateIndexTest(LedgerTestCase):
+    def test_newest_first_file_is_sorted_by_date(self):
+        # 銀行對帳單常見的新到舊順序；同一天的紀錄要維持檔案中的順序
+        self.write_transactions([['2024-01-09', '1', '支出', '吃飯', 'a'],
+                                 ['2024-01-05', '2', '支出', '吃飯', 'b'],
+                                 ['2024-01-05', '3', '支出', '吃飯', 'c'],
+                                 ['2024-01-01', '4', '收入', '薪水', 'd']])
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertTrue(success, data)
+        self.assertEqual([row['description'] for row in data['transactions']], ['d', 'b', 'c', 'a'])
+        success, data = pa.fetch_transactions('2024-01-05', '2024-01-05')
+        self.assertEqual([row['description'] for row in data['transactions']], ['b', 'c'])
+
+        with open(pa.TRANSACTIONS_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['2024-01-07', '5', '支出', '車錢', 'e'], ['2024-01-03', '6', '支出', '車錢', 'f']])
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertEqual([row['description'] for row in data['transactions']], ['d', 'f', 'b', 'c', 'e', 'a'])
+        self.assertEqual(data['total_expense'], 17.0)
+
+
+
+class RangeTotalsTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        # 小數點後兩位的金額用浮點數一直加會累積誤差；日期倒著寫，前綴和要先排序
+        self.rows = [[f'2024-{month:02d}-{day:02d}', f'{day * 1234 + month}.{(day * 7) % 100:02d}',
+                      '收入' if day % 4 == 0 else '支出', ['吃飯', '車錢', '房租'][day % 3], 'x']
+                     for month in range(12, 0, -1) for day in range(28, 0, -1)]
+        self.write_transactions(self.rows)
+
+    def expected(self, start, end):
+        income = expense = 0
+        for date_str, amount, trans_type, _, _ in self.rows:
+            if start <= date_str <= end:
+                cents = int(amount.replace('.', ''))
+                if trans_type == '收入':
+                    income += cents
+                else:
+                    expense += cents
+        return income / 100, expense / 100, (income - expense) / 100
+
+    def test_totals_are_exact_for_any_range(self):
+        for start, end in [('2024-01-01', '2024-12-31'), ('2024-03-15', '2024-10-02'), ('2024-06-07', '2024-06-07'),
+                           ('2023-01-01', '2023-12-31')]:
+            with self.subTest(start=start, end=end):
+                success, data = pa.get_range_totals(start, end)
+                self.assertTrue(success, data)
+                self.assertEqual((data['total_income'], data['total_expense'], data['net_balance']), self.expected(start, end))
+
+    def test_prefix_follows_appends_edits_and_deletes(self):
+        self.assertEqual(pa.get_range_totals('2024-12-01', '2025-01-31')[1]['transaction_count'], 28)
+        december_expense = self.expected('2024-12-01', '2024-12-31')[1]
+        with open(pa.TRANSACTIONS_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['2025-01-03', '10.01', '支出', '吃飯', 'tail'], # 接在尾端
+                                     ['2024-12-05', '0.02', '支出', '新類別', 'back-dated']]) # 要重建
+        self.rows += [['2025-01-03', '10.01', '支出', '吃飯', 'tail'], ['2024-12-05', '0.02', '支出', '新類別', 'back-dated']]
+        success, data = pa.get_range_totals('2024-12-01', '2025-01-31')
+        self.assertEqual(data['transaction_count'], 30)
+        self.assertEqual(data['total_expense'], self.expected('2024-12-01', '2025-01-31')[1])
+        self.assertEqual(data['category_expenses']['新類別'], 0.02)
+
+        rows = {row['description']: row for row in pa.fetch_transactions('2024-12-01', '2025-01-31')[1]['transactions']}
+        self.assertTrue(pa.delete_transaction(rows['tail']['id'])[0])
+        self.assertTrue(pa.edit_transaction(rows['back-dated']['id'], '2023-06-01', 0.02, '支出', '新類別', 'moved')[0])
+        success, data = pa.get_range_totals('2024-12-01', '2025-01-31')
+        self.assertEqual(data['transaction_count'], 28)
+        self.assertEqual(data['total_expense'], december_expense)
+        self.assertNotIn('新類別', data['category_expenses'])
+        self.assertEqual(pa.get_range_totals('2023-01-01', '2023-12-31')[1]['category_expenses'], {'新類別': 0.02})
+
+    def test_trend_buckets_add_up_to_range_totals(self):
+        success, trend = pa.get_trend_report('2024-01-01', '2024-12-31', 'year')
+        self.assertTrue(success, trend)
+        income, expense, net = self.expected('2024-01-01', '2024-12-31')
+        self.assertEqual((trend['income'], trend['expense'], trend['net']), ([income], [expense], [net]))
+
+
+class BackendParityTest(LedgerTestCase):
+    """同一份交易放進三種後端，每個查詢的合計都要一模一樣（金額一律用分加總，最後才換成元）。"""
+
+    ROWS = [(f'2024-{month:02d}-{day:02d}', f'{(day * 7919 + month * 104729) % 90000 / 100 + 0.01:.2f}',
+             '收入' if day % 5 == 0 else '支出', ['吃飯', '車錢', '房租', ''][(day + month) % 4], f'item{day} note')
+            for month in (1, 2, 3, 12) for day in range(1, 29)]
+
+    def load(self, backend):
+        self._reset_caches()
+        pa.STORAGE_BACKEND = backend
+        pa.init_csvs()
+        with open('source.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['date', 'amount', 'type', 'category', 'description'])
+            writer.writerows(self.ROWS)
+        success, data = pa.import_transactions_from_csv('source.csv')
+        self.assertTrue(success, data)
+        self.assertTrue(pa.update_budget('吃飯', 5000)[0])
+
+    def results(self):
+        queries = {
+            'fetch': lambda: pa.fetch_transactions('2024-01-10', '2024-12-20'),
+            'page': lambda: pa.fetch_transactions_page('2024-01-10', '2024-12-20', 5, 10, 'amount', True),
+            'range': lambda: pa.get_range_totals('2024-01-10', '2024-12-20'),
+            'range_months': lambda: pa.get_range_totals('2024-01-01', '2024-03-31'),
+            'search': lambda: pa.search_transactions('note'),
+            'summary': pa.get_category_expense_summary,
+            'budget': lambda: pa.get_budget_usage_details('2024-02'),
+            'dashboard': lambda: pa.compute_dashboard('2024-01-10', '2024-12-20', '2024-03'),
+            'group': lambda: pa.group_transactions(['category', 'type'], ['sum', 'count', 'mean', 'min', 'max']),
+            'group_months': lambda: pa.group_transactions(['month'], ['sum'], '2024-01-01', '2024-12-31', '支出'),
+            'pivot': lambda: pa.pivot_transactions('category', 'weekday', 'sum', '2024-01-05', '2024-03-30'),
+            'trend_week': lambda: pa.get_trend_report('2024-01-10', '2024-12-20', 'week'),
+            'trend_month': lambda: pa.get_trend_report('2024-01-01', '2024-12-31', 'month'),
+        }
+        results = {}
+        for name, query in queries.items():
+            success, data = query()
+            self.assertTrue(success, (name, data))
+            results[name] = data
+        for name in ('fetch', 'dashboard', 'search'): # 明細裡的編號各後端不同
+            rows = results[name]['range']['transactions'] if name == 'dashboard' else results[name]['transactions']
+            for row in rows:
+                row.pop('id', None)
+        for row in results['page']['transactions']:
+            row.pop('id', None)
+        return results
+
+    def test_every_backend_returns_identical_totals(self):
+        self.load('csv')
+        expected = self.results()
+        income = sum(int(amount.replace('.', '')) for date_str, amount, trans_type, _, _ in self.ROWS
+                     if trans_type == '收入' and '2024-01-10' <= date_str <= '2024-12-20')
+        self.assertEqual(expected['fetch']['total_income'], income / 100)
+        self.assertEqual(expected['range']['total_income'], income / 100)
+        self.assertEqual(expected['dashboard']['range']['total_income'], income / 100)
+        for backend in ('partitioned', 'sqlite'):
+            os.remove('source.csv')
+            self.load(backend)
+            actual = self.results()
+            for name in expected:
+                with self.subTest(backend=backend, query=name):
+                    self.assertEqual(actual[name], expected[name])
+
+
+class SqliteBackendTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        pa.STORAGE_BACKEND = 'sqlite'
+        pa.init_csvs()
+        for row in [('2024-01-09', 300, '支出', '房租', 'rent'), ('2024-01-02', 50.5, '支出', '吃飯', 'lunch'),
+                    ('2024-01-05', 1000, '收入', '薪水', 'pay'), ('2024-02-01', 20, '支出', '', 'misc')]:
+            self.assertTrue(pa.add_transaction_record(*row)[0])
+
+    def descriptions(self, start='2024-01-01', end='2024-12-31'):
+        success, data = pa.fetch_transactions(start, end)
+        self.assertTrue(success, data)
+        return [row['description'] for row in data['transactions']]
+
+    def test_rows_come_back_in_date_order_with_totals(self):
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertEqual([row['description'] for row in data['transactions']], ['lunch', 'pay', 'rent'])
+        self.assertEqual((data['total_income'], data['total_expense'], data['net_balance']), (1000.0, 350.5, 649.5))
+        self.assertTrue(all(row['id'].isdigit() for row in data['transactions']))
+        self.assertEqual(pa.get_category_expense_summary()[1]['category_summary'][-1]['category'], '未分類')
+
+    def test_edit_and_delete_change_the_rows_in_place(self):
+        rows = {row['description']: row['id'] for row in pa.fetch_transactions('2024-01-01', '2024-12-31')[1]['transactions']}
+        self.assertTrue(pa.edit_transaction(rows['rent'], '2024-03-01', 310, '支出', '房租', 'rent')[0])
+        self.assertTrue(pa.delete_transaction(rows['lunch'])[0])
+        self.assertEqual(self.descriptions(), ['pay', 'misc', 'rent'])
+        self.assertFalse(pa.delete_transaction(rows['lunch'])[0])
+        self.assertFalse(pa.edit_transaction('not-an-id', '2024-03-01', 1, '支出', '房租', 'x')[0])
+        self.assertFalse(os.path.exists(pa.TRANSACTIONS_FILE)) # 完全不碰 CSV 檔
+
+    def test_budgets_and_paging(self):
+        self.assertTrue(pa.update_budget('吃飯', 100)[0])
+        self.assertTrue(pa.update_budget('吃飯', 200)[0])
+        self.assertEqual(pa.get_all_budgets(), (True, {'吃飯': 200.0}))
+        usage = pa.get_budget_usage_details('2024-01')[1]
+        self.assertEqual([(item['category'], item['spent'], item['percentage_used']) for item in usage], [('吃飯', 50.5, 25.25)])
+        success, page = pa.fetch_transactions_page('2024-01-01', '2024-12-31', 1, 2, 'amount', True)
+        self.assertTrue(success, page)
+        self.assertEqual([row['description'] for row in page['transactions']], ['rent', 'lunch'])
+        self.assertEqual(page['total_count'], 4)
+
+    def test_migrate_from_csv_keeps_rows_and_budgets(self):
+        pa.STORAGE_BACKEND = 'csv'
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'a'], ['2024-01-04', '12.34', '收入', '', 'b']])
+        with open(pa.BUDGETS_FILE, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['category', 'budget'], ['吃飯', '500']])
+        self.assertTrue(pa.migrate_csv_to_sqlite('migrated.db')[0])
+        self.assertFalse(pa.migrate_csv_to_sqlite('migrated.db')[0]) # 已經有資料就不重複搬
+        pa.STORAGE_BACKEND, pa.SQLITE_FILE = 'sqlite', 'migrated.db'
+        self.assertEqual(self.descriptions(), ['b', 'a'])
+        self.assertEqual(pa.get_all_budgets(), (True, {'吃飯': 500.0}))
+
+
+class TrendReportTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_transactions([['2024-12-24', '1', '支出', '吃飯', 'before start'],
+                                 ['2024-12-29', '10', '支出', '吃飯', 'sunday'],
+                                 ['2024-12-30', '20', '支出', '車錢', 'monday, ISO 2025-W01'],
+                                 ['2024-12-31', '300', '收入', '薪水', 'new year eve'],
+                                 ['2025-01-01', '40', '支出', '吃飯', 'new year'],
+                                 ['2025-01-05', '5', '支出', '車錢', 'sunday'],
+                                 ['2025-01-06', '60', '支出', '吃飯', 'monday']])
+
+    def trend(self, start, end, period):
+        success, data = pa.get_trend_report(start, end, period)
+        self.assertTrue(success, data)
+        return data
+
+    def test_weeks_start_on_monday_and_use_iso_labels(self):
+        data = self.trend('2024-12-25', '2025-01-08', 'week')
+        self.assertEqual(data['labels'], ['2024-W52', '2025-W01', '2025-W02'])
+        self.assertEqual(data['expense'], [10.0, 65.0, 60.0])
+        self.assertEqual(data['income'], [0.0, 300.0, 0.0])
+        self.assertEqual(data['net'], [-10.0, 235.0, -60.0])
+        self.assertEqual(data['top_expense'], [('吃飯', 10.0), ('吃飯', 40.0), ('吃飯', 60.0)])
+
+    def test_year_and_month_boundaries(self):
+        data = self.trend('2024-12-25', '2025-01-08', 'year')
+        self.assertEqual((data['labels'], data['expense'], data['income']), (['2024', '2025'], [30.0, 105.0], [300.0, 0.0]))
+        data = self.trend('2024-12-30', '2025-01-01', 'month')
+        self.assertEqual((data['labels'], data['expense']), (['2024-12', '2025-01'], [20.0, 40.0]))
+        series = {(item['category'], item['type']): item['values'] for item in data['series']}
+        self.assertEqual(series, {('車錢', '支出'): [20.0, 0.0], ('吃飯', '支出'): [0.0, 40.0], ('薪水', '收入'): [300.0, 0.0]})
+
+    def test_days_without_transactions_are_zero(self):
+        data = self.trend('2025-01-04', '2025-01-06', 'day')
+        self.assertEqual(data['labels'], ['2025-01-04', '2025-01-05', '2025-01-06'])
+        self.assertEqual(data['expense'], [0.0, 5.0, 60.0])
+        self.assertEqual(data['top_expense'], [None, ('車錢', 5.0), ('吃飯', 60.0)])
+
+    def test_bad_period_or_range(self):
+        self.assertFalse(pa.get_trend_report('2025-01-01', '2025-01-31', 'hour')[0])
+        self.assertFalse(pa.get_trend_report('2025-02-01', '2025-01-31', 'day')[0])
+
+
+class GroupByTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        # 2024-01-01 是星期一
+        self.write_transactions([['2024-01-01', '10', '支出', '吃飯', 'lunch box'],
+                                 ['2024-01-02', '30', '支出', '吃飯', 'dinner'],
+                                 ['2024-01-08', '25.5', '支出', '', 'lunch set'],
+                                 ['2024-01-31', '1000', '收入', '薪水', 'pay'],
+                                 ['2024-02-01', '7', '支出', '吃飯', 'lunch'],
+                                 ['2024-02-29', '3', '支出', '車錢', 'bus']])
+
+    def group(self, *args, **kwargs):
+        success, data = pa.group_transactions(*args, **kwargs)
+        self.assertTrue(success, data)
+        return data
+
+    def test_rollup_and_scan_paths_agree(self):
+        # 整月、只要總額與筆數時讀月彙總；要最大值就得走欄式檢視
+        from_rollups = self.group(['category', 'month'], ['sum', 'count'], '2024-01-01', '2024-02-29', '支出')
+        scanned = self.group(['category', 'month'], ['sum', 'count', 'max'], '2024-01-01', '2024-02-29', '支出')
+        self.assertEqual(from_rollups, [{key: value for key, value in item.items() if key != 'max'} for item in scanned])
+        self.assertEqual(scanned, [
+            {'category': '吃飯', 'month': '2024-01', 'sum': 40.0, 'count': 2, 'max': 30.0},
+            {'category': '吃飯', 'month': '2024-02', 'sum': 7.0, 'count': 1, 'max': 7.0},
+            {'category': '未分類', 'month': '2024-01', 'sum': 25.5, 'count': 1, 'max': 25.5},
+            {'category': '車錢', 'month': '2024-02', 'sum': 3.0, 'count': 1, 'max': 3.0}])
+
+    def test_weekday_keyword_and_measures(self):
+        self.assertEqual(self.group(['weekday'], ['count', 'min'], '2024-01-01', '2024-01-31', '支出'),
+                         [{'weekday': 0, 'count': 2, 'min': 10.0}, {'weekday': 1, 'count': 1, 'min': 30.0}])
+        by_keyword = {item['keyword']: (item['sum'], item['mean']) for item in self.group(['keyword'], ['sum', 'mean'], trans_type='支出')}
+        self.assertEqual(sorted(by_keyword), ['bus', 'dinner', 'lunch'])
+        self.assertEqual(by_keyword['lunch'][0], 42.5)
+        self.assertAlmostEqual(by_keyword['lunch'][1], 42.5 / 3)
+        self.assertEqual(self.group([], ['sum', 'count'], '2024-01-02', '2024-01-31'), [{'sum': 1055.5, 'count': 3}])
+        self.assertEqual(self.group(['type'], ['count'], '2025-01-01', '2025-12-31'), [])
+
+    def test_unknown_names_are_rejected(self):
+        self.assertFalse(pa.group_transactions(['colour'])[0])
+        self.assertFalse(pa.group_transactions(['category'], ['median'])[0])
+        self.assertFalse(pa.pivot_transactions('category', 'colour')[0])
+
+    def test_pivot_fills_missing_cells(self):
+        success, table = pa.pivot_transactions('category', 'month', trans_type='支出')
+        self.assertTrue(success, table)
+        self.assertEqual(table, {'rows': ['吃飯', '未分類', '車錢'], 'columns': ['2024-01', '2024-02'],
+                                 'cells': [[40.0, 7.0], [25.5, 0], [0, 3.0]]})
+        success, table = pa.pivot_transactions('category', 'month', 'max', trans_type='支出')
+        self.assertEqual(table['cells'], [[30.0, 7.0], [25.5, None], [None, 3.0]])
+
+
+class QueryCacheTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch']] * 20)
+
+    def total(self):
+        success, data = pa.get_category_expense_summary()
+        self.assertTrue(success, data)
+        return data['total_expenses']
+
+    def test_repeated_query_is_served_from_cache(self):
+        first = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertIs(pa.fetch_transactions('2024-01-01', '2024-01-31'), first)
+        stats = pa.get_query_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        with mock.patch.object(pa, 'QUERY_CACHE_MAX_BYTES', 0):
+            self.assertIsNot(pa.fetch_transactions('2024-01-01', '2024-01-31'), first)
+
+    def test_writes_through_the_api_invalidate(self):
+        self.assertEqual(self.total(), 2000.0)
+        self.assertTrue(pa.add_transaction_record('2024-01-06', 5, '支出', '吃飯', 'x')[0])
+        self.assertEqual(self.total(), 2005.0)
+        transaction_id = pa.fetch_transactions('2024-01-06', '2024-01-06')[1]['transactions'][0]['id']
+        self.assertTrue(pa.delete_transaction(transaction_id)[0])
+        self.assertEqual(self.total(), 2000.0)
+        self.assertEqual(pa.get_budget_usage_details('2024-01'), (True, []))
+        self.assertTrue(pa.update_budget('吃飯', 4000)[0])
+        self.assertEqual(pa.get_budget_usage_details('2024-01')[1][0]['percentage_used'], 50.0)
+
+    def test_direct_edits_to_the_file_invalidate(self):
+        self.assertEqual(self.total(), 2000.0)
+        # 另一個程式把第一筆改成 900：大小不變，只有修改時間變了
+        self.write_transactions([['2024-01-05', '900', '支出', '吃飯', 'lunch']] + [['2024-01-05', '100', '支出', '吃飯', 'lunch']] * 19)
+        self.touch_later(pa.TRANSACTIONS_FILE)
+        self.assertEqual(self.total(), 2800.0)
+        with open(pa.TRANSACTIONS_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['2024-01-07', '1', '支出', '吃飯', 'appended'])
+        self.assertEqual(self.total(), 2801.0)
+
+    def test_direct_inserts_into_sqlite_invalidate(self):
+        pa.STORAGE_BACKEND = 'sqlite'
+        pa.init_csvs()
+        self.assertTrue(pa.add_transaction_record('2024-01-05', 100, '支出', '吃飯', 'lunch')[0])
+        self.assertEqual(self.total(), 100.0)
+        with contextlib.closing(pa.sqlite3.connect(pa.SQLITE_FILE)) as conn, conn:
+            conn.execute("INSERT INTO transactions (date, amount, type, category, description) "
+                         "VALUES ('2024-01-06', 23, '支出', '吃飯', 'other program')")
+        self.assertEqual(self.total(), 123.0)
+
+    def test_least_recently_used_results_are_evicted(self):
+        ranges = [('2024-01-01', f'2024-01-{day:02d}') for day in (10, 11, 12, 13, 14)]
+        first = pa.fetch_transactions(*ranges[0])
+        size = pa.get_query_cache_stats()['bytes']
+        pa.clear_query_cache()
+        with mock.patch.object(pa, 'QUERY_CACHE_MAX_BYTES', size * 4 + size // 2): # 放得下四個結果
+            first = pa.fetch_transactions(*ranges[0])
+            for start, end in ranges[1:4]:
+                pa.fetch_transactions(start, end)
+            self.assertIs(pa.fetch_transactions(*ranges[0]), first) # 用過一次，變成最近使用的
+            pa.fetch_transactions(*ranges[4])
+            stats = pa.get_query_cache_stats()
+            self.assertEqual((stats['entries'], stats['evictions']), (4, 1))
+            self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+            self.assertIs(pa.fetch_transactions(*ranges[0]), first)
+            self.assertEqual(pa.get_query_cache_stats()['hits'], 2)
+            # 被擠掉的是最久沒用的第二個查詢
+            pa.fetch_transactions(*ranges[1])
+            self.assertEqual(pa.get_query_cache_stats()['misses'], 6)
+
+    def test_failures_and_oversized_results_are_not_cached(self):
+        self.assertFalse(pa.fetch_transactions('2024-02-30', '2024-03-01')[0])
+        self.assertEqual(pa.get_query_cache_stats()['entries'], 0)
+        with mock.patch.object(pa, 'QUERY_CACHE_MAX_BYTES', 1000):
+            self.assertTrue(pa.fetch_transactions('2024-01-01', '2024-01-31')[0])
+            self.assertEqual(pa.get_query_cache_stats()['entries'], 0)
+
+
+class SnapshotTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch'],
+                                 ['2024-01-20', '3000', '收入', '薪水', 'pay'],
+                                 ['2024-02-03', '40.5', '支出', '交通', 'bus']])
+        self.expected = self.report()
+        success, message = pa.save_ledger_snapshot()
+        self.assertTrue(success, message)
+        self.assertTrue(os.path.exists('transactions_snapshot.bin'))
+
+    @staticmethod
+    def report():
+        return (pa.fetch_transactions('2024-01-01', '2024-12-31'), pa.get_category_expense_summary(),
+                pa.get_trend_report('2024-01-01', '2024-12-31', 'month'))
+
+    def load(self):
+        """模擬重新啟動：清掉已載入的帳本後載入快照，返回有沒有用上快照。"""
+        self._reset_caches()
+        with self.quiet():
+            success, message = pa.load_ledger_snapshot()
+        self.assertTrue(success, message)
+        return message.startswith('已從快照載入 1 個')
+
+    def test_restart_from_snapshot_gives_same_results(self):
+        self.assertTrue(self.load())
+        self.assertEqual(self.report(), self.expected)
+        self.assertEqual(pa.save_ledger_snapshot(), (True, "帳本快照已儲存（更新了 0 個檔案）。")) # 還是最新的，不重寫
+
+    def test_rows_and_edits_after_snapshot_are_read_on_top(self):
+        self.assertTrue(pa.add_transaction_record('2024-02-10', 9.5, '支出', '交通', 'taxi')[0])
+        transaction_id = self.expected[0][1]['transactions'][0]['id']
+        self.assertTrue(pa.edit_transaction(transaction_id, '2024-01-05', 120, '支出', '吃飯', 'lunch')[0])
+        expected = self.report()
+        self.assertEqual(expected[1][1]['total_expenses'], 170.0)
+        self.assertTrue(self.load())
+        self.assertEqual(self.report(), expected)
+
+    def test_rewritten_file_invalidates_snapshot(self):
+        # 同樣大小、只改一個數字：要靠前段的雜湊才看得出來
+        self.write_transactions([['2024-01-05', '900', '支出', '吃飯', 'lunch'],
+                                 ['2024-01-20', '3000', '收入', '薪水', 'pay'],
+                                 ['2024-02-03', '40.5', '支出', '交通', 'bus']])
+        self.assertFalse(self.load())
+        self.assertEqual(self.report()[1][1]['total_expenses'], 940.5)
+
+    def test_truncated_file_invalidates_snapshot(self):
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch']])
+        self.assertFalse(self.load())
+        self.assertEqual(self.report()[1][1]['total_expenses'], 100.0)
+
+    def test_unusable_snapshots_fall_back_to_parsing(self):
+        with open('transactions_snapshot.bin', 'rb') as f:
+            header, payload = f.read().split(b'\n', 1)
+        for name, content in (('other format', header.replace(b'"format": %d' % pa.SNAPSHOT_FORMAT, b'"format": 1') + b'\n' + payload),
+                              ('truncated payload', header + b'\n' + payload[:len(payload) // 2]),
+                              ('garbage', b'not a snapshot')):
+            with self.subTest(name):
+                with open('transactions_snapshot.bin', 'wb') as f:
+                    f.write(content)
+                self.assertFalse(self.load())
+                self.assertEqual(self.report(), self.expected)
+
+    def test_partitioned_ledger_snapshots_each_month(self):
+        self.assertTrue(pa.migrate_csv_to_partitions()[0])
+        pa.STORAGE_BACKEND = 'partitioned'
+        expected = self.report()
+        self.assertEqual(pa.save_ledger_snapshot(), (True, "帳本快照已儲存（更新了 2 個檔案）。"))
+        self._reset_caches()
+        self.assertEqual(pa.load_ledger_snapshot(), (True, "已從快照載入 2 個帳本檔（共 2 個）。"))
+        self.assertEqual(self.report(), expected)
+
+
+class ExportTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'lunch'],
+                                 ['2024-01-06', '200', '支出', '車錢', 'taxi']])
+
+    def test_export_writes_all_rows(self):
+        success, message = pa.export_transactions_to_csv('2024-01-01', '2024-01-31', 'report.csv')
+        self.assertTrue(success, message)
+        with open('report.csv', newline='', encoding='utf-8') as f:
+            self.assertEqual([row['description'] for row in csv.DictReader(f)], ['lunch', 'taxi'])
+        self.assertFalse(os.path.exists('report.csv.tmp'))
+
+    def test_cancelled_export_leaves_no_partial_file(self):
+        with open('report.csv', 'w', encoding='utf-8') as f:
+            f.write('old report\n')
+        original = pa.CsvStorage.iter_transactions_between
+
+        def cancelled_midway(storage, *args, **kwargs):
+            for i, item in enumerate(original(storage, *args, **kwargs)):
+                if i == 1:
+                    raise pa.OperationCancelled()
+                yield item
+
+        with mock.patch.object(pa.CsvStorage, 'iter_transactions_between', cancelled_midway), \
+                self.assertRaises(pa.OperationCancelled):
+            pa.export_transactions_to_csv('2024-01-01', '2024-01-31', 'report.csv')
+        with open('report.csv', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'old report\n')
+        self.assertFalse(os.path.exists('report.csv.tmp'))
+
+
+
+class ParallelScanTest(LedgerTestCase):
+    def fetch_both_ways(self):
+        """同一個查詢分別用逐筆解析與平行掃描跑一次。"""
+        serial = pa.fetch_transactions('2024-01-01', '2024-12-31')
+        self._reset_caches()
+        with mock.patch.object(pa, 'PARALLEL_SCAN_WORKERS', 2), mock.patch.object(pa, 'PARALLEL_SCAN_MIN_BYTES', 0):
+            parallel = pa.fetch_transactions('2024-01-01', '2024-12-31')
+        return serial, parallel
+
+    def test_ids_match_engine_for_files_without_id_column(self):
+        self.write_transactions([[f'2024-{month:02d}-0{day}', str(month * 10 + day), '支出', '吃飯', f'row {month}-{day}']
+                                 for month in range(1, 13) for day in range(1, 8)])
+        records = pa.parallel_scan(pa.TRANSACTIONS_FILE, (pa.datetime(2024, 1, 1), pa.datetime(2024, 12, 31)), workers=2)['records']
+        self.assertEqual([record.id for record in records], [f'r{n}' for n in range(1, 85)])
+        serial, parallel = self.fetch_both_ways()
+        self.assertEqual(serial, parallel)
+        self.assertTrue(pa.edit_transaction(parallel[1]['transactions'][3]['id'], '2024-01-04', 1, '支出', '吃飯', 'x')[0])
+
+    def test_rows_split_inside_quotes_fall_back_to_serial(self):
+        self.write_transactions([[f'2024-03-{day:02d}', '10', '支出', '吃飯', 'multi\nline, note'] for day in range(1, 29)])
+        self.assertIsNone(pa.parallel_scan(pa.TRANSACTIONS_FILE, (pa.datetime(2024, 1, 1), pa.datetime(2024, 12, 31)), workers=2))
+        serial, parallel = self.fetch_both_ways()
+        self.assertEqual(serial, parallel)
+        self.assertEqual({row['description'] for row in parallel[1]['transactions']}, {'multi\nline, note'})
+
+    def test_cold_category_summary_uses_parallel_scan(self):
+        self.write_transactions([[f'2024-{month:02d}-0{day}', f'{month}.{day}5', '支出' if day % 3 else '收入',
+                                  ['吃飯', '車錢', ''][day % 3], 'x'] for month in range(1, 13) for day in range(1, 8)])
+        serial = pa.get_category_expense_summary()
+        self._reset_caches()
+        os.remove(pa._rollups_path(pa.TRANSACTIONS_FILE))
+        with mock.patch.object(pa, 'PARALLEL_SCAN_WORKERS', 2), mock.patch.object(pa, 'PARALLEL_SCAN_MIN_BYTES', 0), \
+                mock.patch.object(pa, 'parallel_scan', wraps=pa.parallel_scan) as scan:
+            parallel = pa.get_category_expense_summary()
+            self.assertEqual(scan.call_count, 1)
+            self.assertFalse(pa._ledger_is_loaded(pa.TRANSACTIONS_FILE))
+            pa.clear_query_cache()
+            self.assertEqual(pa.get_category_expense_summary(), parallel) # 重算的彙總已寫回彙總檔
+            self.assertEqual(scan.call_count, 1)
+        self.assertEqual(serial, parallel)
+
+
+
+class WriteBufferTest(LedgerTestCase):
+    def test_failed_flush_is_reported_not_raised(self):
+        pa.init_csvs()
+        pa.update_budget('吃飯', 1000)
+        pa.set_write_buffering(max_rows=50)
+        self.assertTrue(pa.add_transaction_record('2024-01-05', 100, '支出', '吃飯', 'lunch')[0])
+        queries = [
+            (pa.fetch_transactions, ('2024-01-01', '2024-01-31')),
+            (pa.get_range_totals, ('2024-01-01', '2024-01-31')),
+            (pa.fetch_transactions_page, ('2024-01-01', '2024-01-31')),
+            (pa.fetch_transaction_rows, ()),
+            (pa.fetch_latest_transactions, ()),
+            (pa.search_transactions, ('lunch',)),
+            (pa.group_transactions, (['category'],)),
+            (pa.get_trend_report, ('2024-01-01', '2024-01-31')),
+            (pa.get_category_expense_summary, ()),
+            (pa.get_budget_usage_details, ('2024-01',)),
+            (pa.compute_dashboard, ('2024-01-01', '2024-01-31', '2024-01')),
+            (pa.export_transactions_to_csv, ('2024-01-01', '2024-01-31', 'report.csv')),
+            (pa.compact_transactions, ()),
+        ]
+        with mock.patch.object(pa.CsvStorage, 'append_transactions', side_effect=OSError("disk full")):
+            for func, args in queries:
+                with self.subTest(func=func.__name__):
+                    success, message = func(*args)
+                    self.assertFalse(success)
+                    self.assertIn("disk full", message)
+        # 失敗的那筆還在緩衝區，之後寫得進去就照常查得到
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertTrue(success, data)
+        self.assertEqual(data['total_expense'], 100.0)
+
+
+
+class BudgetLogTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        pa.init_csvs()
+
+    def test_reading_budgets_never_rewrites_the_file(self):
+        with open(pa.BUDGETS_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['吃飯', str(n)] for n in range(1, pa.BUDGET_LOG_SLACK + 10)])
+        before = os.stat(pa.BUDGETS_FILE)
+        self.assertEqual(pa.get_all_budgets(), (True, {'吃飯': float(pa.BUDGET_LOG_SLACK + 9)}))
+        after = os.stat(pa.BUDGETS_FILE)
+        self.assertEqual((after.st_size, after.st_mtime_ns, after.st_ino), (before.st_size, before.st_mtime_ns, before.st_ino))
+
+    def test_saving_compacts_without_losing_budgets(self):
+        for n in range(1, pa.BUDGET_LOG_SLACK + 10):
+            self.assertTrue(pa.update_budget('吃飯', n)[0])
+            self.assertTrue(pa.update_budget(f'類別{n % 5}', n)[0])
+        with open(pa.BUDGETS_FILE, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertLessEqual(len(rows), 1 + 6 + pa.BUDGET_LOG_SLACK + 1)
+        expected = {'吃飯': float(pa.BUDGET_LOG_SLACK + 9)}
+        expected.update({f'類別{n % 5}': float(n) for n in range(pa.BUDGET_LOG_SLACK + 5, pa.BUDGET_LOG_SLACK + 10)})
+        self.assertEqual(pa.get_all_budgets(), (True, expected))
+        self.assertEqual([name for name in os.listdir('.') if name.endswith('.tmp')], [])
+
+
+class BudgetAlertTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alerts = []
+        pa.add_budget_alert_listener(self.alerts.append)
+        self.addCleanup(pa.remove_budget_alert_listener, self.alerts.append)
+
+    def spend(self, amount, date_str='2024-03-10', category='吃飯'):
+        self.assertTrue(pa.add_transaction_record(date_str, amount, '支出', category, 'x')[0])
+        return [(alert['category'], alert['month'], alert['level'], alert['spent']) for alert in self.alerts[-1:]]
+
+    def test_each_threshold_alerts_once(self):
+        for backend in ('csv', 'partitioned', 'sqlite'):
+            with self.subTest(backend=backend):
+                self._reset_caches()
+                pa.STORAGE_BACKEND = backend
+                pa.init_csvs()
+                self.assertTrue(pa.update_budget('吃飯', 1000)[0])
+                self.alerts.clear()
+                self.spend(500)
+                self.assertEqual(self.alerts, [])
+                self.spend(399.99) # 89.999% 還不到
+                self.assertEqual(self.alerts, [])
+                self.assertEqual(self.spend(0.01), [('吃飯', '2024-03', 'warning', 900.0)]) # 剛好 90%
+                self.spend(50.01)
+                self.assertEqual(len(self.alerts), 1)
+                self.assertEqual(self.spend(100.01), [('吃飯', '2024-03', 'over', 1050.02)])
+                self.spend(10)
+                self.spend(2000, '2024-04-01') # 別的月份另外算
+                self.spend(2000, category='車錢') # 沒有預算的類別不提醒
+                self.assertEqual([alert['level'] for alert in self.alerts], ['warning', 'over', 'over'])
+                self.assertEqual(self.alerts[-1]['month'], '2024-04')
+
+    def test_buffered_flushes_keep_running_totals(self):
+        pa.init_csvs()
+        self.assertTrue(pa.update_budget('吃飯', 1000)[0])
+        pa.set_write_buffering(max_rows=3)
+        with mock.patch.object(pa, '_category_expenses', wraps=pa._category_expenses) as seed:
+            for i in range(9):
+                self.spend(100)
+                if i % 2:
+                    pa.flush_writes()
+                elif i % 3 == 0:
+                    self.assertTrue(pa.fetch_transactions('2024-03-01', '2024-03-31')[0]) # 查詢也會先寫出緩衝區
+            self.assertEqual(seed.call_count, 1)
+        self.assertEqual([(alert['level'], alert['spent']) for alert in self.alerts], [('warning', 900.0)])
+
+    def test_edits_reload_the_running_totals(self):
+        pa.init_csvs()
+        self.assertTrue(pa.update_budget('吃飯', 1000)[0])
+        self.spend(850)
+        transaction_id = pa.fetch_transactions('2024-03-01', '2024-03-31')[1]['transactions'][0]['id']
+        self.assertTrue(pa.edit_transaction(transaction_id, '2024-03-10', 100, '支出', '吃飯', 'x')[0])
+        self.assertEqual(self.spend(50), [])
+        self.assertEqual(self.spend(750), [('吃飯', '2024-03', 'warning', 900.0)])
+
+
+class PartitionedStorageTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        pa.STORAGE_BACKEND = 'partitioned'
+        pa.init_csvs()
+        for date_str in ('2024-01-05', '2024-02-05', '2024-03-05'):
+            self.assertTrue(pa.add_transaction_record(date_str, 100, '支出', '吃飯', 'lunch')[0])
+
+    def test_version_tracks_direct_edits_to_any_month(self):
+        self.assertEqual(pa.get_category_expense_summary()[1]['total_expenses'], 300.0)
+        storage = pa.get_storage()
+        before = storage.version()
+        self.assertEqual(storage.version(), before)
+        with open(os.path.join(pa.PARTITIONS_DIR, '2024-02.csv'), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['2024-02-06', '50', '支出', '吃飯', 'snack', 'ext1'])
+        self.assertNotEqual(storage.version(), before)
+        self.assertEqual(pa.get_category_expense_summary()[1]['total_expenses'], 350.0) # 快取的舊結果不能再用
+
+    def test_queries_only_open_overlapping_months(self):
+        with mock.patch.object(pa.CsvStorage, 'iter_transactions_between', autospec=True,
+                               side_effect=pa.CsvStorage.iter_transactions_between) as scan:
+            success, data = pa.fetch_transactions('2024-02-01', '2024-02-29')
+        self.assertTrue(success, data)
+        self.assertEqual([row['date'] for row in data['transactions']], ['2024-02-05'])
+        self.assertEqual([os.path.basename(call.args[0].transactions_path) for call in scan.call_args_list], ['2024-02.csv'])
+
+
+class PartitionedAmendTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        pa.STORAGE_BACKEND = 'partitioned'
+        pa.init_csvs()
+        self.assertTrue(pa.add_transaction_record('2024-01-05', 100, '支出', '吃飯', 'lunch')[0])
+        self.transaction_id = pa.fetch_transactions('2024-01-01', '2024-12-31')[1]['transactions'][0]['id']
+
+    def live_rows(self):
+        success, data = pa.fetch_transactions('2024-01-01', '2024-12-31')
+        self.assertTrue(success, data)
+        return [(row['id'], row['date'], row['amount'], row['description']) for row in data['transactions']]
+
+    def test_move_to_another_month_and_back(self):
+        self.assertTrue(pa.edit_transaction(self.transaction_id, '2024-02-05', 100, '支出', '吃飯', 'lunch')[0])
+        self.assertTrue(pa.edit_transaction(self.transaction_id, '2024-01-07', 300, '支出', '吃飯', 'dinner')[0])
+        expected = [(self.transaction_id, '2024-01-07', 300.0, 'dinner')]
+        self.assertEqual(self.live_rows(), expected)
+        self._reset_caches() # 從檔案重新載入也一樣
+        self.assertEqual(self.live_rows(), expected)
+
+        self.assertTrue(pa.compact_transactions()[0])
+        self._reset_caches()
+        self.assertEqual(self.live_rows(), expected)
+        with open(os.path.join(pa.PARTITIONS_DIR, '2024-01.csv'), newline='', encoding='utf-8') as f:
+            self.assertEqual([row['id'] for row in csv.DictReader(f)], [self.transaction_id])
+
+    def test_repeated_moves_keep_one_copy(self):
+        for date_str in ('2024-02-05', '2024-01-06', '2024-02-07', '2024-03-01', '2024-01-09'):
+            self.assertTrue(pa.edit_transaction(self.transaction_id, date_str, 100, '支出', '吃飯', date_str)[0])
+            self.assertEqual(self.live_rows(), [(self.transaction_id, date_str, 100.0, date_str)])
+        self.assertTrue(pa.delete_transaction(self.transaction_id)[0])
+        self.assertEqual(self.live_rows(), [])
+        self.assertTrue(pa.compact_transactions()[0])
+        self._reset_caches()
+        self.assertEqual(self.live_rows(), [])
+
+
+class CompactTest(LedgerTestCase):
+    def test_duplicate_ids_are_written_once(self):
+        fieldnames = ('date', 'amount', 'type', 'category', 'description', 'id')
+        self.write_transactions([['2024-01-05', '100', '支出', '吃飯', 'old', 'x1'],
+                                 ['2024-01-06', '50', '支出', '車錢', 'taxi', 'x2'],
+                                 ['2024-01-07', '300', '支出', '吃飯', 'new', 'x1']], fieldnames)
+        success, data = pa.fetch_transactions('2024-01-01', '2024-01-31')
+        self.assertEqual([row['description'] for row in data['transactions']], ['taxi', 'new'])
+        self.assertEqual(data['total_expense'], 350.0)
+        self.assertTrue(pa.compact_transactions()[0])
+        with open(pa.TRANSACTIONS_FILE, newline='', encoding='utf-8') as f:
+            self.assertEqual([(row['id'], row['description']) for row in csv.DictReader(f)], [('x1', 'new'), ('x2', 'taxi')])
+
+
+class SearchTest(LedgerTestCase):
+    def test_backends_match_the_same_substrings(self):
+        rows = [('2024-01-05', 250, '支出', '交通', 'Uber 回家'),
+                ('2024-01-06', 80, '支出', '吃飯', '午餐便當'),
+                ('2024-02-01', 120, '支出', '吃飯', 'CAFÉ latte')]
+        queries = ['ber', 'UBER', '回家', '餐便', 'afé', 'tte 吃飯', 'uber 便當']
+        results = {}
+        for backend in ('csv', 'partitioned', 'sqlite'):
+            self._reset_caches()
+            pa.STORAGE_BACKEND = backend
+            pa.init_csvs()
+            for row in rows:
+                self.assertTrue(pa.add_transaction_record(*row)[0])
+            for query in queries:
+                success, data = pa.search_transactions(query)
+                self.assertTrue(success, data)
+                results[backend, query] = [row['description'] for row in data['transactions']]
+        expected = {'ber': ['Uber 回家'], 'UBER': ['Uber 回家'], '回家': ['Uber 回家'], '餐便': ['午餐便當'],
+                    'afé': ['CAFÉ latte'], 'tte 吃飯': ['CAFÉ latte'], 'uber 便當': []}
+        for backend in ('csv', 'partitioned', 'sqlite'):
+            for query in queries:
+                with self.subTest(backend=backend, query=query):
+                    self.assertEqual(results[backend, query], expected[query])
+
+
+if __name__ == '__main__':
+    unittest.main()